@@ -0,0 +1,3 @@
+"""
+Building blocks for the FileSolved AI service (ai_service.py)
+"""
@@ -0,0 +1,93 @@
+"""
+Admission control for upstream LLM calls
+
+Each provider gets a fixed number of concurrent upstream slots and a bounded
+wait queue in front of them. Requests that find the queue full are rejected
+immediately (429), and requests that wait longer than the queue deadline are
+shed (503); both carry a Retry-After estimate so callers can back off instead
+of piling up behind a slow upstream.
+"""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a request can't be admitted upstream in time"""
+
+    def __init__(self, message: str, status: int, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limit plus bounded, deadline-limited queue for one provider"""
+
+    def __init__(self, name: str, concurrency: int = 16, max_queue: int = 64,
+                 queue_timeout: float = 10):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Exponentially weighted average of how long a slot is held
+        self.avg_service_time = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new request"""
+        backlog = (self.waiting + 1) / self.concurrency
+        return max(1, math.ceil(backlog * self.avg_service_time))
+
+    def has_spare(self) -> bool:
+        """Whether a slot is free right now with nobody queued for it"""
+        return self.in_flight < self.concurrency and self.waiting == 0
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold an upstream slot for the duration of the block"""
+        if self.in_flight >= self.concurrency and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f'{self.name} queue is full', 429, self.retry_after())
+
+        self.waiting += 1
+        try:
+            async with asyncio.timeout(self.queue_timeout if self.queue_timeout > 0 else None):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self.timed_out += 1
+            raise Overloaded(f'Timed out waiting for {self.name} capacity', 503,
+                             self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            elapsed = time.monotonic() - started
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'maxQueue': self.max_queue,
+            'queueTimeout': self.queue_timeout,
+            'inFlight': self.in_flight,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timedOut': self.timed_out,
+            'avgServiceTime': round(self.avg_service_time, 3),
+        }
@@ -0,0 +1,232 @@
+"""
+Near-duplicate answer cache for opening chat messages
+
+New chat sessions mostly open with the same few situations, phrased slightly
+differently. Messages are normalised and broken into character n-grams;
+a MinHash signature with LSH banding finds likely matches in constant time,
+and the best candidate is accepted if the exact n-gram Jaccard similarity
+clears the threshold. Entries come from a curated seed file, whose answers
+never expire, and optionally from live first turns. Learning is off by
+default because a first reply can be personal; when on, a message is only
+learned once enough distinct sessions have opened with it, and messages
+carrying digits or names are never learned.
+"""
+
+import hashlib
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+
+# Modulus for the MinHash permutations (a Mersenne prime above 2^61)
+MERSENNE_61 = (1 << 61) - 1
+
+NON_WORD = re.compile(r"[^a-z0-9 ]+")
+SPACES = re.compile(r'\s+')
+DIGIT = re.compile(r'\d')
+# A capitalised word that doesn't start a sentence, e.g. a name or street
+NAME = re.compile(r"(?<![.!?]\s)(?<!^)\b(?!I\b|I')[A-Z][a-z]+")
+
+
+def normalise(text: str) -> str:
+    """Lowercase, drop punctuation (so won't == wont) and collapse whitespace"""
+    text = text.lower().replace('’', "'").replace("'", '')
+    return SPACES.sub(' ', NON_WORD.sub(' ', text)).strip()
+
+
+def shingles(text: str, n: int = 3) -> frozenset:
+    """Character n-grams of normalised text, padded so short words still count"""
+    padded = f' {text} '
+    if len(padded) <= n:
+        return frozenset([padded])
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def looks_personal(message: str) -> bool:
+    """Whether a message mentions numbers (amounts, dates, addresses) or names"""
+    message = message.strip()
+    return bool(DIGIT.search(message) or NAME.search(message))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """MinHash signatures from num_perm seeded universal hash functions"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_61), rng.randrange(0, MERSENNE_61))
+                             for _ in range(num_perm)]
+
+    def signature(self, grams: frozenset) -> tuple:
+        hashes = [int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for gram in grams]
+        return tuple(min((a * h + b) % MERSENNE_61 for h in hashes)
+                     for a, b in self.permutations)
+
+
+class AnswerEntry:
+    __slots__ = ('text', 'grams', 'bands', 'answer', 'created', 'seeded', 'hits')
+
+    def __init__(self, text, grams, bands, answer, created, seeded):
+        self.text = text
+        self.grams = grams
+        self.bands = bands
+        self.answer = answer
+        self.created = created
+        self.seeded = seeded
+        self.hits = 0
+
+
+class AnswerCache:
+    """MinHash/LSH index of opening messages and their answers"""
+
+    def __init__(self, threshold: float = 0.8, ttl: float = 86400, max_entries: int = 512,
+                 max_chars: int = 300, learn: bool = False, learn_min_sessions: int = 3,
+                 ngram: int = 3, num_perm: int = 64, bands: int = 16, clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_chars = max_chars
+        self.learn_enabled = learn
+        self.learn_min_sessions = max(1, learn_min_sessions)
+        self.ngram = ngram
+        self.bands = max(1, min(bands, num_perm))
+        self.rows = num_perm // self.bands
+        self.hasher = MinHasher(self.bands * self.rows)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._buckets = {}
+        # Messages seen from too few sessions to learn yet: text -> session ids
+        self._pending = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, grams: frozenset) -> list:
+        signature = self.hasher.signature(grams)
+        return [(band, signature[band * self.rows:(band + 1) * self.rows])
+                for band in range(self.bands)]
+
+    def _expired(self, entry: AnswerEntry) -> bool:
+        return not entry.seeded and self.ttl > 0 and self._clock() - entry.created > self.ttl
+
+    def lookup(self, message: str):
+        """Return (answer, similarity) for the closest cached message, or None"""
+        text = normalise(message)
+        if not text or len(text) > self.max_chars:
+            self.misses += 1
+            return None
+
+        entry = self._entries.get(text)
+        similarity = 1.0
+        if entry is None:
+            grams = shingles(text, self.ngram)
+            candidates = set()
+            for key in self._band_keys(grams):
+                candidates.update(self._buckets.get(key, ()))
+            best = None
+            for candidate in candidates:
+                score = jaccard(grams, self._entries[candidate].grams)
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (candidate, score)
+            if best is not None:
+                entry, similarity = self._entries[best[0]], best[1]
+
+        if entry is None or self._expired(entry):
+            if entry is not None:
+                self._remove(entry.text)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(entry.text)
+        entry.hits += 1
+        self.hits += 1
+        return entry.answer, similarity
+
+    def add(self, message: str, answer: str, seeded: bool = False) -> bool:
+        text = normalise(message)
+        if not text or not answer or (not seeded and len(text) > self.max_chars):
+            return False
+        existing = self._entries.get(text)
+        if existing is not None:
+            # Live traffic never replaces a curated answer
+            if existing.seeded and not seeded:
+                return False
+            self._remove(text)
+        grams = shingles(text, self.ngram)
+        bands = self._band_keys(grams)
+        self._entries[text] = AnswerEntry(text, grams, bands, answer, self._clock(), seeded)
+        for key in bands:
+            self._buckets.setdefault(key, set()).add(text)
+        self._enforce_limit()
+        return True
+
+    def learn(self, message: str, answer: str, session_id: str):
+        """Remember a live first-turn answer once enough sessions have opened with it"""
+        if not self.learn_enabled or looks_personal(message):
+            return
+        text = normalise(message)
+        if not text or len(text) > self.max_chars or text in self._entries:
+            return
+        seen = self._pending.pop(text, set())
+        seen.add(session_id)
+        if len(seen) < self.learn_min_sessions:
+            self._pending[text] = seen
+            while len(self._pending) > self.max_entries:
+                self._pending.popitem(last=False)
+            return
+        if self.add(message, answer):
+            self.learned += 1
+
+    def load(self, path: str) -> int:
+        """Seed curated answers from {"answers": [{"message", "response"}]}"""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return sum(self.add(item['message'], item['response'], seeded=True)
+                   for item in config.get('answers', []))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'seeded': sum(1 for entry in self._entries.values() if entry.seeded),
+            'maxEntries': self.max_entries,
+            'threshold': self.threshold,
+            'ttl': self.ttl,
+            'learn': self.learn_enabled,
+            'learnMinSessions': self.learn_min_sessions,
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'learned': self.learned,
+            'evictions': self.evictions,
+        }
+
+    def _enforce_limit(self):
+        # Least recently used learned entries go first; seeded ones are kept
+        while len(self._entries) > self.max_entries:
+            victim = next((text for text, entry in self._entries.items() if not entry.seeded), None)
+            if victim is None:
+                break
+            self._remove(victim)
+            self.evictions += 1
+
+    def _remove(self, text: str):
+        entry = self._entries.pop(text)
+        for key in entry.bands:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(text)
+                if not bucket:
+                    del self._buckets[key]
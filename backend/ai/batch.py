@@ -0,0 +1,29 @@
+"""
+Bounded-concurrency fan-out for batch requests
+"""
+
+import asyncio
+
+
+async def fan_out(items: list, worker, concurrency: int):
+    """Run worker(item) for every item with at most `concurrency` in flight
+    
+    Yields (index, result, error) tuples in completion order; exactly one of
+    result/error is set. Remaining work is cancelled if the consumer stops early.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index, item):
+        async with semaphore:
+            try:
+                return index, await worker(item), None
+            except Exception as e:
+                return index, None, e
+
+    tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,204 @@
+"""
+Token accounting and budgets
+
+Every upstream turn is charged to its chat session and to the caller that
+sent it (the Node API passes the user ID or client IP). A session may spend
+at most its lifetime budget, and a caller at most its per-minute budget over
+a sliding window, so one runaway conversation or scripted client can't use
+up the upstream capacity everyone shares. Prompt tokens are charged before
+the call goes out, so concurrent requests can't all slip under the limit
+together; completion tokens are charged when the reply arrives.
+"""
+
+import math
+import time
+from collections import OrderedDict, deque
+
+
+class BudgetExceeded(Exception):
+    """Raised when a turn would take a session or caller over its token budget"""
+
+    def __init__(self, message: str, scope: str, limit: int, used: int, retry_after: int = None):
+        super().__init__(message)
+        self.scope = scope
+        self.limit = limit
+        self.used = used
+        self.retry_after = retry_after
+
+
+class Usage:
+    """Tokens used while handling one request, across all of its upstream calls"""
+
+    __slots__ = ('caller', 'prompt_tokens', 'completion_tokens', 'calls', 'model')
+
+    def __init__(self, caller: str = None):
+        self.caller = caller
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self.model = None
+
+    def add(self, prompt_tokens: int, completion_tokens: int, model: str = None):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.calls += 1
+        self.model = model or self.model
+
+    def as_dict(self) -> dict:
+        return {
+            'promptTokens': self.prompt_tokens,
+            'completionTokens': self.completion_tokens,
+            'totalTokens': self.prompt_tokens + self.completion_tokens,
+            'upstreamCalls': self.calls,
+            'model': self.model,
+        }
+
+
+class CallerUsage:
+    __slots__ = ('window', 'window_tokens', 'prompt_tokens', 'completion_tokens', 'turns', 'rejected')
+
+    def __init__(self):
+        self.window = deque()
+        self.window_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.turns = 0
+        self.rejected = 0
+
+
+class TokenLedger:
+    """Running token totals per session and caller, with budget checks"""
+
+    def __init__(self, session_budget: int = 0, caller_per_minute: int = 0, window: float = 60,
+                 max_sessions: int = 10000, max_callers: int = 10000, clock=time.monotonic):
+        self.session_budget = max(0, session_budget)
+        self.caller_per_minute = max(0, caller_per_minute)
+        self.window = window
+        self.max_sessions = max(1, max_sessions)
+        self.max_callers = max(1, max_callers)
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._callers = OrderedDict()
+        self.rejected = {'session': 0, 'caller': 0}
+
+    def session_tokens(self, session_id: str) -> int:
+        totals = self._sessions.get(session_id)
+        return sum(totals) if totals else 0
+
+    def _session(self, session_id: str) -> list:
+        totals = self._sessions.get(session_id)
+        if totals is None:
+            totals = self._sessions[session_id] = [0, 0]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return totals
+
+    def _caller(self, caller: str) -> CallerUsage:
+        usage = self._callers.get(caller)
+        if usage is None:
+            usage = self._callers[caller] = CallerUsage()
+            while len(self._callers) > self.max_callers:
+                self._callers.popitem(last=False)
+        self._callers.move_to_end(caller)
+        return usage
+
+    def _expire(self, usage: CallerUsage, now: float):
+        while usage.window and usage.window[0][0] <= now - self.window:
+            usage.window_tokens -= usage.window.popleft()[1]
+
+    def _retry_after(self, usage: CallerUsage, tokens: int, now: float) -> int:
+        """Seconds until enough of the window has expired for tokens to fit"""
+        excess = usage.window_tokens + tokens - self.caller_per_minute
+        for started, spent in usage.window:
+            excess -= spent
+            if excess <= 0:
+                return max(1, math.ceil(started + self.window - now))
+        return max(1, math.ceil(self.window))
+
+    def admit(self, session_id: str, caller: str, prompt_tokens: int):
+        """Check both budgets for a turn and charge its prompt, or raise BudgetExceeded
+
+        session_id is None for one-shot calls, which only count against the caller.
+        """
+        if session_id is not None and self.session_budget:
+            used = self.session_tokens(session_id)
+            if used + prompt_tokens > self.session_budget:
+                self.rejected['session'] += 1
+                raise BudgetExceeded(
+                    f"Session token budget exhausted ({used} of {self.session_budget} tokens used); "
+                    f"start a new session to continue", 'session', self.session_budget, used)
+
+        if caller is not None:
+            usage = self._caller(caller)
+            now = self._clock()
+            self._expire(usage, now)
+            if self.caller_per_minute and usage.window_tokens + prompt_tokens > self.caller_per_minute:
+                usage.rejected += 1
+                self.rejected['caller'] += 1
+                retry_after = self._retry_after(usage, prompt_tokens, now)
+                raise BudgetExceeded(
+                    f"Token rate limit exceeded ({usage.window_tokens} of {self.caller_per_minute} "
+                    f"tokens used in the last {self.window:g}s); retry in {retry_after}s",
+                    'caller', self.caller_per_minute, usage.window_tokens, retry_after)
+
+        self._charge(session_id, caller, prompt_tokens, 0)
+
+    def complete(self, session_id: str, caller: str, completion_tokens: int):
+        """Charge a finished turn's completion tokens"""
+        self._charge(session_id, caller, 0, completion_tokens)
+        if caller is not None:
+            self._caller(caller).turns += 1
+
+    def refund(self, session_id: str, caller: str, prompt_tokens: int):
+        """Take back an admitted prompt that was never sent (or is re-admitted elsewhere)"""
+        if session_id is not None and session_id in self._sessions:
+            totals = self._sessions[session_id]
+            totals[0] = max(0, totals[0] - prompt_tokens)
+        if caller is not None and caller in self._callers:
+            usage = self._callers[caller]
+            usage.prompt_tokens = max(0, usage.prompt_tokens - prompt_tokens)
+            # Newest window entries first, so the refund leaves with the charge it undoes
+            remaining = prompt_tokens
+            while remaining and usage.window:
+                started, spent = usage.window.pop()
+                taken = min(spent, remaining)
+                remaining -= taken
+                usage.window_tokens -= taken
+                if spent > taken:
+                    usage.window.append((started, spent - taken))
+
+    def _charge(self, session_id: str, caller: str, prompt_tokens: int, completion_tokens: int):
+        if session_id is not None:
+            totals = self._session(session_id)
+            totals[0] += prompt_tokens
+            totals[1] += completion_tokens
+        if caller is not None:
+            usage = self._caller(caller)
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+            tokens = prompt_tokens + completion_tokens
+            if tokens:
+                usage.window.append((self._clock(), tokens))
+                usage.window_tokens += tokens
+
+    def stats(self, top: int = 10) -> dict:
+        now = self._clock()
+        for usage in self._callers.values():
+            self._expire(usage, now)
+        busiest = sorted(self._callers.items(), key=lambda item: item[1].window_tokens, reverse=True)
+        return {
+            'sessionBudget': self.session_budget,
+            'callerTokensPerMinute': self.caller_per_minute,
+            'sessions': len(self._sessions),
+            'callers': len(self._callers),
+            'rejected': dict(self.rejected),
+            'topCallers': [{
+                'caller': caller,
+                'lastMinuteTokens': usage.window_tokens,
+                'promptTokens': usage.prompt_tokens,
+                'completionTokens': usage.completion_tokens,
+                'turns': usage.turns,
+                'rejected': usage.rejected,
+            } for caller, usage in busiest[:top]],
+        }
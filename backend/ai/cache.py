@@ -0,0 +1,217 @@
+"""
+Content-addressed cache for stateless (one-shot) AI responses
+
+Entries are keyed by a SHA-256 of model, system prompt and message, so the
+same summarize/classify/suggest prompt is only sent upstream once per TTL.
+Lookups go to an in-memory LRU first and then, when a cache directory is
+configured, to an on-disk store that survives restarts. Concurrent misses on
+the same key share a single upstream call.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+
+def cache_key(model: str, system_prompt: str, message: str) -> str:
+    """Hash the inputs that fully determine a one-shot response"""
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, message):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DiskStore:
+    """One JSON file per entry, sharded by the first two hex digits of the key"""
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._files())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def read(self, key: str, ttl: float):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if ttl > 0 and time.time() - entry.get('created', 0) > ttl:
+            self.delete(key)
+            return None
+        return entry.get('response')
+
+    def write(self, key: str, response: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.time(), 'response': response}, f)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        self.total_bytes += os.path.getsize(path) - previous
+        if self.max_bytes > 0 and self.total_bytes > self.max_bytes:
+            self.prune()
+
+    def delete(self, key: str):
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Remove the oldest files until the store is back under 90% of its cap"""
+        target = self.max_bytes * 0.9
+        files = sorted(self._files(), key=lambda item: item[2])
+        self.total_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+
+class ResponseCache:
+    """In-memory LRU with TTL in front of an optional DiskStore"""
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 32 * 1024 * 1024,
+                 ttl: float = 86400, disk: DiskStore = None, clock=time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str):
+        """Return a cached response or None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            created, response = entry
+            if self.ttl <= 0 or self._clock() - created <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self._remove(key)
+
+        if self.disk is not None:
+            response = await asyncio.to_thread(self.disk.read, key, self.ttl)
+            if response is not None:
+                self.disk_hits += 1
+                self._store(key, response)
+                return response
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: str):
+        self._store(key, response)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.write, key, response)
+            except OSError as e:
+                print(f"Response cache write failed: {e}", file=sys.stderr)
+
+    async def get_or_compute(self, key: str, compute):
+        """Return the cached response for key, calling compute() once on a miss"""
+        response = await self.get(key)
+        if response is not None:
+            return response
+
+        pending = self._inflight.get(key)
+        while pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The leading caller disconnected; take over the computation
+                pending = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure isn't logged
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(response)
+        await self.put(key, response)
+        return response
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'bytes': self.total_bytes,
+            'maxEntries': self.max_entries,
+            'maxBytes': self.max_bytes,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'diskHits': self.disk_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hitRate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'diskBytes': self.disk.total_bytes if self.disk is not None else None,
+        }
+
+    def _store(self, key: str, response: str):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (self._clock(), response)
+        self.total_bytes += len(response.encode('utf-8'))
+        while len(self._entries) > self.max_entries or (
+                self.max_bytes > 0 and self.total_bytes > self.max_bytes and len(self._entries) > 1):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, response = self._entries.pop(key)
+        self.total_bytes -= len(response.encode('utf-8'))
@@ -0,0 +1,172 @@
+"""
+Local TF-IDF classifier for the closed-set suggest and classify prompts
+
+Suggest picks services for a described situation and classify picks one of a
+fixed list of document categories. Both are answered from TF-IDF indexes
+built at startup from the services catalog and the shared option list in
+src/config/aiOptions.json; callers fall back to the model when the local
+answer's confidence is below their threshold.
+"""
+
+import json
+import math
+import re
+from collections import Counter
+
+WORD = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can do for from has have he her his i if in into is it its
+me my of on or our she so that the their them they this to was we were what when which who
+will with won t you your not no any all about after before up out over just than then there
+""".split())
+
+# Score a match needs before it counts as fully confident
+STRONG_SCORE = 0.35
+
+# Distinct matched terms needed before a match is trusted; a lone category
+# (nothing else matched, so there is no margin to judge by) needs more
+MIN_TERMS = 2
+LONE_MIN_TERMS = 3
+
+# Ceiling for matches the index can't vouch for: too few terms, or a
+# runner-up matching the very same terms (word order, e.g. pdf to word vs
+# word to pdf, is invisible to it). Kept under the default local threshold
+WEAK_CONFIDENCE = 0.4
+
+# Suggestions padded onto short local answers (the route's old fallback)
+DEFAULT_SUGGESTIONS = ('evidence_builder', 'complaint_generator')
+
+
+def stem(word: str) -> str:
+    """Strip common English suffixes so harass/harassed/harassment match"""
+    for suffix in ('ments', 'ment', 'ing', 'ed', 'es', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    return [stem(word) for word in WORD.findall(text.lower().replace("'", ''))
+            if word not in STOPWORDS]
+
+
+def load_catalog(path: str) -> list:
+    """Enabled services from servicesCatalog.js as {id, name, description, type}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    services = []
+    starts = [match.start() for match in re.finditer(r'\bid:\s*"', source)]
+    for start, end in zip(starts, starts[1:] + [len(source)]):
+        block = source[start:end]
+        fields = dict(re.findall(r'\b(id|name|description|type):\s*"((?:[^"\\]|\\.)*)"', block))
+        if 'id' in fields and re.search(r'\benabled:\s*true', block):
+            services.append(fields)
+    return services
+
+
+def load_options(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class TfidfIndex:
+    """Cosine similarity over L2-normalised TF-IDF vectors with an inverted index"""
+
+    def __init__(self, documents):
+        documents = list(documents)
+        self.ids = [doc_id for doc_id, _ in documents]
+        counts = [Counter(tokenize(text)) for _, text in documents]
+        df = Counter(term for terms in counts for term in terms)
+        total = len(documents)
+        self.idf = {term: math.log((1 + total) / (1 + freq)) + 1 for term, freq in df.items()}
+        self.postings = {}
+        for index, terms in enumerate(counts):
+            vector = self._weigh(terms)
+            for term, weight in vector.items():
+                self.postings.setdefault(term, []).append((index, weight))
+
+    def _weigh(self, terms: Counter) -> dict:
+        vector = {term: (1 + math.log(count)) * self.idf[term]
+                  for term, count in terms.items() if term in self.idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def search(self, text: str, limit: int = 3) -> list:
+        """Best (id, score, matched terms) tuples for text, highest first"""
+        query = self._weigh(Counter(tokenize(text)))
+        scores = Counter()
+        matched = {}
+        for term, weight in query.items():
+            for index, doc_weight in self.postings.get(term, ()):
+                scores[index] += weight * doc_weight
+                matched.setdefault(index, []).append(term)
+        return [(self.ids[index], score, matched[index]) for index, score in scores.most_common(limit)]
+
+
+def confidence(ranked: list, use_margin: bool) -> float:
+    """0-1 confidence from the top score, optionally discounted by a close runner-up
+
+    Weak matches are capped at WEAK_CONFIDENCE whether or not the margin is used.
+    """
+    if not ranked:
+        return 0.0
+    _, top, terms = ranked[0]
+    terms = set(terms)
+    strength = min(1.0, top / STRONG_SCORE)
+    if use_margin:
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        strength *= 0.5 + 0.5 * (1 - second / top)
+    lone = len(ranked) == 1
+    if len(terms) < (LONE_MIN_TERMS if lone else MIN_TERMS):
+        strength = min(strength, WEAK_CONFIDENCE)
+    if not lone and set(ranked[1][2]) == terms:
+        strength = min(strength, WEAK_CONFIDENCE)
+    return strength
+
+
+class LocalClassifier:
+    """Suggest and classify answered locally, with a confidence score"""
+
+    def __init__(self, catalog: list, options: dict):
+        self.reasons = {}
+        suggest_docs = []
+        for option in options.get('suggestOptions', []):
+            self.reasons[option['id']] = option['description']
+            suggest_docs.append((option['id'], f"{option['description']} {option.get('keywords', '')}"))
+        for service in catalog:
+            if service['id'] in self.reasons:
+                continue
+            self.reasons[service['id']] = service.get('description', '').split('. ')[0].rstrip('.')
+            suggest_docs.append((service['id'], ' '.join(
+                service.get(field, '') for field in ('name', 'description', 'type'))))
+        self.suggest_index = TfidfIndex(suggest_docs)
+        self.classify_index = TfidfIndex(
+            (category['id'], f"{category['id'].replace('_', ' ')} {category.get('keywords', '')}")
+            for category in options.get('classifyCategories', []) if category.get('keywords'))
+
+    def suggest(self, situation: str, limit: int = 3, minimum: int = 2):
+        """([{serviceId, reason}], confidence) for a described situation"""
+        ranked = self.suggest_index.search(situation, limit)
+        service_ids = [service_id for service_id, _, _ in ranked]
+        for service_id in DEFAULT_SUGGESTIONS:
+            if len(service_ids) >= minimum:
+                break
+            if service_id not in service_ids and service_id in self.reasons:
+                service_ids.append(service_id)
+        suggestions = [{'serviceId': service_id, 'reason': self.reasons[service_id]}
+                       for service_id in service_ids]
+        return suggestions, confidence(ranked, use_margin=False)
+
+    def classify(self, text: str):
+        """({category, confidence, reasoning}, confidence) for a document preview"""
+        ranked = self.classify_index.search(text[:2000], 2)
+        score = confidence(ranked, use_margin=True)
+        if not ranked:
+            return {'category': 'other', 'confidence': 0.0, 'reasoning': 'No known keywords'}, 0.0
+        category, _, terms = ranked[0]
+        return {
+            'category': category,
+            'confidence': round(score, 2),
+            'reasoning': f"Matched keywords: {', '.join(sorted(set(terms))[:8])}"
+        }, score
@@ -0,0 +1,41 @@
+"""
+Environment helpers for AI service configuration
+"""
+
+import os
+
+
+def env_str(name: str, default: str = '') -> str:
+    """Read a string setting, falling back to default when unset or blank"""
+    value = os.environ.get(name, '').strip()
+    return value or default
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting, ignoring malformed values"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting, ignoring malformed values"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean setting (1/true/yes/on)"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_list(name: str, default: str = '') -> list:
+    """Read a comma separated list setting"""
+    raw = os.environ.get(name, default)
+    return [item.strip() for item in raw.split(',') if item.strip()]
@@ -0,0 +1,185 @@
+"""
+Map-reduce summarization of large documents
+
+The file is memory-mapped and cut into token-sized chunks on paragraph, line
+or word boundaries, so only the chunks currently being summarized are ever
+decoded. Chunks are summarized in parallel with bounded concurrency, then the
+partial summaries are merged in groups, level by level, until one remains.
+Documents are checked first: binary files (PDFs, Office files, images) and
+files over the size or chunk limits are refused before any model call.
+"""
+
+import codecs
+import mmap
+import os
+
+from ai.batch import fan_out
+
+# Rough UTF-8 bytes per token for English prose
+BYTES_PER_TOKEN = 4
+
+# How far back from a hard cut we look for a natural break
+BOUNDARY_WINDOW = 0.1
+
+# Share of undecodable characters above which a file isn't treated as text
+MAX_REPLACEMENT_RATIO = 0.01
+
+# Bytes decoded at a time while checking that a file is text
+SCAN_BLOCK = 1024 * 1024
+
+
+class DocumentError(Exception):
+    """Raised for documents that can't be read or are outside the allowed roots"""
+
+
+class DocumentTooLarge(DocumentError):
+    """Raised for documents over the size or chunk-count limit"""
+
+
+class NotText(DocumentError):
+    """Raised for files that aren't UTF-8 text (PDFs, Office files, images)"""
+
+
+def resolve_document(path: str, roots: list) -> str:
+    """Return the real path of a document, refusing anything outside roots"""
+    real = os.path.realpath(path)
+    for root in roots:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(root + os.sep):
+            if not os.path.isfile(real):
+                raise DocumentError('Document not found')
+            return real
+    raise DocumentError('Document path is not allowed')
+
+
+def _find_break(mm, start: int, end: int) -> int:
+    """Pick a cut point at or before end, preferring paragraph > line > word"""
+    if end >= len(mm):
+        return len(mm)
+    floor = max(start + 1, end - int((end - start) * BOUNDARY_WINDOW))
+    for separator in (b'\n\n', b'\n', b' '):
+        cut = mm.rfind(separator, floor, end)
+        if cut != -1:
+            return cut + len(separator)
+    # No natural break; at least don't split a UTF-8 sequence
+    while end > start + 1 and 0x80 <= mm[end] <= 0xBF:
+        end -= 1
+    return end
+
+
+def chunk_spans(mm, chunk_bytes: int) -> list:
+    """Byte (start, end) spans covering the whole mapping"""
+    spans = []
+    start = 0
+    size = len(mm)
+    while start < size:
+        end = _find_break(mm, start, min(size, start + chunk_bytes))
+        spans.append((start, end))
+        start = end
+    return spans
+
+
+def check_document(path: str, max_bytes: int = 0, max_chunks: int = 0,
+                   chunk_tokens: int = 3000):
+    """Raise DocumentTooLarge or NotText unless the file can be summarized (0 = no limit)"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if max_bytes > 0 and size > max_bytes:
+            raise DocumentTooLarge(f'Document is {size} bytes; the limit is {max_bytes}')
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm.find(b'\x00') != -1:
+                raise NotText('Document is not text')
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            replaced = characters = 0
+            for start in range(0, size, SCAN_BLOCK):
+                text = decoder.decode(mm[start:start + SCAN_BLOCK], final=start + SCAN_BLOCK >= size)
+                replaced += text.count('\ufffd')
+                characters += len(text)
+            if replaced > MAX_REPLACEMENT_RATIO * max(1, characters):
+                raise NotText('Document is not UTF-8 text')
+            if max_chunks > 0:
+                chunks = len(chunk_spans(mm, max(1, chunk_tokens) * BYTES_PER_TOKEN))
+                if chunks > max_chunks:
+                    raise DocumentTooLarge(f'Document would need {chunks} chunks; '
+                                           f'the limit is {max_chunks}')
+
+
+def decode_span(mm, span) -> str:
+    start, end = span
+    return mm[start:end].decode('utf-8', errors='replace').strip()
+
+
+def chunk_prompt(text: str, index: int, total: int, max_words: int) -> str:
+    return (f"This is part {index + 1} of {total} of a document. Summarize the key facts "
+            f"in this part (people, organisations, dates, amounts, obligations and events) "
+            f"in under {max_words} words.\n\n{text}")
+
+
+def merge_prompt(summaries: list, max_words: int) -> str:
+    parts = '\n\n'.join(f"Part {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
+    return (f"These are summaries of consecutive parts of one document. Combine them into "
+            f"a single coherent summary in under {max_words} words, keeping the key facts "
+            f"and their order.\n\n{parts}")
+
+
+def final_prompt(text: str, max_words: int) -> str:
+    return f"Summarize this document in under {max_words} words:\n\n{text}"
+
+
+async def summarize_document(path: str, summarize, max_words: int = 500,
+                             chunk_tokens: int = 3000, concurrency: int = 4,
+                             fan_in: int = 8, chunk_words: int = 200, progress=None) -> dict:
+    """Summarize a document of any size
+
+    `summarize(prompt)` performs one model call and returns its text;
+    `progress(stage, done, total)` is awaited as chunks and merges complete.
+    """
+    fan_in = max(2, fan_in)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {'summary': '', 'chunks': 0, 'levels': 0}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            spans = chunk_spans(mm, max(1, chunk_tokens) * BYTES_PER_TOKEN)
+
+            # Short documents need just the one call
+            if len(spans) == 1:
+                summary = await summarize(final_prompt(decode_span(mm, spans[0]), max_words))
+                if progress:
+                    await progress('map', 1, 1)
+                return {'summary': summary, 'chunks': 1, 'levels': 1}
+
+            async def summarize_chunk(item):
+                index, span = item
+                return await summarize(chunk_prompt(decode_span(mm, span), index, len(spans),
+                                                    chunk_words))
+
+            partials = await _run_level(list(enumerate(spans)), summarize_chunk, concurrency,
+                                        'map', progress)
+
+    levels = 1
+    while len(partials) > 1:
+        groups = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+        words = max_words if len(groups) == 1 else chunk_words
+
+        async def merge_group(group, words=words):
+            return await summarize(merge_prompt(group, words))
+
+        partials = await _run_level(groups, merge_group, concurrency, 'reduce', progress)
+        levels += 1
+
+    return {'summary': partials[0], 'chunks': len(spans), 'levels': levels}
+
+
+async def _run_level(items: list, worker, concurrency: int, stage: str, progress) -> list:
+    results = [None] * len(items)
+    done = 0
+    async for index, result, error in fan_out(items, worker, concurrency):
+        if error is not None:
+            raise error
+        results[index] = result
+        done += 1
+        if progress:
+            await progress(stage, done, len(items))
+    return results
@@ -0,0 +1,71 @@
+"""
+Token-budgeted conversation history compaction
+
+Long chat sessions keep their most recent turns verbatim and fold everything
+older into a rolling summary. The chat is then rebuilt with a system message
+made of the base prompt, the summary and the recent transcript, so the
+prompt sent upstream stays roughly constant no matter how long the session
+has been running.
+"""
+
+from ai.tokens import count_tokens
+
+ROLE_LABELS = {'user': 'User', 'assistant': 'Assistant'}
+
+
+def history_tokens(history: list) -> int:
+    return sum(count_tokens(content) for _, content in history)
+
+
+def split_history(history: list, keep_turns: int):
+    """Split history into (older, recent), keeping the last keep_turns exchanges"""
+    keep = max(0, keep_turns) * 2
+    if keep >= len(history):
+        return [], list(history)
+    if keep == 0:
+        return list(history), []
+    return history[:-keep], history[-keep:]
+
+
+def render_transcript(history: list) -> str:
+    return '\n'.join(f"{ROLE_LABELS.get(role, role)}: {content}" for role, content in history)
+
+
+def summary_prompt(previous_summary: str, turns: list, max_words: int = 200) -> str:
+    """Prompt asking the model to fold turns into the running summary"""
+    parts = [
+        f"Update the running summary of a FileSolved support conversation. "
+        f"Keep every fact the assistant will need later: the user's situation, "
+        f"names, dates, places, documents mentioned, what has been recommended and "
+        f"any open questions. Write plain prose in under {max_words} words."
+    ]
+    if previous_summary:
+        parts.append(f"Current summary:\n{previous_summary}")
+    parts.append(f"New conversation turns:\n{render_transcript(turns)}")
+    parts.append("Reply with the updated summary only.")
+    return '\n\n'.join(parts)
+
+
+def compacted_system_message(base_prompt: str, summary: str, recent: list) -> str:
+    """System message for a chat rebuilt from a summary plus recent turns"""
+    parts = [base_prompt]
+    if summary:
+        parts.append(f"Summary of the conversation so far:\n{summary}")
+    if recent:
+        parts.append(f"Most recent messages (continue from here):\n{render_transcript(recent)}")
+    return '\n\n'.join(parts)
+
+
+class PromptTooLong(Exception):
+    """Raised when a turn can't fit the prompt cap even with no history at all"""
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text from the front so it fits in max_tokens (keeps the newest part)"""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Characters per token is roughly stable within one text
+    ratio = len(text) / max(1, count_tokens(text))
+    return text[-int(max_tokens * ratio):]
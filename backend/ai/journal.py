@@ -0,0 +1,238 @@
+"""
+Durable session journal in SQLite
+
+Chat turns are queued in memory and written in batches by a background task
+on a dedicated thread, so requests never wait on disk. A session missing
+from memory (after a restart, deploy or eviction) is loaded back on its
+next turn and its chat rebuilt from the saved summary and transcript. When
+history compaction folds old turns into the summary, the session's rows are
+rewritten to match, so each conversation stays small on disk. Sessions idle
+longer than the TTL are pruned, and freed pages are given back to the
+filesystem.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    profile TEXT,
+    summary TEXT NOT NULL DEFAULT '',
+    turns INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+"""
+
+
+class SessionJournal:
+    """SQLite-backed record of chat sessions with batched background writes"""
+
+    def __init__(self, path: str, ttl: float = 7 * 86400, flush_interval: float = 0.05):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # One thread owns the connection, so writes and loads never interleave
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-journal')
+        self._conn = None
+        self._pending = []
+        self._wake = asyncio.Event()
+        self._writer = None
+        self.written = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.errors = 0
+        self.loads = 0
+        self.load_misses = 0
+        self.load_seconds = 0.0
+        self.max_load_seconds = 0.0
+        self.pruned = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # Must be set before the first table exists to take effect
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA busy_timeout = 5000')
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def open(self):
+        await self._run(self._open)
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    @property
+    def backlog(self) -> int:
+        """Operations queued but not yet written"""
+        return len(self._pending)
+
+    def _queue(self, op: tuple):
+        self._pending.append(op)
+        self._wake.set()
+
+    def append_turn(self, session_id: str, profile: str, message: str, response: str):
+        """Queue one exchange for writing"""
+        self._queue(('turn', session_id, profile, message, response, time.time()))
+
+    def snapshot(self, session_id: str, profile: str, summary: str, history: list, turns: int):
+        """Queue a rewrite of a session after its history was compacted"""
+        self._queue(('snapshot', session_id, profile, summary, list(history), turns, time.time()))
+
+    def delete(self, session_id: str):
+        self._queue(('delete', session_id))
+
+    async def _write_loop(self):
+        while True:
+            await self._wake.wait()
+            # Let a burst of turns collect into one transaction
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far"""
+        self._wake.clear()
+        if not self._pending or self._conn is None:
+            return
+        batch, self._pending = self._pending, []
+        started = time.perf_counter()
+        try:
+            await self._run(self._write, batch)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Session journal write failed ({len(batch)} operations lost): {e}", file=sys.stderr)
+        self.write_seconds += time.perf_counter() - started
+
+    def _write(self, batch: list):
+        conn = self._conn
+        with conn:
+            conn.execute('BEGIN')
+            for op in batch:
+                if op[0] == 'turn':
+                    _, session_id, profile, message, response, now = op
+                    conn.execute(
+                        'INSERT INTO sessions (session_id, profile, turns, updated) VALUES (?, ?, 1, ?) '
+                        'ON CONFLICT (session_id) DO UPDATE SET turns = turns + 1, updated = excluded.updated',
+                        (session_id, profile, now))
+                    conn.executemany(
+                        'INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
+                        ((session_id, 'user', message), (session_id, 'assistant', response)))
+                elif op[0] == 'snapshot':
+                    _, session_id, profile, summary, history, turns, now = op
+                    conn.execute(
+                        'INSERT INTO sessions (session_id, profile, summary, turns, updated) '
+                        'VALUES (?, ?, ?, ?, ?) ON CONFLICT (session_id) DO UPDATE SET '
+                        'summary = excluded.summary, turns = excluded.turns, updated = excluded.updated',
+                        (session_id, profile, summary, turns, now))
+                    conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+                    conn.executemany(
+                        'INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
+                        ((session_id, role, content) for role, content in history))
+                elif op[0] == 'delete':
+                    conn.execute('DELETE FROM sessions WHERE session_id = ?', (op[1],))
+                    conn.execute('DELETE FROM messages WHERE session_id = ?', (op[1],))
+
+    def _load(self, session_id: str):
+        row = self._conn.execute(
+            'SELECT profile, summary, turns, updated FROM sessions WHERE session_id = ?',
+            (session_id,)).fetchone()
+        if row is None:
+            return None
+        history = self._conn.execute(
+            'SELECT role, content FROM messages WHERE session_id = ? ORDER BY id',
+            (session_id,)).fetchall()
+        profile, summary, turns, updated = row
+        return {'profile': profile, 'summary': summary, 'turns': turns, 'updated': updated,
+                'history': [(role, content) for role, content in history]}
+
+    async def load(self, session_id: str):
+        """The saved {profile, summary, turns, updated, history} for a session, or None"""
+        if self._conn is None:
+            return None
+        # Turns still queued must land first or they'd be missing from the reload
+        if any(op[1] == session_id for op in self._pending):
+            await self.flush()
+        started = time.perf_counter()
+        saved = await self._run(self._load, session_id)
+        elapsed = time.perf_counter() - started
+        if saved is None or (self.ttl > 0 and time.time() - saved['updated'] > self.ttl):
+            self.load_misses += 1
+            return None
+        self.loads += 1
+        self.load_seconds += elapsed
+        self.max_load_seconds = max(self.max_load_seconds, elapsed)
+        return saved
+
+    def _prune(self, cutoff: float) -> int:
+        conn = self._conn
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM messages WHERE session_id IN '
+                         '(SELECT session_id FROM sessions WHERE updated < ?)', (cutoff,))
+            removed = conn.execute('DELETE FROM sessions WHERE updated < ?', (cutoff,)).rowcount
+        # Hand freed pages back and keep the write-ahead log short
+        conn.execute('PRAGMA incremental_vacuum')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return removed
+
+    async def prune(self) -> int:
+        """Drop sessions idle longer than the TTL and compact the file"""
+        if self._conn is None or self.ttl <= 0:
+            return 0
+        await self.flush()
+        removed = await self._run(self._prune, time.time() - self.ttl)
+        self.pruned += removed
+        return removed
+
+    def _count(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    async def stats(self) -> dict:
+        size = sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal')
+                   if os.path.exists(self.path + suffix))
+        return {
+            'path': self.path,
+            'sessions': await self._run(self._count) if self._conn is not None else 0,
+            'bytes': size,
+            'ttl': self.ttl,
+            'pending': self.backlog,
+            'written': self.written,
+            'batches': self.batches,
+            'avgBatchMs': round(1000 * self.write_seconds / self.batches, 3) if self.batches else 0,
+            'errors': self.errors,
+            'loads': self.loads,
+            'loadMisses': self.load_misses,
+            'avgLoadMs': round(1000 * self.load_seconds / self.loads, 3) if self.loads else 0,
+            'maxLoadMs': round(1000 * self.max_load_seconds, 3),
+            'pruned': self.pruned,
+        }
@@ -0,0 +1,135 @@
+"""
+Micro-batching of concurrent one-shot structured calls
+
+Classifying a case file's uploads sends one request per file, each repeating
+the same category list and answer format. Requests that arrive within a few
+milliseconds of each other and would go to the same profile, model and
+schema are collected and sent as one upstream call. The instructions they
+share are written into the prompt once, and the model is asked for a JSON
+array with one result per input. Results that can't be matched back to
+their input (bad JSON, wrong length, or an element failing the schema) come
+back as None, and those requests are sent on their own as usual; so does
+every request in a batch whose call fails.
+"""
+
+import asyncio
+import os
+import sys
+from collections import Counter
+
+from ai.structured import extract_json, schema_instruction, validate
+
+PLACEHOLDER = '<INPUT>'
+
+
+class MicroBatcher:
+    """Gather submissions that share a key for a short window and run them together"""
+
+    def __init__(self, run, window: float = 0.005, max_items: int = 8):
+        # run(key, items) -> one result per item, in order
+        self.run = run
+        self.window = window
+        self.max_items = max(2, max_items)
+        self._open = {}
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.sizes = Counter()
+
+    async def submit(self, key, item):
+        """Add item to the batch open for key and wait for its result"""
+        loop = asyncio.get_running_loop()
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = ([], [], loop.call_later(self.window, self._close, key))
+        items, futures, _ = batch
+        future = loop.create_future()
+        items.append(item)
+        futures.append(future)
+        if len(items) >= self.max_items:
+            self._close(key)
+        return await future
+
+    def _close(self, key):
+        batch = self._open.pop(key, None)
+        if batch is None:
+            return
+        items, futures, timer = batch
+        timer.cancel()
+        task = asyncio.create_task(self._dispatch(key, items, futures))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, key, items: list, futures: list):
+        # Every waiter gave up before the window closed
+        if all(future.done() for future in futures):
+            return
+        self.batches += 1
+        self.items += len(items)
+        self.sizes[len(items)] += 1
+        try:
+            results = await self.run(key, items)
+        except Exception as e:
+            # The batch call failing says nothing about each request on its
+            # own, so every one of them is retried alone
+            print(f"Micro-batch of {len(items)} failed, sending each alone: {e}", file=sys.stderr)
+            results = [None] * len(items)
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            'window': self.window,
+            'maxItems': self.max_items,
+            'open': len(self._open),
+            'batches': self.batches,
+            'items': self.items,
+            'avgSize': round(self.items / self.batches, 2) if self.batches else 0,
+            'sizes': {str(size): count for size, count in sorted(self.sizes.items())},
+        }
+
+
+def shared_affixes(messages: list):
+    """The longest whole-line prefix and suffix common to every message"""
+    prefix = os.path.commonprefix(messages)
+    prefix = prefix[:prefix.rfind('\n') + 1]
+    rest = [message[len(prefix):] for message in messages]
+    suffix = os.path.commonprefix([text[::-1] for text in rest])[::-1]
+    suffix = suffix[suffix.find('\n'):] if '\n' in suffix else ''
+    return prefix, suffix
+
+
+def array_schema(schema: dict, count: int) -> dict:
+    return {'type': 'array', 'items': schema, 'minItems': count, 'maxItems': count}
+
+
+def pack(messages: list, schema: dict) -> str:
+    """One prompt asking for a JSON array answering every message in order"""
+    count = len(messages)
+    prefix, suffix = shared_affixes(messages)
+    if prefix or suffix:
+        parts = [f"Each of the {count} inputs below goes in place of {PLACEHOLDER} "
+                 f"in these instructions:\n\n{prefix}{PLACEHOLDER}{suffix}\n"]
+    else:
+        parts = [f"Answer each of the {count} requests below on its own.\n"]
+    for index, message in enumerate(messages, 1):
+        body = message[len(prefix):len(message) - len(suffix)]
+        parts.append(f"### Input {index}\n{body.strip()}\n")
+    parts.append(f"Answer every input independently. Respond with a JSON array of exactly "
+                 f"{count} results, where result N answers input N.")
+    return '\n'.join(parts) + schema_instruction(array_schema(schema, count))
+
+
+def unpack(text: str, schema: dict, count: int) -> list:
+    """Each input's result from a packed reply, or None where it's missing or invalid"""
+    try:
+        value = extract_json(text)
+    except ValueError:
+        return [None] * count
+    # Some models wrap the array in an object despite being told not to
+    if isinstance(value, dict) and len(value) == 1:
+        value = next(iter(value.values()))
+    if not isinstance(value, list) or len(value) != count:
+        return [None] * count
+    return [None if validate(item, schema) else item for item in value]
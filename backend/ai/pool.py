@@ -0,0 +1,67 @@
+"""
+Shared upstream HTTP connection pool
+
+Every session's chat object calls the same few model endpoints. Rather than
+let each client open its own connections, one httpx client with bounded,
+keep-alive limits is shared by all of them, so DNS lookups and TLS handshakes
+are paid once per connection instead of once per chat. The emergent backend
+talks to models through litellm, which uses this client when it is installed
+as litellm.aclient_session.
+"""
+
+import sys
+
+
+class UpstreamPool:
+    """Size-limited keep-alive pool shared by all upstream chat clients"""
+
+    def __init__(self, max_connections: int = 16, max_keepalive: int = 16,
+                 keepalive_expiry: float = 30, connect_timeout: float = 10):
+        self.max_connections = max(1, max_connections)
+        self.max_keepalive = max(0, min(max_keepalive, self.max_connections))
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.client = None
+
+    def install(self) -> bool:
+        """Create the shared client and hand it to litellm; False if either is missing"""
+        if self.client is not None:
+            return True
+        try:
+            import httpx
+            import litellm
+        except ImportError as e:
+            print(f"Upstream connection pool disabled: {e}", file=sys.stderr)
+            return False
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_keepalive,
+                                keepalive_expiry=self.keepalive_expiry),
+            timeout=httpx.Timeout(None, connect=self.connect_timeout)
+        )
+        litellm.aclient_session = self.client
+        return True
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _connections(self) -> list:
+        # httpx keeps its httpcore pool on the transport
+        pool = getattr(getattr(self.client, '_transport', None), '_pool', None)
+        return list(getattr(pool, 'connections', []))
+
+    def stats(self) -> dict:
+        connections = self._connections()
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            'installed': self.client is not None,
+            'maxConnections': self.max_connections,
+            'maxKeepalive': self.max_keepalive,
+            'keepaliveExpiry': self.keepalive_expiry,
+            'connections': len(connections),
+            'active': len(connections) - idle,
+            'idle': idle,
+            'utilisation': round((len(connections) - idle) / self.max_connections, 4),
+        }
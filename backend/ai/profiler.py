@@ -0,0 +1,113 @@
+"""
+On-demand sampling profiler
+
+Started from an admin endpoint for a fixed window. A helper thread records
+the event loop thread's Python stack at a fixed interval, so time spent in
+JSON work, token counting or waiting in the selector shows up in proportion
+to how long it took. The stacks are written in the folded format that
+flamegraph.pl and speedscope read, and a short summary of the hottest
+functions is returned.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def _frame_name(code) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Samples the calling thread's stack for a window and dumps the result"""
+
+    def __init__(self, directory: str, interval: float = 0.01, max_seconds: float = 60):
+        self.directory = directory
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.running = False
+        self.runs = 0
+        self.last = None
+
+    def _sample(self, thread_id: int, stop: threading.Event, stacks: Counter):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                stacks[';'.join(reversed(names))] += 1
+
+    async def profile(self, seconds: float, top: int = 20) -> dict:
+        """Sample the event loop for seconds, write the folded stacks, return a summary"""
+        if self.running:
+            raise ProfilerBusy('A profile is already running')
+        seconds = min(max(seconds, self.interval), self.max_seconds)
+        self.running = True
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True,
+                                   args=(threading.get_ident(), stop, stacks))
+        started = time.time()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+
+        name = time.strftime('profile-%Y%m%d-%H%M%S', time.localtime(started))
+        path = os.path.join(self.directory, f'{name}-{os.getpid()}.folded')
+        await asyncio.to_thread(self._dump, path, stacks)
+        self.runs += 1
+        self.last = self._summary(path, seconds, stacks, top)
+        return self.last
+
+    def _dump(self, path: str, stacks: Counter):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def _summary(self, path: str, seconds: float, stacks: Counter, top: int) -> dict:
+        samples = sum(stacks.values())
+        own = Counter()
+        total = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+
+        def share(count):
+            return round(count / samples, 4) if samples else 0
+
+        return {
+            'file': path,
+            'seconds': seconds,
+            'interval': self.interval,
+            'pid': os.getpid(),
+            'samples': samples,
+            'topSelf': [{'function': name, 'samples': count, 'share': share(count)}
+                        for name, count in own.most_common(top)],
+            'topTotal': [{'function': name, 'samples': count, 'share': share(count)}
+                         for name, count in total.most_common(top)],
+        }
+
+    def stats(self) -> dict:
+        return {
+            'directory': self.directory,
+            'interval': self.interval,
+            'running': self.running,
+            'runs': self.runs,
+            'lastFile': self.last['file'] if self.last else None,
+        }
@@ -0,0 +1,163 @@
+"""
+Named prompt profiles
+
+A profile fixes the system prompt, model, output-token cap and temperature
+for one kind of call. Chat sessions keep the full FileSolved assistant
+prompt, while one-shot suggest/classify/summarize calls get short,
+task-specific prompts instead of paying for ~400 words of tone and bundle
+guidance on every request. Requests choose a profile by name; otherwise it
+follows the session's route kind. Built-in profiles can be overridden or
+extended from a JSON file.
+"""
+
+import json
+
+from ai.tokens import count_tokens
+
+BUILTIN_PROFILES = {
+    'suggest': {
+        'systemPrompt': "You match people's situations to FileSolved services. "
+                        "Answer only in the format requested.",
+        'maxTokens': 300,
+        'temperature': 0.2,
+    },
+    'classify': {
+        'systemPrompt': "You classify documents by type. Answer only in the format requested.",
+        'maxTokens': 200,
+        'temperature': 0.0,
+    },
+    'summarize': {
+        'systemPrompt': "You summarize documents and conversations accurately and concisely, "
+                        "keeping names, dates, amounts, obligations and open questions.",
+        'maxTokens': 1200,
+        'temperature': 0.2,
+    },
+    'repair': {
+        'systemPrompt': "You fix malformed JSON so it matches a given schema. Output JSON only.",
+        'maxTokens': 400,
+        'temperature': 0.0,
+    },
+}
+
+
+class Profile:
+    """System prompt and model settings for one kind of call"""
+
+    __slots__ = ('name', 'system_prompt', 'model_provider', 'model_name', 'max_tokens',
+                 'temperature', 'pinned', '_prompt_tokens', 'requests', 'prompt_tokens_total',
+                 'completion_tokens_total')
+
+    def __init__(self, name: str, system_prompt: str, model_provider: str, model_name: str,
+                 max_tokens: int = None, temperature: float = None, pinned: bool = False):
+        self.name = name
+        self.system_prompt = system_prompt
+        self.model_provider = model_provider
+        self.model_name = model_name
+        # A model set explicitly for this profile is never re-routed to another tier
+        self.pinned = pinned
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self._prompt_tokens = None
+        self.requests = 0
+        self.prompt_tokens_total = 0
+        self.completion_tokens_total = 0
+
+    @property
+    def prompt_tokens(self) -> int:
+        """Tokens the system prompt adds to every call"""
+        if self._prompt_tokens is None:
+            self._prompt_tokens = count_tokens(self.system_prompt, self.model_name)
+        return self._prompt_tokens
+
+    @property
+    def model(self) -> str:
+        return f"{self.model_provider}/{self.model_name}"
+
+    def cache_identity(self, model: str = None) -> str:
+        """Everything besides the prompts that changes what the model returns"""
+        return f"{model or self.model}|{self.max_tokens}|{self.temperature}"
+
+    def record(self, prompt_tokens: int, completion_tokens: int):
+        self.requests += 1
+        self.prompt_tokens_total += prompt_tokens
+        self.completion_tokens_total += completion_tokens
+
+    def stats(self) -> dict:
+        return {
+            'model': self.model,
+            'pinned': self.pinned,
+            'maxTokens': self.max_tokens,
+            'temperature': self.temperature,
+            'systemPromptTokens': self.prompt_tokens,
+            'requests': self.requests,
+            'promptTokens': self.prompt_tokens_total,
+            'completionTokens': self.completion_tokens_total,
+            'avgPromptTokens': round(self.prompt_tokens_total / self.requests, 1) if self.requests else 0,
+        }
+
+
+class ProfileRegistry:
+    """The built-in profiles plus any loaded from a file"""
+
+    def __init__(self, chat_prompt: str, model_provider: str, model_name: str):
+        self.model_provider = model_provider
+        self.model_name = model_name
+        self._profiles = {}
+        self.add('chat', {'systemPrompt': chat_prompt})
+        for name, config in BUILTIN_PROFILES.items():
+            self.add(name, config)
+
+    def __contains__(self, name):
+        return name in self._profiles
+
+    def add(self, name: str, config: dict) -> Profile:
+        """Add or override a profile; omitted settings keep the current values"""
+        current = self._profiles.get(name)
+        model = config.get('model')
+        if model:
+            model_provider, _, model_name = model.rpartition('/')
+            model_provider = model_provider or self.model_provider
+        elif current is not None:
+            model_provider, model_name = current.model_provider, current.model_name
+        else:
+            model_provider, model_name = self.model_provider, self.model_name
+
+        def setting(key, attr):
+            if key in config:
+                return config[key]
+            return getattr(current, attr) if current is not None else None
+
+        profile = Profile(
+            name,
+            setting('systemPrompt', 'system_prompt') or '',
+            model_provider,
+            model_name,
+            max_tokens=setting('maxTokens', 'max_tokens'),
+            temperature=setting('temperature', 'temperature'),
+            pinned=bool(model) or (current is not None and current.pinned)
+        )
+        self._profiles[name] = profile
+        return profile
+
+    def load(self, path: str) -> int:
+        """Apply {"profiles": {name: {systemPrompt, model, maxTokens, temperature}}}"""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        for name, settings in config.get('profiles', {}).items():
+            self.add(name, settings)
+        return len(config.get('profiles', {}))
+
+    def get(self, name: str) -> Profile:
+        try:
+            return self._profiles[name]
+        except KeyError:
+            raise ValueError(f"Unknown profile '{name}' (expected one of: {', '.join(self._profiles)})")
+
+    def resolve(self, name: str, kind: str) -> Profile:
+        """The named profile, or the one matching the route kind, or chat"""
+        if name:
+            return self.get(name)
+        return self._profiles.get(kind) or self._profiles['chat']
+
+    def stats(self) -> dict:
+        return {name: profile.stats() for name, profile in self._profiles.items()}
@@ -0,0 +1,245 @@
+"""
+LLM provider backends
+
+A provider creates chat objects for sessions. Every chat exposes:
+  await chat.send(text)        -> full reply text
+  async for delta in chat.stream(text)   reply text as it arrives
+
+Backends:
+  emergent  GPT-4o (or AI_PROVIDER/AI_MODEL) through emergentintegrations and
+            the Emergent LLM Key, over one shared keep-alive connection pool
+  stub      Deterministic local responses with configurable latency, jitter,
+            token rate and error rate, for load tests and profiling offline
+"""
+
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+
+from ai.config import env_float, env_int, env_str
+from ai.pool import UpstreamPool
+
+
+class ProviderError(Exception):
+    """An upstream call failed; retryable says whether another attempt may succeed"""
+
+    def __init__(self, message: str, retryable: bool = None):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class Provider:
+    """Base class for chat backends"""
+
+    name = 'base'
+    pool = None
+
+    def check(self):
+        """Raise if the provider can't serve requests (e.g. missing credentials)"""
+
+    async def warm_up(self):
+        """Do the provider's one-off setup now instead of on the first request"""
+        self.check()
+
+    async def close(self):
+        """Release shared clients when the service stops"""
+        if self.pool is not None:
+            await self.pool.close()
+
+    def create_chat(self, session_id: str, system_message: str, model_provider: str,
+                    model_name: str, max_tokens: int = None, temperature: float = None):
+        raise NotImplementedError
+
+
+class EmergentChat:
+    """Adapter from LlmChat to the provider chat interface"""
+
+    def __init__(self, chat, user_message_cls):
+        self._chat = chat
+        self._user_message = user_message_cls
+
+    async def send(self, text: str) -> str:
+        return await self._chat.send_message(self._user_message(text=text))
+
+    async def stream(self, text: str):
+        # LlmChat has no streaming API; use one if a future version adds it,
+        # otherwise the whole reply arrives as a single delta
+        stream_message = getattr(self._chat, 'stream_message', None)
+        if stream_message is None:
+            yield await self.send(text)
+            return
+        async for delta in stream_message(self._user_message(text=text)):
+            if delta:
+                yield delta
+
+
+class EmergentProvider(Provider):
+    """emergentintegrations LlmChat using the Emergent LLM Key"""
+
+    name = 'emergent'
+
+    def __init__(self, pool: UpstreamPool = None):
+        self._classes = None
+        self.load_seconds = None
+        self.pool = pool or UpstreamPool(
+            max_connections=env_int('AI_UPSTREAM_POOL_SIZE', env_int('AI_UPSTREAM_CONCURRENCY', 16)),
+            max_keepalive=env_int('AI_UPSTREAM_POOL_KEEPALIVE', env_int('AI_UPSTREAM_CONCURRENCY', 16)),
+            keepalive_expiry=env_float('AI_UPSTREAM_POOL_IDLE', 30)
+        )
+
+    def _load(self):
+        if self._classes is None:
+            started = time.perf_counter()
+            from emergentintegrations.llm.chat import LlmChat, UserMessage
+            # Share one connection pool across every session's LlmChat
+            self.pool.install()
+            self._classes = (LlmChat, UserMessage)
+            self.load_seconds = time.perf_counter() - started
+            print(f"Loaded emergentintegrations in {self.load_seconds:.2f}s", file=sys.stderr)
+        return self._classes
+
+    def api_key(self) -> str:
+        api_key = env_str('EMERGENT_LLM_KEY')
+        if not api_key:
+            raise ValueError("EMERGENT_LLM_KEY not found")
+        return api_key
+
+    def check(self):
+        self.api_key()
+
+    async def warm_up(self):
+        self.check()
+        # The SDK import is slow; keep the event loop free for /healthz meanwhile
+        if self._classes is None:
+            await asyncio.to_thread(self._load)
+
+    def create_chat(self, session_id, system_message, model_provider, model_name,
+                    max_tokens=None, temperature=None):
+        LlmChat, UserMessage = self._load()
+        chat = LlmChat(
+            api_key=self.api_key(),
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(model_provider, model_name)
+        # Generation settings are passed through where the SDK supports them
+        params = {key: value for key, value in (('max_tokens', max_tokens), ('temperature', temperature))
+                  if value is not None}
+        with_params = getattr(chat, 'with_params', None)
+        if params and with_params is not None:
+            chat = with_params(**params)
+        return EmergentChat(chat, UserMessage)
+
+
+# Built-in stub replies, matched in order against the user message. Templates
+# may use {message}, {session_id}, {model} and {turn}.
+STUB_RULES = [
+    (r'JSON array', '[{"serviceId": "evidence_builder", "reason": "Organize your evidence with timestamps"}, '
+                    '{"serviceId": "complaint_generator", "reason": "Turn your notes into a formal complaint"}]'),
+    (r'"category"', '{"category": "correspondence", "confidence": 0.72, "reasoning": "Stub classification"}'),
+    (r'(?i)summar', 'Summary: the document describes a dispute, the parties involved, key dates and '
+                    'the actions requested. (stub summary)'),
+]
+STUB_DEFAULT = ("Thanks for explaining your situation. Start by documenting everything with dates "
+                "and photos using the Evidence Builder, then use the Complaint Generator to prepare "
+                "a formal complaint. (stub reply, turn {turn})")
+
+
+class StubChat:
+    """Chat that answers locally after a simulated upstream delay"""
+
+    def __init__(self, provider, session_id: str, model_name: str, max_tokens: int = None):
+        self.provider = provider
+        self.session_id = session_id
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.turn = 0
+
+    def _reply(self, text: str) -> str:
+        self.turn += 1
+        template = self.provider.default
+        for pattern, response in self.provider.rules:
+            if pattern.search(text):
+                template = response
+                break
+        reply = (template.replace('{message}', text[:200])
+                 .replace('{session_id}', self.session_id)
+                 .replace('{model}', self.model_name)
+                 .replace('{turn}', str(self.turn)))
+        # Roughly four characters per token, like a real max_tokens cut-off
+        return reply[:self.max_tokens * 4] if self.max_tokens else reply
+
+    async def send(self, text: str) -> str:
+        reply = self._reply(text)
+        await asyncio.sleep(self.provider.first_token_delay())
+        self.provider.maybe_fail()
+        await asyncio.sleep(self.provider.generation_time(reply))
+        return reply
+
+    async def stream(self, text: str):
+        reply = self._reply(text)
+        await asyncio.sleep(self.provider.first_token_delay())
+        self.provider.maybe_fail()
+        words = re.findall(r'\S+\s*', reply)
+        for word in words:
+            await asyncio.sleep(self.provider.generation_time(word))
+            yield word
+
+
+class StubProvider(Provider):
+    """Deterministic local backend for benchmarking the service itself"""
+
+    name = 'stub'
+
+    def __init__(self, latency: float = None, jitter: float = None, tokens_per_second: float = None,
+                 error_rate: float = None, seed: int = None, responses_file: str = None):
+        self.latency = env_float('AI_STUB_LATENCY', 0.2) if latency is None else latency
+        self.jitter = env_float('AI_STUB_JITTER', 0.05) if jitter is None else jitter
+        self.tokens_per_second = (env_float('AI_STUB_TOKENS_PER_SEC', 50)
+                                  if tokens_per_second is None else tokens_per_second)
+        self.error_rate = env_float('AI_STUB_ERROR_RATE', 0.0) if error_rate is None else error_rate
+        self.random = random.Random(env_int('AI_STUB_SEED', 0) if seed is None else seed)
+        self.rules = [(re.compile(pattern), response) for pattern, response in STUB_RULES]
+        self.default = STUB_DEFAULT
+        responses_file = env_str('AI_STUB_RESPONSES') if responses_file is None else responses_file
+        if responses_file:
+            self.load_responses(responses_file)
+
+    def load_responses(self, path: str):
+        """Prepend rules from a JSON file: {"rules": [{"match", "response"}], "default"}"""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        custom = [(re.compile(rule['match']), rule['response']) for rule in config.get('rules', [])]
+        self.rules = custom + self.rules
+        self.default = config.get('default', self.default)
+
+    def first_token_delay(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def generation_time(self, text: str) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return max(1, len(text) // 4) / self.tokens_per_second
+
+    def maybe_fail(self):
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            raise ProviderError('Stub upstream error (AI_STUB_ERROR_RATE)', retryable=True)
+
+    def create_chat(self, session_id, system_message, model_provider, model_name,
+                    max_tokens=None, temperature=None):
+        return StubChat(self, session_id, model_name, max_tokens)
+
+
+PROVIDERS = {
+    EmergentProvider.name: EmergentProvider,
+    StubProvider.name: StubProvider,
+}
+
+
+def create_provider(name: str) -> Provider:
+    try:
+        return PROVIDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown AI_BACKEND '{name}' (expected one of: {', '.join(PROVIDERS)})")
@@ -0,0 +1,339 @@
+"""
+Retries, hedging and circuit breaking for upstream model calls
+
+Each call attempt gets its own deadline. Attempts that fail with a retryable
+error (timeouts, dropped connections, 429 and 5xx responses) are retried after
+a fully jittered exponential backoff. When hedging is on, a duplicate attempt
+is started once the first has run past the recent p95 latency for that model
+and route kind, and whichever answers first wins. A circuit breaker per model
+opens after consecutive failures: calls then go to the fallback model if one
+is configured, or fail fast with 503, until a probe call succeeds.
+"""
+
+import asyncio
+import math
+import random
+import re
+import time
+from collections import Counter, deque
+
+from ai.admission import Overloaded
+from ai.providers import ProviderError
+from ai.tracing import span
+
+# HTTP statuses worth another attempt
+RETRYABLE_STATUS = frozenset((408, 409, 425, 429, 500, 502, 503, 504, 529))
+
+# Transient error types raised by the OpenAI and litellm clients
+RETRYABLE_NAMES = frozenset((
+    'RateLimitError', 'APIConnectionError', 'APITimeoutError', 'Timeout',
+    'ServiceUnavailableError', 'InternalServerError', 'ConnectError', 'ReadTimeout',
+    'RemoteProtocolError',
+))
+
+# SDKs that re-raise everything as a plain Exception still say what happened
+RETRYABLE_MESSAGE = re.compile(
+    r'rate.?limit|timed? ?out|overloaded|temporarily unavailable|connection (?:error|reset|refused)'
+    r'|\b(?:429|50[234]|529)\b', re.IGNORECASE)
+
+
+class CircuitOpen(Overloaded):
+    """Raised instead of calling a model whose circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, 503, retry_after)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether error (or anything it wraps) is a transient upstream failure"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return True
+        retryable = getattr(error, 'retryable', None)
+        if retryable is not None:
+            return retryable
+        status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS
+        if type(error).__name__ in RETRYABLE_NAMES:
+            return True
+        if RETRYABLE_MESSAGE.search(str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class RetryPolicy:
+    """How many times to retry, and the full-jitter backoff between attempts"""
+
+    def __init__(self, retries: int = 2, base_delay: float = 0.25, max_delay: float = 4.0,
+                 rng: random.Random = None):
+        self.retries = max(0, retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.random = rng or random.Random()
+
+    def delay(self, retry: int) -> float:
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class LatencyTracker:
+    """Latencies of recent successful calls, for picking a hedge delay"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20, max_age: float = 0,
+                 clock=time.monotonic):
+        self.samples = deque(maxlen=size)
+        self.times = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.max_age = max_age
+        self._clock = clock
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.times.append(self._clock())
+
+    def _expire(self):
+        if self.max_age <= 0:
+            return
+        cutoff = self._clock() - self.max_age
+        while self.times and self.times[0] <= cutoff:
+            self.times.popleft()
+            self.samples.popleft()
+
+    def recent(self) -> list:
+        """Latencies observed within max_age (all kept ones if it is 0)"""
+        self._expire()
+        return list(self.samples)
+
+    def quantile(self, q: float):
+        """The q-quantile of recent latencies, or None until there are enough"""
+        ordered = sorted(self.recent())
+        if len(ordered) < self.min_samples:
+            return None
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe -> closed"""
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one probe at a time"""
+        now = self._clock()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probe_started = None
+        if self.state == self.HALF_OPEN:
+            # A probe that never reported back (cancelled) doesn't block forever
+            if self.probe_started is None or now - self.probe_started >= self.reset_timeout:
+                self.probe_started = now
+                return True
+        if self.state == self.CLOSED:
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_started = None
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = self._clock()
+            self.probe_started = None
+
+    def release(self):
+        """Forget an allowed call that ended without telling us anything"""
+        self.probe_started = None
+
+    def retry_after(self) -> int:
+        if self.state != self.OPEN:
+            return 1
+        return max(1, math.ceil(self.opened_at + self.reset_timeout - self._clock()))
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutiveFailures': self.failures,
+            'opens': self.opens,
+            'rejected': self.rejected,
+            'retryAfter': self.retry_after() if self.state == self.OPEN else None,
+        }
+
+
+async def hedged(attempt, delay: float = None, can_hedge=lambda: True, on_hedge=None):
+    """Await attempt(); if it hasn't finished after delay, race a second one
+
+    The first successful result wins and the other attempt is cancelled. If
+    one attempt fails the other is still awaited; if both fail, the first
+    error is raised.
+    """
+    pending = {asyncio.ensure_future(attempt())}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and can_hedge():
+                if on_hedge is not None:
+                    on_hedge()
+                pending.add(asyncio.ensure_future(attempt()))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class Resilience:
+    """Retry policy, per-model circuit breakers and latency trackers for upstream calls"""
+
+    def __init__(self, policy: RetryPolicy = None, attempt_timeout: float = 0,
+                 hedge: bool = False, hedge_quantile: float = 0.95, hedge_min_delay: float = 0.5,
+                 hedge_min_samples: int = 20, failure_threshold: int = 5,
+                 reset_timeout: float = 30, fallback_model: str = None):
+        self.policy = policy or RetryPolicy()
+        self.attempt_timeout = attempt_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fallback_model = fallback_model
+        self.breakers = {}
+        self.latencies = {}
+        self.retries = Counter()
+        self.hedges = Counter()
+        self.hedge_wins = Counter()
+        self.fallbacks = Counter()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(model, self.failure_threshold, self.reset_timeout)
+        return self.breakers[model]
+
+    def latency(self, model: str, kind: str) -> LatencyTracker:
+        key = (model, kind)
+        if key not in self.latencies:
+            self.latencies[key] = LatencyTracker(min_samples=self.hedge_min_samples)
+        return self.latencies[key]
+
+    def choose(self, model: str) -> str:
+        """The model to call: model itself, or the fallback while its circuit is open"""
+        breaker = self.breaker(model)
+        if breaker.allow():
+            return model
+        fallback = self.fallback_model
+        if fallback and fallback != model and self.breaker(fallback).allow():
+            self.fallbacks[model] += 1
+            return fallback
+        raise CircuitOpen(f'Upstream model {model} is unavailable; try again shortly',
+                          breaker.retry_after())
+
+    def hedge_delay(self, model: str, kind: str):
+        if not self.hedge or self.breaker(model).state != CircuitBreaker.CLOSED:
+            return None
+        p = self.latency(model, kind).quantile(self.hedge_quantile)
+        return None if p is None else max(self.hedge_min_delay, p)
+
+    async def _attempt(self, attempt, model: str, kind: str):
+        breaker = self.breaker(model)
+        started = time.monotonic()
+        try:
+            with span('attempt', model=model):
+                async with asyncio.timeout(self.attempt_timeout if self.attempt_timeout > 0 else None):
+                    result = await attempt(model)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                breaker.failure()
+            else:
+                breaker.release()
+            raise
+        breaker.success()
+        self.latency(model, kind).observe(time.monotonic() - started)
+        return result
+
+    async def call(self, attempt, model: str, kind: str, can_hedge=lambda: False, hedge_slot=None):
+        """Run attempt(model) until it succeeds or fails for good
+
+        attempt is called afresh for every retry and hedge, with the model to
+        use (the requested one or the fallback). can_hedge() is asked before a
+        hedge is started, so it can refuse when there is no spare capacity,
+        and the hedge runs inside hedge_slot() if given.
+        """
+        error = None
+        for retry in range(self.policy.retries + 1):
+            if retry:
+                self.retries[kind] += 1
+                await asyncio.sleep(self.policy.delay(retry - 1))
+            chosen = self.choose(model)
+            hedge_started = []
+
+            def on_hedge():
+                self.hedges[kind] += 1
+                hedge_started.append(True)
+
+            def run():
+                index = len(hedge_started)
+
+                async def timed():
+                    if not index or hedge_slot is None:
+                        return await self._attempt(attempt, chosen, kind)
+                    async with hedge_slot():
+                        result = await self._attempt(attempt, chosen, kind)
+                    self.hedge_wins[kind] += 1
+                    return result
+                return timed()
+
+            try:
+                return await hedged(run, self.hedge_delay(chosen, kind), can_hedge, on_hedge)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+        raise ProviderError(f'Upstream model failed after {self.policy.retries + 1} attempts: '
+                            f'{error}') from error
+
+    def stats(self) -> dict:
+        return {
+            'retries': self.policy.retries,
+            'attemptTimeout': self.attempt_timeout,
+            'hedge': self.hedge,
+            'fallbackModel': self.fallback_model,
+            'retried': dict(self.retries),
+            'hedged': dict(self.hedges),
+            'hedgeWins': dict(self.hedge_wins),
+            'fallbacks': dict(self.fallbacks),
+            'hedgeDelays': {f'{model}|{kind}': round(delay, 3) for (model, kind) in self.latencies
+                            for delay in [self.hedge_delay(model, kind)] if delay is not None},
+            'breakers': {model: breaker.stats() for model, breaker in self.breakers.items()},
+        }
@@ -0,0 +1,175 @@
+"""
+Bounded session store for AI chat instances
+
+Sessions are kept in LRU order and evicted when they sit idle longer than the
+TTL, when the entry cap is reached, or when the estimated memory held by all
+conversations crosses the byte cap. Session IDs with a one-shot prefix (the
+`suggest-`, `summarize-` and `classify-` calls made by routes/ai.js) are never
+retained at all.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+# Rough fixed cost of a chat instance (client object, lock, bookkeeping)
+SESSION_OVERHEAD_BYTES = 2048
+
+DEFAULT_ONE_SHOT_PREFIXES = ('suggest-', 'summarize-', 'classify-', 'repair-')
+
+
+class Session:
+    """A chat instance plus the bookkeeping the store needs"""
+
+    __slots__ = ('session_id', 'chat', 'lock', 'created_at', 'last_access',
+                 'size', 'turns', 'tokens', 'retained', 'history', 'summary',
+                 'compacting', 'profile', 'model')
+
+    def __init__(self, session_id: str, chat, now: float, retained: bool = True):
+        self.session_id = session_id
+        self.chat = chat
+        self.lock = asyncio.Lock()
+        self.created_at = now
+        self.last_access = now
+        self.size = SESSION_OVERHEAD_BYTES
+        self.turns = 0
+        self.tokens = 0
+        self.retained = retained
+        # Our own transcript of (role, content) pairs, used to compact the
+        # chat's history once it grows past the token budget
+        self.history = []
+        self.summary = ''
+        self.compacting = None
+        # Prompt profile the chat was created with, and the provider/model its
+        # turns go to (set by the service)
+        self.profile = None
+        self.model = None
+
+
+class SessionStore:
+    """LRU + idle-TTL store of chat sessions with entry and memory caps"""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 idle_ttl: float = 3600, one_shot_prefixes=DEFAULT_ONE_SHOT_PREFIXES,
+                 clock=time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.one_shot_prefixes = tuple(one_shot_prefixes)
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.one_shot = 0
+        self.evictions = {'ttl': 0, 'capacity': 0, 'memory': 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        session = self._sessions.get(session_id)
+        return session is not None and not self._expired(session, self._clock())
+
+    def is_one_shot(self, session_id: str) -> bool:
+        return bool(self.one_shot_prefixes) and session_id.startswith(self.one_shot_prefixes)
+
+    def get(self, session_id: str, factory) -> Session:
+        """Return the session for session_id, creating it with factory() on a miss"""
+        now = self._clock()
+
+        if self.is_one_shot(session_id):
+            self.one_shot += 1
+            return Session(session_id, factory(), now, retained=False)
+
+        session = self._sessions.get(session_id)
+        if session is not None and self._expired(session, now):
+            self._evict(session_id, 'ttl')
+            session = None
+
+        if session is not None:
+            self.hits += 1
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+        self.misses += 1
+        session = Session(session_id, factory(), now)
+        self._sessions[session_id] = session
+        self.total_bytes += session.size
+        self._enforce_limits(keep=session_id)
+        return session
+
+    def record_turn(self, session: Session, message: str, response: str, tokens: int = 0):
+        """Account for the memory (and history tokens) a completed turn adds to a session"""
+        # Each turn is held twice: in the chat's own history and our transcript
+        added = 2 * (len(message.encode('utf-8')) + len(response.encode('utf-8')))
+        session.turns += 1
+        session.tokens += tokens
+        if session.retained:
+            session.history.append(('user', message))
+            session.history.append(('assistant', response))
+        session.size += added
+        session.last_access = self._clock()
+        if session.retained and self._sessions.get(session.session_id) is session:
+            self.total_bytes += added
+            self._enforce_limits(keep=session.session_id)
+
+    def resize(self, session: Session, size: int):
+        """Replace a session's size estimate after its history is rewritten"""
+        size = max(SESSION_OVERHEAD_BYTES, size)
+        if session.retained and self._sessions.get(session.session_id) is session:
+            self.total_bytes += size - session.size
+        session.size = size
+
+    def discard(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.total_bytes -= session.size
+        return True
+
+    def sweep(self) -> int:
+        """Drop every session that has been idle longer than the TTL"""
+        if self.idle_ttl <= 0:
+            return 0
+        now = self._clock()
+        expired = [sid for sid, s in self._sessions.items() if self._expired(s, now)]
+        for sid in expired:
+            self._evict(sid, 'ttl')
+        return len(expired)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._sessions),
+            'bytes': self.total_bytes,
+            'maxEntries': self.max_entries,
+            'maxBytes': self.max_bytes,
+            'idleTtl': self.idle_ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'oneShot': self.one_shot,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': dict(self.evictions),
+        }
+
+    def _expired(self, session: Session, now: float) -> bool:
+        return self.idle_ttl > 0 and now - session.last_access > self.idle_ttl
+
+    def _evict(self, session_id: str, reason: str):
+        if self.discard(session_id):
+            self.evictions[reason] += 1
+
+    def _enforce_limits(self, keep: str = None):
+        # Oldest entries sit at the front of the OrderedDict
+        while len(self._sessions) > self.max_entries:
+            oldest = next(iter(self._sessions))
+            self._evict(oldest, 'capacity')
+        if self.max_bytes <= 0:
+            return
+        while self.total_bytes > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._evict(oldest, 'memory')
@@ -0,0 +1,57 @@
+"""
+Incremental response writers for streamed AI replies
+
+Two wire formats are supported:
+  sse     text/event-stream, one `event:` + `data:` block per frame
+  ndjson  application/x-ndjson, one JSON object per line with a `type` key
+"""
+
+import json
+
+from aiohttp import web
+
+STREAM_FORMATS = ('sse', 'ndjson')
+
+
+def requested_format(request: web.Request, data: dict):
+    """Return the stream format a request asked for, or None for a plain JSON reply"""
+    stream = data.get('stream')
+    if isinstance(stream, str) and stream.lower() in STREAM_FORMATS:
+        return stream.lower()
+    accept = request.headers.get('Accept', '')
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    if stream is True or 'text/event-stream' in accept:
+        return 'sse'
+    return None
+
+
+class EventStream:
+    """Writes token, done and error frames to a chunked HTTP response"""
+
+    def __init__(self, request: web.Request, fmt: str = 'sse'):
+        self.request = request
+        self.format = fmt
+        content_type = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+        self.response = web.StreamResponse(status=200, headers={
+            'Content-Type': f'{content_type}; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': '*',
+        })
+
+    async def prepare(self):
+        await self.response.prepare(self.request)
+
+    async def send(self, event: str, data: dict):
+        if self.format == 'sse':
+            frame = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        else:
+            frame = json.dumps({'type': event, **data}) + '\n'
+        await self.response.write(frame.encode('utf-8'))
+
+    async def token(self, delta: str):
+        await self.send('token', {'delta': delta})
+
+    async def close(self):
+        await self.response.write_eof()
@@ -0,0 +1,126 @@
+"""
+Structured (JSON) output for machine-consumed calls
+
+Callers send a JSON Schema with the request. The model is told to answer
+with matching JSON only, the reply is parsed and validated here, and a
+failed reply gets a single cheap repair call that sees only the bad output
+and the errors, not the original prompt. Only the subset of JSON Schema our
+routes use is supported: type, enum, properties, required,
+additionalProperties, items, minItems/maxItems, minimum/maximum and
+minLength/maxLength.
+"""
+
+import json
+import re
+
+FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+    'null': type(None),
+}
+
+
+class StructuredOutputError(Exception):
+    """The model's reply could not be parsed or didn't match the schema"""
+
+    def __init__(self, message: str, errors: list, response: str):
+        super().__init__(message)
+        self.errors = errors
+        self.response = response
+
+
+def extract_json(text: str):
+    """Parse the first JSON object or array in text (code fences and prose allowed)"""
+    text = FENCE.sub('', text.strip())
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'[\[{]', text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+            return value
+        except ValueError:
+            continue
+    raise ValueError('No JSON object or array found')
+
+
+def _type_ok(value, expected: str) -> bool:
+    if expected == 'integer':
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == 'number':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, TYPES.get(expected, object))
+
+
+def validate(value, schema: dict, path: str = '$') -> list:
+    """Return a list of human-readable schema violations (empty if valid)"""
+    errors = []
+    expected = schema.get('type')
+    if expected:
+        allowed = expected if isinstance(expected, list) else [expected]
+        if not any(_type_ok(value, name) for name in allowed):
+            return [f"{path}: expected {' or '.join(allowed)}, got {type(value).__name__}"]
+
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if 'minimum' in schema and value < schema['minimum']:
+            errors.append(f"{path}: {value} is below the minimum {schema['minimum']}")
+        if 'maximum' in schema and value > schema['maximum']:
+            errors.append(f"{path}: {value} is above the maximum {schema['maximum']}")
+
+    if isinstance(value, str):
+        if 'minLength' in schema and len(value) < schema['minLength']:
+            errors.append(f"{path}: shorter than {schema['minLength']} characters")
+        if 'maxLength' in schema and len(value) > schema['maxLength']:
+            errors.append(f"{path}: longer than {schema['maxLength']} characters")
+
+    if isinstance(value, dict):
+        properties = schema.get('properties', {})
+        for name in schema.get('required', []):
+            if name not in value:
+                errors.append(f"{path}: missing required property '{name}'")
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(validate(item, properties[name], f'{path}.{name}'))
+            elif schema.get('additionalProperties') is False:
+                errors.append(f"{path}: unexpected property '{name}'")
+
+    if isinstance(value, list):
+        if 'minItems' in schema and len(value) < schema['minItems']:
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        if 'maxItems' in schema and len(value) > schema['maxItems']:
+            errors.append(f"{path}: more than {schema['maxItems']} items")
+        if 'items' in schema:
+            for index, item in enumerate(value):
+                errors.extend(validate(item, schema['items'], f'{path}[{index}]'))
+
+    return errors
+
+
+def parse(text: str, schema: dict):
+    """Parse and validate a reply, raising StructuredOutputError on failure"""
+    try:
+        value = extract_json(text)
+    except ValueError as e:
+        raise StructuredOutputError('Reply is not JSON', [str(e)], text)
+    errors = validate(value, schema)
+    if errors:
+        raise StructuredOutputError('Reply does not match the schema', errors, text)
+    return value
+
+
+def schema_instruction(schema: dict) -> str:
+    return ("\n\nRespond with JSON only, no prose or code fences, matching this JSON Schema:\n"
+            f"{json.dumps(schema, separators=(',', ':'))}")
+
+
+def repair_prompt(response: str, errors: list, schema: dict) -> str:
+    """Prompt for the single repair attempt: fix the JSON, don't redo the task"""
+    problems = '\n'.join(f"- {error}" for error in errors[:10])
+    return (f"The following output was supposed to be JSON matching a schema but has "
+            f"these problems:\n{problems}\n\nOutput:\n{response[:4000]}"
+            f"{schema_instruction(schema)}\nReturn the corrected JSON only.")
@@ -0,0 +1,112 @@
+"""
+Model tier routing
+
+Requests go either to the fast tier (a smaller, cheaper model) or to the full
+tier (the profile's own model, gpt-4o by default). Chat sessions always get
+the full tier. Suggest, classify and repair calls get the fast tier when
+their input is short. Other one-shot calls (summaries) get the full tier
+unless the full tier's recent p95 latency for that kind is over the latency
+target and the input still fits the fast tier's limit. While they are
+switched, a small share still goes to the full tier as probes, and latency
+samples older than the window are dropped, so a full tier that recovers wins
+its traffic back. Replies from the
+fast tier that can't be used (empty, or failing their schema) are retried
+once on the full tier; those quality fallbacks are counted per kind.
+"""
+
+import time
+from collections import Counter
+
+from ai.resilience import LatencyTracker
+
+FAST, FULL = 'fast', 'full'
+
+
+class TierRouter:
+    """Pick a tier per request and keep per-tier latency and fallback counts"""
+
+    def __init__(self, fast_model: str, fast_kinds=('suggest', 'classify', 'repair'),
+                 fast_max_tokens: int = 2000, latency_target: float = 0,
+                 min_samples: int = 20, latency_window: float = 300,
+                 probe_share: float = 0.05, clock=time.monotonic):
+        self.fast_model = fast_model
+        self.fast_kinds = frozenset(fast_kinds)
+        self.fast_max_tokens = fast_max_tokens
+        self.latency_target = latency_target
+        self.min_samples = min_samples
+        self.latency_window = latency_window
+        # Every probe_every-th latency-switched request goes to the full tier
+        self.probe_every = round(1 / probe_share) if probe_share > 0 else 0
+        self._clock = clock
+        self._switched = Counter()
+        self.latencies = {}
+        self.decisions = Counter()
+        self.quality_fallbacks = Counter()
+
+    def latency(self, tier: str, kind: str) -> LatencyTracker:
+        key = (tier, kind)
+        if key not in self.latencies:
+            self.latencies[key] = LatencyTracker(min_samples=self.min_samples,
+                                                 max_age=self.latency_window, clock=self._clock)
+        return self.latencies[key]
+
+    def tier_of(self, model: str) -> str:
+        return FAST if model == self.fast_model else FULL
+
+    def pick(self, kind: str, input_tokens: int, one_shot: bool = True):
+        """(tier, reason) for a request of this kind and input size"""
+        if not one_shot:
+            return self._decide(FULL, kind, 'chat')
+        if input_tokens > self.fast_max_tokens:
+            return self._decide(FULL, kind, 'length')
+        if kind in self.fast_kinds:
+            return self._decide(FAST, kind, 'kind')
+        if self.latency_target > 0:
+            p95 = self.latency(FULL, kind).quantile(0.95)
+            if p95 is not None and p95 > self.latency_target:
+                self._switched[kind] += 1
+                if self.probe_every and self._switched[kind] % self.probe_every == 0:
+                    return self._decide(FULL, kind, 'probe')
+                return self._decide(FAST, kind, 'latency')
+        return self._decide(FULL, kind, 'kind')
+
+    def _decide(self, tier: str, kind: str, reason: str):
+        self.decisions[(tier, kind, reason)] += 1
+        return tier, reason
+
+    def observe(self, model: str, kind: str, seconds: float):
+        self.latency(self.tier_of(model), kind).observe(seconds)
+
+    def quality_fallback(self, kind: str):
+        """Count a fast-tier reply that had to be redone on the full tier"""
+        self.quality_fallbacks[kind] += 1
+        self._decide(FULL, kind, 'quality')
+
+    def stats(self) -> dict:
+        fast_requests = Counter()
+        tiers = {}
+        for (tier, kind, reason), count in self.decisions.items():
+            entry = tiers.setdefault(tier, {}).setdefault(kind, {'requests': 0, 'reasons': {}})
+            entry['requests'] += count
+            entry['reasons'][reason] = count
+            if tier == FAST:
+                fast_requests[kind] += count
+        for (tier, kind), tracker in self.latencies.items():
+            entry = tiers.setdefault(tier, {}).setdefault(kind, {'requests': 0, 'reasons': {}})
+            samples = sorted(tracker.recent())
+            if samples:
+                entry['p50'] = round(samples[len(samples) // 2], 3)
+                entry['p95'] = round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 3)
+        for kind, count in fast_requests.items():
+            entry = tiers[FAST][kind]
+            entry['qualityFallbacks'] = self.quality_fallbacks[kind]
+            entry['qualityFallbackRate'] = round(self.quality_fallbacks[kind] / count, 4)
+        return {
+            'fastModel': self.fast_model,
+            'fastKinds': sorted(self.fast_kinds),
+            'fastMaxTokens': self.fast_max_tokens,
+            'latencyTarget': self.latency_target,
+            'latencyWindow': self.latency_window,
+            'probeEvery': self.probe_every,
+            'tiers': tiers,
+        }
@@ -0,0 +1,32 @@
+"""
+Token counting for usage reporting
+
+Uses tiktoken when it is installed and its encoding can be loaded, otherwise
+falls back to the usual ~4 characters per token estimate.
+"""
+
+from functools import lru_cache
+
+DEFAULT_ENCODING_MODEL = 'gpt-4o'
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = DEFAULT_ENCODING_MODEL) -> int:
+    """Return the number of tokens in text for the given model"""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, (len(text) + 3) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,174 @@
+"""
+Request tracing
+
+Each request gets an ID: the X-Request-ID the Node API sent, or a new one.
+Handlers mark the phases of a request (parsing, session lookup, waiting for
+the session lock and an upstream slot, each upstream attempt, serialising
+the reply) as spans on the request's trace. Recording a span is one list
+append. Whether a trace is kept is decided once the request has finished: a
+random sample of requests is kept, plus every request slower than the slow
+threshold. Kept traces are appended to a JSONL file in the background, one
+line per request.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+# IDs we accept from callers; anything else is replaced with a new one
+REQUEST_ID = re.compile(r'^[\w.:-]{1,128}$')
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def request_id_from(header: str) -> str:
+    """The caller's request ID if it is sane, else a new one"""
+    if header and REQUEST_ID.match(header):
+        return header
+    return uuid.uuid4().hex
+
+
+class Trace:
+    """Spans recorded while handling one request"""
+
+    __slots__ = ('request_id', 'method', 'path', 'started', 'wall', 'spans')
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.spans = []
+
+    def add(self, name: str, started: float, ended: float, attrs: dict):
+        self.spans.append((name, started, ended, attrs))
+
+    def as_dict(self, status: int, kind: str, duration: float, reason: str) -> dict:
+        return {
+            'requestId': self.request_id,
+            'time': round(self.wall, 3),
+            'method': self.method,
+            'path': self.path,
+            'kind': kind,
+            'status': status,
+            'durationMs': round(1000 * duration, 3),
+            'sampled': reason,
+            'pid': os.getpid(),
+            'spans': [{
+                'name': name,
+                'startMs': round(1000 * (started - self.started), 3),
+                'durationMs': round(1000 * (ended - started), 3),
+                **attrs
+            } for name, started, ended, attrs in sorted(self.spans, key=lambda span: span[1])],
+        }
+
+
+def record_span(name: str, started: float, **attrs):
+    """Add a span from started (a perf_counter() reading) to now on the current trace"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, started, time.perf_counter(), attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Record the enclosed block as a span on the current trace, if there is one"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter(), attrs)
+
+
+class Tracer:
+    """Keeps a sample of finished traces and appends them to a JSONL file"""
+
+    def __init__(self, path: str, sample_rate: float = 0.01, slow: float = 5.0,
+                 max_bytes: int = 64 * 1024 * 1024, flush_interval: float = 1.0,
+                 rng: random.Random = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow = slow
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.random = rng or random.Random()
+        self._pending = []
+        self.traced = 0
+        self.kept = {'sampled': 0, 'slow': 0}
+        self.written = 0
+        self.dropped = 0
+
+    def start(self, request_id: str, method: str, path: str) -> Trace:
+        trace = Trace(request_id, method, path)
+        current_trace.set(trace)
+        return trace
+
+    def finish(self, trace: Trace, status: int, kind: str = None):
+        """Decide whether to keep a finished trace and queue it for writing"""
+        self.traced += 1
+        duration = time.perf_counter() - trace.started
+        if self.slow > 0 and duration >= self.slow:
+            reason = 'slow'
+        elif self.random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            return
+        self.kept[reason] += 1
+        # Never let a stuck disk grow the queue without bound
+        if len(self._pending) >= 10000:
+            self.dropped += 1
+            return
+        self._pending.append(json.dumps(trace.as_dict(status, kind, duration, reason),
+                                        separators=(',', ':')))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.written += len(lines)
+        except OSError as e:
+            self.dropped += len(lines)
+            print(f"Trace write failed ({len(lines)} traces lost): {e}", file=sys.stderr)
+
+    def _write(self, lines: list):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            if self.max_bytes > 0 and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+        except FileNotFoundError:
+            pass
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def stats(self) -> dict:
+        return {
+            'path': self.path,
+            'sampleRate': self.sample_rate,
+            'slowSeconds': self.slow,
+            'traced': self.traced,
+            'kept': dict(self.kept),
+            'written': self.written,
+            'pending': len(self._pending),
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,370 @@
+"""
+Pre-fork worker mode
+
+A small router process owns the public port and starts N copies of the
+service as child processes, each listening on its own Unix socket. Chat
+requests are routed by a stable hash of their sessionId, so a conversation's
+chat object and history always live in the same worker; one-shot requests
+are routed by a hash of the message instead, so identical prompts reach the
+same response cache. A /batch goes to the worker owning its one chat
+session, if it has one; batches mixing several chat sessions are refused.
+Workers that exit or fail to start are restarted with backoff,
+/stats and /metrics aggregate every worker, and POST /admin/profile
+profiles them all at once.
+"""
+
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+from ai.metrics import Registry
+
+# Response headers the router must not copy from a worker
+HOP_BY_HOP = {'connection', 'keep-alive', 'transfer-encoding', 'content-length',
+              'date', 'server'}
+
+# Restart backoff: doubles per quick crash, resets after a healthy run
+RESTART_BACKOFF_MIN = 0.5
+RESTART_BACKOFF_MAX = 30
+HEALTHY_RUN_SECONDS = 60
+
+WORKER_ENV = 'AI_WORKER_SOCKET'
+
+# Longest a worker may take to answer POST /admin/profile (its window included)
+PROFILE_TIMEOUT = 300
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (.*)$')
+
+
+class Unroutable(ValueError):
+    """Raised for a request no single worker can serve"""
+
+
+def batch_route_key(items: list, is_one_shot) -> str:
+    """A /batch is routed by the one chat session among its items, else by its messages"""
+    chat_sessions = set()
+    messages = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        session_id = str(item.get('sessionId') or 'default')
+        if is_one_shot(session_id):
+            messages.append(str(item.get('message') or ''))
+        else:
+            chat_sessions.add(session_id)
+    if len(chat_sessions) > 1:
+        raise Unroutable('With AI_WORKERS > 1, a batch may hold turns of at most one chat '
+                         'session; send other sessions in separate batches')
+    if chat_sessions:
+        return chat_sessions.pop()
+    return '\n'.join(messages)
+
+
+def route_key(body: bytes, is_one_shot) -> str:
+    """What a request is routed by: its sessionId, or the message for one-shot sessions"""
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        return ''
+    if not isinstance(data, dict):
+        return ''
+    if isinstance(data.get('items'), list):
+        return batch_route_key(data['items'], is_one_shot)
+    session_id = str(data.get('sessionId') or '')
+    if session_id and is_one_shot(session_id):
+        return str(data.get('message') or session_id)
+    return session_id or str(data.get('path') or data.get('text') or '')
+
+
+def pick_worker(key: str, count: int) -> int:
+    return zlib.crc32(key.encode('utf-8')) % count
+
+
+class Worker:
+    """One supervised child process"""
+
+    def __init__(self, index: int, socket_path: str, argv: list):
+        self.index = index
+        self.socket_path = socket_path
+        self.argv = argv
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.last_exit = None
+        self.session = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        env = dict(os.environ, **{WORKER_ENV: self.socket_path, 'AI_WORKER_ID': str(self.index)})
+        self.process = await asyncio.create_subprocess_exec(*self.argv, env=env)
+        self.started_at = time.monotonic()
+
+    async def supervise(self):
+        """Keep the worker running until cancelled"""
+        backoff = RESTART_BACKOFF_MIN
+        while True:
+            try:
+                await self.spawn()
+            except Exception as e:
+                # A failed spawn (fork limits, a bad interpreter path) mustn't
+                # end supervision; keep trying with backoff
+                backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+                print(f"Worker {self.index} failed to start ({e}), retrying in {backoff:.1f}s",
+                      file=sys.stderr)
+                await asyncio.sleep(backoff)
+                self.restarts += 1
+                continue
+            code = await self.process.wait()
+            self.last_exit = code
+            ran = time.monotonic() - self.started_at
+            backoff = RESTART_BACKOFF_MIN if ran > HEALTHY_RUN_SECONDS else min(backoff * 2, RESTART_BACKOFF_MAX)
+            print(f"Worker {self.index} exited with code {code}, restarting in {backoff:.1f}s",
+                  file=sys.stderr)
+            await asyncio.sleep(backoff)
+            self.restarts += 1
+
+    async def stop(self, timeout: float = 10):
+        if not self.alive:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+    def client(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=self.socket_path),
+                auto_decompress=False,
+                timeout=aiohttp.ClientTimeout(total=None, connect=5))
+        return self.session
+
+    def stats(self) -> dict:
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'alive': self.alive,
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.alive else 0,
+            'restarts': self.restarts,
+            'lastExit': self.last_exit,
+        }
+
+
+class WorkerPool:
+    """Router in front of N supervised workers"""
+
+    def __init__(self, count: int, argv: list, is_one_shot, socket_dir: str = None):
+        self.owns_socket_dir = not socket_dir
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix='ai-workers-')
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.workers = [Worker(i, os.path.join(self.socket_dir, f'worker-{i}.sock'), argv)
+                        for i in range(max(1, count))]
+        self.is_one_shot = is_one_shot
+        self.routed = [0] * len(self.workers)
+        self._tasks = []
+
+        self.metrics = Registry()
+        self.metrics.gauge('ai_workers_alive', 'Worker processes currently running',
+                           fn=lambda: sum(worker.alive for worker in self.workers))
+        self.metrics.counter('ai_worker_restarts_total', 'Worker processes restarted after exiting',
+                             labelnames=('worker',),
+                             fn=lambda: {str(w.index): w.restarts for w in self.workers})
+        self.metrics.counter('ai_worker_routed_total', 'Requests routed to each worker',
+                             labelnames=('worker',),
+                             fn=lambda: {str(i): count for i, count in enumerate(self.routed)})
+
+    async def supervise(self, app: web.Application):
+        """cleanup_ctx: start the workers with the router, stop them with it"""
+        self._tasks = [asyncio.create_task(worker.supervise()) for worker in self.workers]
+        yield
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        for worker in self.workers:
+            if worker.session is not None:
+                await worker.session.close()
+            if os.path.exists(worker.socket_path):
+                os.remove(worker.socket_path)
+        if self.owns_socket_dir:
+            os.rmdir(self.socket_dir)
+
+    async def proxy(self, request: web.Request) -> web.StreamResponse:
+        """Forward a request to the worker that owns its session"""
+        body = await request.read()
+        try:
+            index = pick_worker(route_key(body, self.is_one_shot), len(self.workers))
+        except Unroutable as e:
+            return web.json_response({'error': str(e)}, status=400)
+        worker = self.workers[index]
+        self.routed[index] += 1
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() not in HOP_BY_HOP and name.lower() != 'host'}
+        try:
+            upstream = await worker.client().request(
+                request.method, f'http://worker{request.path_qs}', data=body, headers=headers)
+        except aiohttp.ClientError as e:
+            print(f"Worker {index} unavailable: {e}", file=sys.stderr)
+            return web.json_response({'error': 'AI service worker is restarting, please retry'},
+                                     status=503, headers={'Retry-After': '1'})
+
+        async with upstream:
+            response = web.StreamResponse(status=upstream.status, headers={
+                name: value for name, value in upstream.headers.items()
+                if name.lower() not in HOP_BY_HOP})
+            if upstream.content_length is not None:
+                response.content_length = upstream.content_length
+            await response.prepare(request)
+            # Streamed replies (SSE/NDJSON) are relayed as they arrive
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+
+    async def _fetch_all(self, path: str) -> list:
+        """GET path from every worker: a (status, body) pair each, None if unreachable"""
+        async def fetch(worker):
+            try:
+                async with worker.client().get(f'http://worker{path}',
+                                               timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    return response.status, await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+        return await asyncio.gather(*(fetch(worker) for worker in self.workers))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """GET /stats -> per-worker process state and each worker's own /stats"""
+        results = await self._fetch_all('/stats')
+        workers = []
+        for worker, result, routed in zip(self.workers, results, self.routed):
+            entry = worker.stats()
+            entry['routed'] = routed
+            entry['stats'] = json.loads(result[1]) if result else None
+            workers.append(entry)
+        return web.json_response({
+            'workers': workers,
+            'alive': sum(worker.alive for worker in self.workers),
+            'count': len(self.workers),
+        }, headers={'Access-Control-Allow-Origin': '*'})
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """GET /metrics -> router metrics plus every worker's, labelled by worker"""
+        results = await self._fetch_all('/metrics')
+        text = self.metrics.render() + merge_metrics(
+            (str(worker.index), result[1].decode('utf-8'))
+            for worker, result in zip(self.workers, results) if result)
+        return web.Response(text=text, content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def handle_profile(self, request: web.Request) -> web.Response:
+        """POST /admin/profile -> profile every worker over the same window"""
+        body = await request.read()
+
+        async def post(worker):
+            try:
+                async with worker.client().post(
+                        f'http://worker{request.path}', data=body,
+                        headers={'Content-Type': 'application/json'},
+                        timeout=aiohttp.ClientTimeout(total=PROFILE_TIMEOUT)) as response:
+                    return response.status, await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                return None
+        results = await asyncio.gather(*(post(worker) for worker in self.workers))
+        return web.json_response({'workers': [{
+            'index': worker.index,
+            'status': result[0] if result else None,
+            'profile': result[1] if result else None,
+        } for worker, result in zip(self.workers, results)]})
+
+    async def handle_healthz(self, request: web.Request) -> web.Response:
+        """GET /healthz -> 200 while the router is serving"""
+        return web.json_response({
+            'status': 'ok',
+            'alive': sum(worker.alive for worker in self.workers),
+            'count': len(self.workers),
+        })
+
+    async def handle_readyz(self, request: web.Request) -> web.Response:
+        """GET /readyz -> 200 only when every worker reports ready"""
+        results = await self._fetch_all('/readyz')
+        workers = [{'index': worker.index, 'ready': bool(result) and result[0] == 200}
+                   for worker, result in zip(self.workers, results)]
+        ready = all(worker['ready'] for worker in workers)
+        return web.json_response(
+            {'status': 'ready' if ready else 'starting', 'workers': workers},
+            status=200 if ready else 503, headers=None if ready else {'Retry-After': '1'})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.cleanup_ctx.append(self.supervise)
+        app.router.add_get('/healthz', self.handle_healthz)
+        app.router.add_get('/readyz', self.handle_readyz)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/stats', self.handle_stats)
+        app.router.add_post('/admin/profile', self.handle_profile)
+        app.router.add_route('*', '/{tail:.*}', self.proxy)
+        return app
+
+
+def merge_metrics(expositions) -> str:
+    """Merge Prometheus text from several workers, adding a worker label
+
+    Samples of one metric family must be contiguous, so lines are grouped by
+    family in first-seen order rather than concatenated per worker.
+    """
+    families = {}
+    for worker, text in expositions:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split(' ', 3)[2]
+                entry = families.setdefault(family, {'meta': [], 'samples': []})
+                if len(entry['meta']) < 2 and line not in entry['meta']:
+                    entry['meta'].append(line)
+                continue
+            match = SAMPLE_LINE.match(line)
+            if not match or family is None:
+                continue
+            name, labels, value = match.groups()
+            worker_label = f'worker="{worker}"'
+            if labels and labels != '{}':
+                labels = f'{{{worker_label},{labels[1:]}'
+            else:
+                labels = f'{{{worker_label}}}'
+            families[family]['samples'].append(f'{name}{labels} {value}')
+    lines = []
+    for entry in families.values():
+        lines.extend(entry['meta'])
+        lines.extend(entry['samples'])
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+async def watch_parent(app: web.Application):
+    """cleanup_ctx for workers: exit if the router dies without stopping us"""
+    parent = os.getppid()
+
+    async def watcher():
+        while True:
+            await asyncio.sleep(2)
+            if os.getppid() != parent:
+                print("AI Service router exited, stopping worker", file=sys.stderr)
+                os._exit(0)
+
+    task = asyncio.create_task(watcher())
+    yield
+    task.cancel()
@@ -2,19 +2,205 @@
 """
 AI Service for FileSolved - Uses Emergent LLM Key via emergentintegrations
 Run with: python3 ai_service.py
+Offline load testing: AI_BACKEND=stub python3 ai_service.py
+
+Configuration (environment):
+  AI_SERVICE_PORT            Port to listen on (default 8002)
+  AI_WORKERS                 Worker processes; above 1 a router on the port forwards
+                             each request to a worker by sessionId hash (default 1)
+  AI_WORKER_SOCKET_DIR       Directory for the workers' Unix sockets (default: a temp dir)
+  AI_BACKEND                 Chat backend: emergent (default) or stub
+  AI_PROVIDER, AI_MODEL      Upstream model, the full tier (default openai / gpt-4o)
+  AI_TIERS_ENABLED           Route short one-shot calls to the fast tier (default true)
+  AI_TIER_FAST_MODEL         provider/model of the fast tier (default openai/gpt-4o-mini)
+  AI_TIER_FAST_KINDS         One-shot kinds sent to the fast tier (default suggest,classify,repair)
+  AI_TIER_FAST_MAX_TOKENS    Longer inputs always go to the full tier (default 2000)
+  AI_TIER_LATENCY_TARGET     p95 seconds; other one-shot kinds move to the fast tier while
+                             the full tier is slower than this (default 0, off)
+  AI_TIER_LATENCY_WINDOW     Seconds of full-tier latency samples considered (default 300)
+  AI_TIER_LATENCY_PROBE      Share of latency-switched calls still sent to the full tier,
+                             to notice when it recovers (default 0.05)
+  AI_PROFILES                JSON file of prompt profiles overriding or adding to the
+                             built-in chat/suggest/classify/summarize/repair ones:
+                             {"profiles": {name: {systemPrompt, model, maxTokens, temperature}}};
+                             a profile with its own model is never re-routed to a tier
+  AI_STUB_LATENCY            Stub: seconds before the first token (default 0.2)
+  AI_STUB_JITTER             Stub: +/- seconds of random latency (default 0.05)
+  AI_STUB_TOKENS_PER_SEC     Stub: generation speed, 0 for instant (default 50)
+  AI_STUB_ERROR_RATE         Stub: fraction of calls that fail (default 0)
+  AI_STUB_SEED               Stub: random seed for jitter and errors (default 0)
+  AI_STUB_RESPONSES          Stub: JSON file of extra {match, response} rules
+  AI_SESSION_MAX_ENTRIES     Max retained chat sessions (default 1000)
+  AI_SESSION_MAX_BYTES       Max estimated bytes held by sessions (default 64MB)
+  AI_SESSION_TTL             Idle seconds before a session is evicted (default 3600)
+  AI_SESSION_SWEEP_INTERVAL  Seconds between idle sweeps (default 60)
+  AI_SESSION_STORE           SQLite file chat sessions are journaled to, so they survive
+                             restarts and eviction (default data/ai_sessions.db next to
+                             this file; "off" keeps sessions in memory only)
+  AI_SESSION_STORE_TTL       Seconds a journaled session is kept after its last turn
+                             (default 604800)
+  AI_SESSION_STORE_PRUNE_INTERVAL  Seconds between pruning and compacting the journal
+                             (default 3600)
+  AI_ONESHOT_PREFIXES        Session ID prefixes that are never retained
+                             (default suggest-,summarize-,classify-,repair-)
+  AI_CACHE_ENABLED           Cache one-shot responses (default true)
+  AI_CACHE_MAX_ENTRIES       Max in-memory cached responses (default 2048)
+  AI_CACHE_MAX_BYTES         Max in-memory cached bytes (default 32MB)
+  AI_CACHE_TTL               Seconds a cached response stays valid (default 86400)
+  AI_CACHE_DIR               Directory for the on-disk cache (default: memory only)
+  AI_CACHE_DISK_MAX_BYTES    Max bytes kept on disk (default 512MB)
+  AI_ANSWER_CACHE_ENABLED    Answer near-duplicate opening chat messages from cache (default true)
+  AI_ANSWER_CACHE_THRESHOLD  Min character-trigram Jaccard similarity for a hit (default 0.8)
+  AI_ANSWER_CACHE_TTL        Seconds a learned answer stays valid (default 86400)
+  AI_ANSWER_CACHE_MAX_ENTRIES  Max learned opening answers (default 512)
+  AI_ANSWER_CACHE_MAX_CHARS  Longer opening messages are never cached (default 300)
+  AI_ANSWER_CACHE_LEARN      Learn answers from live first turns (default false)
+  AI_ANSWER_CACHE_LEARN_MIN_SESSIONS  Distinct sessions that must open with a message
+                             before its answer is learned (default 3)
+  AI_ANSWER_CACHE_SEED       JSON file of curated {"answers": [{message, response}]}
+  AI_BATCH_MAX_ITEMS         Max items accepted by POST /batch (default 100)
+  AI_BATCH_CONCURRENCY       Max batch items sent upstream at once (default 8)
+  AI_MICROBATCH_WINDOW       Seconds to collect concurrent structured requests of the
+                             kinds below into one upstream call (default 0, off; try 0.005)
+  AI_MICROBATCH_MAX_ITEMS    Most requests packed into one call (default 8)
+  AI_MICROBATCH_KINDS        One-shot kinds that are micro-batched (default classify)
+  AI_ROUTER_ENABLED          Answer suggest/classify locally when confident (default true)
+  AI_ROUTER_THRESHOLD        Min local confidence before falling back to the model (default 0.5)
+  AI_ROUTER_CATALOG          Services catalog to index (default src/config/servicesCatalog.js)
+  AI_ROUTER_OPTIONS          Suggest options and classify categories
+                             (default src/config/aiOptions.json)
+  AI_UPSTREAM_CONCURRENCY    Max concurrent upstream calls per provider (default 16);
+                             AI_UPSTREAM_CONCURRENCY_<PROVIDER> overrides one provider
+  AI_QUEUE_MAX               Max requests waiting for an upstream slot (default 64)
+  AI_QUEUE_TIMEOUT           Seconds a request may wait for a slot (default 10)
+  AI_UPSTREAM_TIMEOUT        Seconds allowed for one upstream call, retries included (default 55)
+  AI_ATTEMPT_TIMEOUT         Seconds allowed for each attempt within a call (default 25, 0 off)
+  AI_RETRY_MAX               Retries after a timeout, dropped connection, 429 or 5xx (default 2)
+  AI_RETRY_BASE_DELAY        Backoff before the first retry, doubling after; fully
+                             jittered (default 0.25)
+  AI_RETRY_MAX_DELAY         Longest backoff between retries (default 4)
+  AI_HEDGE_ENABLED           Race a duplicate call once a non-streamed call runs past the
+                             recent latency quantile, if a slot is free (default false)
+  AI_HEDGE_QUANTILE          Latency quantile that triggers a hedge (default 0.95)
+  AI_HEDGE_MIN_DELAY         Never hedge sooner than this many seconds (default 0.5)
+  AI_HEDGE_MIN_SAMPLES       Calls observed per model and route kind before hedging (default 20)
+  AI_BREAKER_FAILURES        Consecutive failures that open a model's circuit breaker (default 5)
+  AI_BREAKER_RESET           Seconds an open breaker waits before a probe call (default 30)
+  AI_FALLBACK_MODEL          provider/model used while the primary's breaker is open;
+                             without one, calls fail fast with 503
+  AI_UPSTREAM_POOL_SIZE      Max upstream connections shared by all sessions
+                             (default AI_UPSTREAM_CONCURRENCY)
+  AI_UPSTREAM_POOL_KEEPALIVE Idle upstream connections kept open (default AI_UPSTREAM_CONCURRENCY)
+  AI_UPSTREAM_POOL_IDLE      Seconds an idle upstream connection is kept (default 30)
+  AI_KEEPALIVE_TIMEOUT       Seconds an idle client connection is kept open (default 75)
+  AI_WARMUP                  Before reporting ready: off, client (load the model SDK,
+                             check credentials, build a chat; default) or request
+                             (also send one short upstream call)
+  AI_WARMUP_RETRY            Seconds between failed warm-up attempts (default 5)
+  AI_HISTORY_COMPACT_TOKENS  History tokens at which older turns are folded into
+                             a rolling summary (default 3000, 0 disables)
+  AI_HISTORY_KEEP_TURNS      Recent exchanges kept verbatim on compaction (default 3)
+  AI_HISTORY_SUMMARY_WORDS   Target length of the rolling summary (default 200)
+  AI_MAX_PROMPT_TOKENS       Hard cap on estimated prompt tokens per turn; a message that
+                             can't fit even without history gets 413 (default 0, off)
+  AI_SESSION_TOKEN_BUDGET    Tokens one chat session may spend in total (default 0, off)
+  AI_CALLER_TOKENS_PER_MINUTE  Tokens one caller may spend per minute, in each worker
+                             process (default 0, off)
+  AI_DOC_ROOTS               Directories documents may be read from (default the
+                             Node API's UPLOAD_DIR and OUTPUT_DIR, else uploads,outputs,
+                             relative to this file)
+  AI_DOC_MAX_BYTES           Larger documents are refused with 413 (default 8MB, 0 off)
+  AI_DOC_MAX_CHUNKS          Documents needing more chunks are refused with 413
+                             (default 64, 0 off); non-text files get 415
+  AI_DOC_CHUNK_TOKENS        Tokens per document chunk (default 3000)
+  AI_DOC_CONCURRENCY         Chunks summarized at once per document (default 4)
+  AI_DOC_FAN_IN              Partial summaries merged per reduce call (default 8)
+  AI_TRACE_FILE              JSONL file request traces are appended to (default
+                             data/ai_traces.jsonl next to this file, one per worker
+                             with AI_WORKERS > 1; "off" disables tracing)
+  AI_TRACE_SAMPLE            Fraction of requests whose trace is kept (default 0.01)
+  AI_TRACE_SLOW              Requests slower than this many seconds are always kept
+                             (default 5, 0 off)
+  AI_TRACE_MAX_BYTES         Trace file size at which it is rotated to .1 (default 64MB)
+  AI_PROFILE_DIR             Where profiles from POST /admin/profile are written
+                             (default data/profiles next to this file)
+  AI_PROFILE_INTERVAL        Seconds between profiler stack samples (default 0.01)
+  AI_PROFILE_MAX_SECONDS     Longest profiling window allowed (default 60)
+
+Endpoints:
+  POST /          {sessionId, message[, stream | schema][, profile][, caller]} chat turn;
+                  with a JSON Schema the reply is validated and returned parsed as `data`
+  POST /batch     {items: [{sessionId, message[, schema][, profile]}][, schema][, caller]}
+                  bounded-parallel batch
+  POST /summarize/document  {path, maxLength[, stream][, caller]} whole-document summary
+  POST /sessions/delete  {sessionId} forget a chat session, in memory and on disk
+  POST /route     {task: suggest|classify, text} local answer, or local: false
+                  when the caller should ask the model
+  POST /admin/profile  {seconds} sample the event loop's stacks for a window; writes
+                  folded stacks to AI_PROFILE_DIR and returns the hottest functions
+                  (with AI_WORKERS > 1: every worker, over the same window)
+                  Replies carry the request's token `usage`; a turn over the session
+                  or caller budget is refused with 429
+  GET  /stats     JSON counters for sessions, admission, caches and the upstream pool
+                  (with AI_WORKERS > 1: per-worker process state and stats)
+  GET  /metrics   Prometheus metrics (with AI_WORKERS > 1: every worker's,
+                  labelled worker="N", plus the router's own)
+  GET  /healthz   Liveness: 200 while the process is serving
+  GET  /readyz    Readiness: 200 once warm-up has succeeded, 503 before
+                  (with AI_WORKERS > 1: once every worker is ready)
+
+Every response carries an X-Request-ID: the one the request came with, or a
+new one. Traces in AI_TRACE_FILE are keyed by it.
 """
 
+# Imported first so the cost of everything below can be measured
+import time
+PROCESS_STARTED = time.perf_counter()
+
 import os
 import sys
 import json
 import asyncio
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import contextvars
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+from aiohttp import web
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from ai.admission import AdmissionController, Overloaded
+from ai.answers import AnswerCache
+from ai.batch import fan_out
+from ai.budgets import BudgetExceeded, TokenLedger, Usage
+from ai.cache import DiskStore, ResponseCache, cache_key
+from ai.classifier import LocalClassifier, load_catalog, load_options
+from ai.config import env_bool, env_float, env_int, env_list, env_str
+from ai.documents import (DocumentError, DocumentTooLarge, NotText, check_document,
+                          resolve_document, summarize_document)
+from ai.journal import SessionJournal
+from ai.history import (PromptTooLong, compacted_system_message, history_tokens,
+                        split_history, summary_prompt, truncate_to_tokens)
+from ai.metrics import Registry
+from ai.microbatch import MicroBatcher, pack, unpack
+from ai.profiler import ProfilerBusy, SamplingProfiler
+from ai.profiles import Profile, ProfileRegistry
+from ai.providers import ProviderError, create_provider
+from ai.resilience import Resilience, RetryPolicy, is_retryable
+from ai.sessions import DEFAULT_ONE_SHOT_PREFIXES, SessionStore
+from ai.streaming import EventStream, requested_format
+from ai.structured import StructuredOutputError, parse, repair_prompt, schema_instruction
+from ai.tiers import FAST, TierRouter
+from ai.tokens import count_tokens
+from ai.tracing import Tracer, record_span, request_id_from, span
+from ai.workers import WORKER_ENV, WorkerPool, watch_parent
+
+# The model SDK is imported by the provider on first use (or during warm-up),
+# so this only covers aiohttp and the service's own modules
+IMPORT_SECONDS = time.perf_counter() - PROCESS_STARTED
 
 # System prompt for FileSolved AI Assistant
 SYSTEM_PROMPT = """You are the FileSolved AI Assistant - a helpful guide for people navigating disputes with landlords, employers, government agencies, and other powerful entities.
@@ -48,86 +234,1525 @@ Key tools:
 
 Be concise, helpful, and action-oriented. Ask clarifying questions when needed. Keep responses under 150 words."""
 
+MODEL_PROVIDER = env_str('AI_PROVIDER', 'openai')
+MODEL_NAME = env_str('AI_MODEL', 'gpt-4o')
+
+# Chat backend; "stub" answers locally for offline load tests and profiling
+provider = create_provider(env_str('AI_BACKEND', 'emergent'))
+
+
+def build_profiles():
+    registry = ProfileRegistry(SYSTEM_PROMPT, MODEL_PROVIDER, MODEL_NAME)
+    profiles_file = env_str('AI_PROFILES')
+    if profiles_file:
+        try:
+            registry.load(profiles_file)
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Could not load prompt profiles from {profiles_file}: {e}", file=sys.stderr)
+    return registry
+
+
+# Prompt profiles: chat sessions use SYSTEM_PROMPT, one-shot calls get a short
+# task-specific prompt (and their own model settings) unless a request names one
+profiles = build_profiles()
+
+def build_tiers():
+    if not env_bool('AI_TIERS_ENABLED', True):
+        return None
+    return TierRouter(
+        env_str('AI_TIER_FAST_MODEL', 'openai/gpt-4o-mini'),
+        fast_kinds=env_list('AI_TIER_FAST_KINDS', 'suggest,classify,repair'),
+        fast_max_tokens=env_int('AI_TIER_FAST_MAX_TOKENS', 2000),
+        latency_target=env_float('AI_TIER_LATENCY_TARGET', 0),
+        latency_window=env_float('AI_TIER_LATENCY_WINDOW', 300),
+        probe_share=env_float('AI_TIER_LATENCY_PROBE', 0.05)
+    )
+
+
+# Model tiers: short suggest/classify-style calls go to a smaller, faster
+# model; chat sessions and long inputs stay on the profile's full model
+tiers = build_tiers()
+
+# Route kinds reported in metrics; anything else is a chat session
+ONE_SHOT_KINDS = ('suggest', 'summarize', 'classify', 'repair')
+
+
+# Route kind of chat requests rejected before their sessionId was read
+UNKNOWN_KIND = 'unknown'
+
+
+def request_kind(session_id: str) -> str:
+    prefix = session_id.split('-', 1)[0]
+    return prefix if prefix in ONE_SHOT_KINDS else 'chat'
+
+
+# Chat instances are kept alive across requests so the underlying client
+# connections are reused, but the store is bounded: idle sessions expire,
+# the least recently used are evicted at the caps, and one-shot sessions
+# (suggest-/summarize-/classify-) are never retained.
+sessions = SessionStore(
+    max_entries=env_int('AI_SESSION_MAX_ENTRIES', 1000),
+    max_bytes=env_int('AI_SESSION_MAX_BYTES', 64 * 1024 * 1024),
+    idle_ttl=env_float('AI_SESSION_TTL', 3600),
+    one_shot_prefixes=env_list('AI_ONESHOT_PREFIXES', ','.join(DEFAULT_ONE_SHOT_PREFIXES))
+)
+SESSION_SWEEP_INTERVAL = env_float('AI_SESSION_SWEEP_INTERVAL', 60)
+
+# Where the BASE_DIR-relative defaults below live
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_journal():
+    path = env_str('AI_SESSION_STORE', os.path.join(BASE_DIR, 'data', 'ai_sessions.db'))
+    if path.lower() in ('off', 'false', 'none', '0'):
+        return None
+    return SessionJournal(path, ttl=env_float('AI_SESSION_STORE_TTL', 7 * 86400))
+
+
+# Chat turns are journaled to disk in the background; a session that isn't
+# in memory (after a restart or eviction) is rebuilt from it on its next turn
+journal = build_journal()
+JOURNAL_PRUNE_INTERVAL = env_float('AI_SESSION_STORE_PRUNE_INTERVAL', 3600)
+
+
+def build_tracer():
+    path = env_str('AI_TRACE_FILE', os.path.join(BASE_DIR, 'data', 'ai_traces.jsonl'))
+    if path.lower() in ('off', 'false', 'none', '0'):
+        return None
+    worker_id = env_str('AI_WORKER_ID')
+    if worker_id:
+        # Each worker appends to (and rotates) a file of its own
+        root, ext = os.path.splitext(path)
+        path = f'{root}.worker-{worker_id}{ext}'
+    return Tracer(path, sample_rate=env_float('AI_TRACE_SAMPLE', 0.01),
+                  slow=env_float('AI_TRACE_SLOW', 5),
+                  max_bytes=env_int('AI_TRACE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+# Requests record where their time went (parse, session, lock, queue,
+# upstream, serialize); a sample of them, and every slow one, is written out
+tracer = build_tracer()
+profiler = SamplingProfiler(
+    env_str('AI_PROFILE_DIR', os.path.join(BASE_DIR, 'data', 'profiles')),
+    interval=env_float('AI_PROFILE_INTERVAL', 0.01),
+    max_seconds=env_float('AI_PROFILE_MAX_SECONDS', 60)
+)
+
+# Long conversations keep recent turns verbatim and fold older ones into a
+# rolling summary, so per-turn prompt size stays flat
+HISTORY_COMPACT_TOKENS = env_int('AI_HISTORY_COMPACT_TOKENS', 3000)
+HISTORY_KEEP_TURNS = env_int('AI_HISTORY_KEEP_TURNS', 3)
+HISTORY_SUMMARY_WORDS = env_int('AI_HISTORY_SUMMARY_WORDS', 200)
+MAX_PROMPT_TOKENS = env_int('AI_MAX_PROMPT_TOKENS', 0)
+
+# One-shot calls carry their whole context in the message, so identical
+# prompts get identical answers and can be served from cache
+def build_response_cache():
+    if not env_bool('AI_CACHE_ENABLED', True):
+        return None
+    cache_dir = env_str('AI_CACHE_DIR')
+    disk = None
+    if cache_dir:
+        disk = DiskStore(cache_dir, env_int('AI_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+    return ResponseCache(
+        max_entries=env_int('AI_CACHE_MAX_ENTRIES', 2048),
+        max_bytes=env_int('AI_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+        ttl=env_float('AI_CACHE_TTL', 86400),
+        disk=disk
+    )
+
+
+response_cache = build_response_cache()
+
+
+def build_answer_cache():
+    if not env_bool('AI_ANSWER_CACHE_ENABLED', True):
+        return None
+    cache = AnswerCache(
+        threshold=env_float('AI_ANSWER_CACHE_THRESHOLD', 0.8),
+        ttl=env_float('AI_ANSWER_CACHE_TTL', 86400),
+        max_entries=env_int('AI_ANSWER_CACHE_MAX_ENTRIES', 512),
+        max_chars=env_int('AI_ANSWER_CACHE_MAX_CHARS', 300),
+        learn=env_bool('AI_ANSWER_CACHE_LEARN', False),
+        learn_min_sessions=env_int('AI_ANSWER_CACHE_LEARN_MIN_SESSIONS', 3)
+    )
+    seed_file = env_str('AI_ANSWER_CACHE_SEED')
+    if seed_file:
+        try:
+            print(f"Seeded {cache.load(seed_file)} opening answers from {seed_file}", file=sys.stderr)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not seed answer cache from {seed_file}: {e}", file=sys.stderr)
+    return cache
+
+
+# First turns of chat sessions that closely match an earlier (or curated)
+# opening message are answered locally without an upstream call
+answer_cache = build_answer_cache()
+
+# Token totals per session and caller; per-session and per-minute budgets
+# stop one conversation or client from taking everyone's upstream capacity
+ledger = TokenLedger(
+    session_budget=env_int('AI_SESSION_TOKEN_BUDGET', 0),
+    caller_per_minute=env_int('AI_CALLER_TOKENS_PER_MINUTE', 0)
+)
+
+# Token usage of the request being handled; background work started by a
+# request (history compaction) is charged to the same caller
+current_usage = contextvars.ContextVar('current_usage', default=None)
+
+BATCH_MAX_ITEMS = env_int('AI_BATCH_MAX_ITEMS', 100)
+BATCH_CONCURRENCY = env_int('AI_BATCH_CONCURRENCY', 8)
+
+
+def build_microbatcher():
+    window = env_float('AI_MICROBATCH_WINDOW', 0)
+    if window <= 0:
+        return None
+    return MicroBatcher(lambda key, items: run_structured_batch(key, items), window,
+                        env_int('AI_MICROBATCH_MAX_ITEMS', 8))
+
+
+# Concurrent structured one-shot calls of these kinds (a case file's uploads
+# being classified) share one upstream call instead of one each
+microbatcher = build_microbatcher()
+MICROBATCH_KINDS = frozenset(env_list('AI_MICROBATCH_KINDS', 'classify'))
+
+# Whole-document summaries are read straight from the upload directories
+# The same directories the Node API stores uploads and outputs in, unless
+# AI_DOC_ROOTS names others
+DOC_ROOTS = [os.path.join(BASE_DIR, root) for root in env_list('AI_DOC_ROOTS') or [
+    env_str('UPLOAD_DIR', 'uploads'), env_str('OUTPUT_DIR', 'outputs')]]
+DOC_MAX_BYTES = env_int('AI_DOC_MAX_BYTES', 8 * 1024 * 1024)
+DOC_MAX_CHUNKS = env_int('AI_DOC_MAX_CHUNKS', 64)
+DOC_CHUNK_TOKENS = env_int('AI_DOC_CHUNK_TOKENS', 3000)
+DOC_CONCURRENCY = env_int('AI_DOC_CONCURRENCY', 4)
+DOC_FAN_IN = env_int('AI_DOC_FAN_IN', 8)
+
+
+def build_classifier():
+    if not env_bool('AI_ROUTER_ENABLED', True):
+        return None
+    catalog = env_str('AI_ROUTER_CATALOG', os.path.join(BASE_DIR, 'src', 'config', 'servicesCatalog.js'))
+    options = env_str('AI_ROUTER_OPTIONS', os.path.join(BASE_DIR, 'src', 'config', 'aiOptions.json'))
+    try:
+        return LocalClassifier(load_catalog(catalog), load_options(options))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Local suggest/classify router disabled: {e}", file=sys.stderr)
+        return None
+
+
+# Suggest and classify are closed-set choices; a TF-IDF index over the
+# catalog and option lists answers most of them without a model call
+classifier = build_classifier()
+ROUTER_THRESHOLD = env_float('AI_ROUTER_THRESHOLD', 0.5)
+
+# Upstream admission: a bounded queue in front of a fixed number of slots
+# per provider, so load spikes are shed quickly instead of piling up
+UPSTREAM_TIMEOUT = env_float('AI_UPSTREAM_TIMEOUT', 55)
+admission = {}
+
+# Per-attempt deadlines, jittered retries, optional hedging and a circuit
+# breaker (with fallback model) per upstream model
+resilience = Resilience(
+    policy=RetryPolicy(
+        retries=env_int('AI_RETRY_MAX', 2),
+        base_delay=env_float('AI_RETRY_BASE_DELAY', 0.25),
+        max_delay=env_float('AI_RETRY_MAX_DELAY', 4)
+    ),
+    attempt_timeout=env_float('AI_ATTEMPT_TIMEOUT', 25),
+    hedge=env_bool('AI_HEDGE_ENABLED', False),
+    hedge_quantile=env_float('AI_HEDGE_QUANTILE', 0.95),
+    hedge_min_delay=env_float('AI_HEDGE_MIN_DELAY', 0.5),
+    hedge_min_samples=env_int('AI_HEDGE_MIN_SAMPLES', 20),
+    failure_threshold=env_int('AI_BREAKER_FAILURES', 5),
+    reset_timeout=env_float('AI_BREAKER_RESET', 30),
+    fallback_model=env_str('AI_FALLBACK_MODEL') or None
+)
+
+
+def admission_for(provider: str) -> AdmissionController:
+    if provider not in admission:
+        admission[provider] = AdmissionController(
+            provider,
+            concurrency=env_int(f'AI_UPSTREAM_CONCURRENCY_{provider.upper()}',
+                                env_int('AI_UPSTREAM_CONCURRENCY', 16)),
+            max_queue=env_int('AI_QUEUE_MAX', 64),
+            queue_timeout=env_float('AI_QUEUE_TIMEOUT', 10)
+        )
+    return admission[provider]
+
+
+# Readiness, reported on GET /readyz once warm-up has succeeded
+WARMUP_MODE = env_str('AI_WARMUP', 'client')
+WARMUP_RETRY = env_float('AI_WARMUP_RETRY', 5)
+readiness = {
+    'ready': False,
+    'phase': 'starting',
+    'error': None,
+    'importSeconds': round(IMPORT_SECONDS, 4),
+    'warmupSeconds': None,
+    'startupSeconds': None,
+}
 
-# Store chat instances
-chats = {}
+# Metrics exposed on GET /metrics (Prometheus text format)
+metrics = Registry()
+REQUESTS = metrics.counter(
+    'ai_requests_total', 'Requests handled by route kind and HTTP status', ('kind', 'status'))
+REQUESTS_IN_FLIGHT = metrics.gauge(
+    'ai_requests_in_flight', 'Requests currently being handled')
+REQUEST_LATENCY = metrics.histogram(
+    'ai_request_duration_seconds', 'Total time to handle a request', ('kind',))
+QUEUE_WAIT = metrics.histogram(
+    'ai_queue_wait_seconds', 'Time spent waiting for an upstream slot', ('provider',))
+UPSTREAM_LATENCY = metrics.histogram(
+    'ai_upstream_duration_seconds', 'Upstream model call latency', ('provider', 'kind'))
+UPSTREAM_ERRORS = metrics.counter(
+    'ai_upstream_errors_total', 'Upstream model calls that failed or timed out', ('provider', 'kind'))
+TOKENS = metrics.counter(
+    'ai_tokens_total', 'Prompt and completion tokens by route kind and prompt profile',
+    ('kind', 'profile', 'type'))
+metrics.gauge(
+    'ai_upstream_in_flight', 'Upstream calls currently running', ('provider',),
+    fn=lambda: {name: ctl.in_flight for name, ctl in admission.items()})
+metrics.gauge(
+    'ai_upstream_queue_depth', 'Requests waiting for an upstream slot', ('provider',),
+    fn=lambda: {name: ctl.waiting for name, ctl in admission.items()})
+metrics.counter(
+    'ai_admission_rejected_total', 'Requests shed by admission control', ('provider', 'reason'),
+    fn=lambda: {key: value for name, ctl in admission.items() for key, value in (
+        ((name, 'queue_full'), ctl.rejected), ((name, 'queue_timeout'), ctl.timed_out))})
+ROUTED = metrics.counter(
+    'ai_router_requests_total', 'Suggest/classify requests answered locally or sent to the model',
+    ('task', 'result'))
+ROUTER_LATENCY = metrics.histogram(
+    'ai_router_duration_seconds', 'Time to score a suggest/classify request locally', ('task',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+STRUCTURED = metrics.counter(
+    'ai_structured_responses_total',
+    'Schema-validated replies by outcome (ok, batched, escalated, repaired, failed)',
+    ('kind', 'result'))
+metrics.counter(
+    'ai_upstream_retries_total', 'Upstream attempts retried after a transient failure', ('kind',),
+    fn=lambda: dict(resilience.retries))
+metrics.counter(
+    'ai_upstream_hedges_total', 'Duplicate upstream attempts started, and how many won',
+    ('kind', 'result'),
+    fn=lambda: {key: value for kind, started in resilience.hedges.items() for key, value in (
+        ((kind, 'started'), started), ((kind, 'won'), resilience.hedge_wins[kind]))})
+metrics.counter(
+    'ai_upstream_fallbacks_total', 'Calls sent to the fallback model while a breaker was open',
+    ('model',), fn=lambda: dict(resilience.fallbacks))
+metrics.gauge(
+    'ai_circuit_open', 'Whether a model\'s circuit breaker is open (0.5 while half-open)', ('model',),
+    fn=lambda: {model: {'closed': 0, 'half_open': 0.5, 'open': 1}[breaker.state]
+                for model, breaker in resilience.breakers.items()})
+BUDGET_REJECTED = metrics.counter(
+    'ai_budget_rejections_total', 'Turns refused for exceeding a token budget', ('scope',))
+metrics.counter(
+    'ai_tier_requests_total', 'Requests routed to each model tier, by kind and reason',
+    ('tier', 'kind', 'reason'), fn=lambda: dict(tiers.decisions) if tiers is not None else {})
+metrics.counter(
+    'ai_tier_quality_fallbacks_total', 'Fast-tier replies redone on the full tier', ('kind',),
+    fn=lambda: dict(tiers.quality_fallbacks) if tiers is not None else {})
+TIER_LATENCY = metrics.histogram(
+    'ai_tier_duration_seconds', 'Upstream call latency by model tier', ('tier', 'kind'))
+MICROBATCHED = metrics.counter(
+    'ai_microbatch_requests_total',
+    'Structured requests offered to the micro-batcher, by outcome (batched, solo, fallback)',
+    ('kind', 'result'))
+MICROBATCH_SIZE = metrics.histogram(
+    'ai_microbatch_size', 'Requests packed into each micro-batched upstream call', ('kind',),
+    buckets=(2, 3, 4, 6, 8, 12, 16, 32))
+COMPACTIONS = metrics.counter(
+    'ai_history_compactions_total', 'Chat history compactions by result', ('result',))
+metrics.gauge('ai_ready', 'Whether the service reports ready', fn=lambda: int(readiness['ready']))
+metrics.gauge(
+    'ai_startup_seconds', 'Time spent starting up by phase', ('phase',),
+    fn=lambda: {phase: readiness[key] for phase, key in (
+        ('import', 'importSeconds'), ('warmup', 'warmupSeconds'), ('total', 'startupSeconds'))
+        if readiness[key] is not None})
+metrics.gauge('ai_sessions', 'Retained chat sessions', fn=lambda: len(sessions))
+metrics.gauge('ai_session_bytes', 'Estimated bytes held by chat sessions',
+              fn=lambda: sessions.total_bytes)
+metrics.counter('ai_session_evictions_total', 'Chat sessions evicted', ('reason',),
+                fn=lambda: dict(sessions.evictions))
+RESTORES = metrics.counter(
+    'ai_session_restores_total', 'Chat sessions looked up in the journal on first access',
+    ('result',))
+RESTORE_LATENCY = metrics.histogram(
+    'ai_session_restore_seconds', 'Time to reload a chat session from the journal and rebuild it',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+metrics.counter(
+    'ai_session_journal_writes_total', 'Session journal operations written to disk',
+    fn=lambda: journal.written if journal is not None else 0)
+metrics.gauge(
+    'ai_session_journal_pending', 'Session journal operations waiting to be written',
+    fn=lambda: journal.backlog if journal is not None else 0)
+metrics.counter(
+    'ai_answer_cache_lookups_total', 'Opening chat message lookups in the answer cache', ('result',),
+    fn=lambda: {'hit': answer_cache.hits, 'miss': answer_cache.misses}
+    if answer_cache is not None else {})
+metrics.gauge('ai_answer_cache_entries', 'Opening answers held by the answer cache',
+              fn=lambda: len(answer_cache) if answer_cache is not None else 0)
+metrics.gauge(
+    'ai_upstream_pool_connections', 'Shared upstream connections by state', ('state',),
+    fn=lambda: {state: provider.pool.stats()[state] for state in ('active', 'idle')}
+    if provider.pool else {})
+metrics.gauge(
+    'ai_upstream_pool_max_connections', 'Size limit of the shared upstream pool',
+    fn=lambda: provider.pool.max_connections if provider.pool else 0)
+metrics.counter(
+    'ai_response_cache_lookups_total', 'One-shot response cache lookups', ('result',),
+    fn=lambda: {'hit': response_cache.hits, 'disk_hit': response_cache.disk_hits,
+                'miss': response_cache.misses} if response_cache is not None else {})
 
 
-async def get_response(session_id: str, message: str) -> str:
-    """Get AI response for a message"""
-    api_key = os.environ.get('EMERGENT_LLM_KEY')
-    if not api_key:
-        raise ValueError("EMERGENT_LLM_KEY not found")
+@asynccontextmanager
+async def upstream_turn(session):
+    """Hold the session's turn lock and an upstream slot for one model call
     
-    # Create new chat instance for each session
-    if session_id not in chats:
-        chats[session_id] = LlmChat(
-            api_key=api_key,
-            session_id=session_id,
-            system_message=SYSTEM_PROMPT
-        ).with_model("openai", "gpt-4o")
+    Turns within a session are serialised so concurrent messages don't
+    interleave the conversation history; different sessions run in parallel
+    up to the provider's concurrency limit.
+    """
+    model_provider = provider_of(session.model)
+    locking = time.perf_counter()
+    async with session.lock:
+        record_span('lock', locking)
+        waited = time.perf_counter()
+        async with admission_for(model_provider).admit():
+            QUEUE_WAIT.observe(time.perf_counter() - waited, provider=model_provider)
+            record_span('queue', waited, provider=model_provider)
+            yield
+
+
+@asynccontextmanager
+async def upstream_call(kind: str, model: str = f'{MODEL_PROVIDER}/{MODEL_NAME}'):
+    """Time one upstream model call and bound it by the upstream timeout"""
+    model_provider = provider_of(model)
+    started = time.monotonic()
+    try:
+        with span('upstream', kind=kind, model=model):
+            async with asyncio.timeout(UPSTREAM_TIMEOUT):
+                yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(provider=model_provider, kind=kind)
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        UPSTREAM_LATENCY.observe(elapsed, provider=model_provider, kind=kind)
+    if tiers is not None:
+        tiers.observe(model, kind, elapsed)
+        TIER_LATENCY.observe(elapsed, tier=tiers.tier_of(model), kind=kind)
+
+
+def provider_of(model: str) -> str:
+    return model.partition('/')[0]
+
+
+def route_model(session_id: str, message: str, profile) -> str:
+    """The provider/model for a request: a pinned profile's own, else its tier's"""
+    if tiers is None or profile.pinned:
+        return profile.model
+    tier, _ = tiers.pick(request_kind(session_id), count_tokens(message),
+                         one_shot=sessions.is_one_shot(session_id))
+    return tiers.fast_model if tier == FAST else profile.model
+
+
+def new_chat(session_id: str, profile, system_message: str = None, model: str = None):
+    """Create a chat instance for a session from its prompt profile (optionally on another model)"""
+    model_provider, model_name = profile.model_provider, profile.model_name
+    if model and model != profile.model:
+        model_provider, _, model_name = model.partition('/')
+    return provider.create_chat(
+        session_id, system_message or profile.system_prompt, model_provider,
+        model_name, max_tokens=profile.max_tokens, temperature=profile.temperature)
+
+
+def fresh_chat(session, model: str = None):
+    """A new chat seeded from the session's summary and transcript"""
+    return new_chat(session.session_id, session.profile, compacted_system_message(
+        session.profile.system_prompt, session.summary, session.history), model or session.model)
+
+
+def open_session(session_id: str, profile=None, model: str = None):
+    """Look up (or create) the chat session for session_id"""
+    # Fail before touching the store if the backend isn't usable
+    provider.check()
+    profile = profile or profiles.resolve(None, request_kind(session_id))
     
-    chat = chats[session_id]
-    user_message = UserMessage(text=message)
-    response = await chat.send_message(user_message)
+    # Create new chat instance for each session; an existing session keeps
+    # the profile and model it was created with
+    model = model or profile.model
+    session = sessions.get(session_id, lambda: new_chat(session_id, profile, model=model))
+    if session.profile is None:
+        session.profile = profile
+        session.model = model
+    return session
+
+
+def estimate_prompt_tokens(session, message: str) -> int:
+    """Tokens sent upstream for the next turn: system prompt, summary, history, message"""
+    return session.profile.prompt_tokens + session.tokens + count_tokens(message)
+
+
+def request_usage() -> Usage:
+    """The current request's usage, or a throwaway one outside a request"""
+    usage = current_usage.get()
+    return usage if usage is not None else Usage()
+
+
+def ledger_session(session):
+    # One-shot calls only count against their caller
+    return session.session_id if session.retained else None
+
+
+def admit_tokens(session_id: str, prompt_tokens: int):
+    """Check the session's and caller's token budgets and charge prompt_tokens"""
+    try:
+        ledger.admit(session_id, request_usage().caller, prompt_tokens)
+    except BudgetExceeded as e:
+        BUDGET_REJECTED.inc(scope=e.scope)
+        raise
+
+
+def admit_turn(session, message: str):
+    admit_tokens(ledger_session(session), estimate_prompt_tokens(session, message))
+
+
+def finish_turn(session, message: str, response: str) -> dict:
+    """Record a completed turn and return its (estimated) token usage"""
+    prompt_tokens = estimate_prompt_tokens(session, message)
+    completion_tokens = count_tokens(response)
+    kind = request_kind(session.session_id)
+    profile = session.profile
+    usage = request_usage()
+    usage.add(prompt_tokens, completion_tokens, session.model)
+    ledger.complete(ledger_session(session), usage.caller, completion_tokens)
+    TOKENS.inc(prompt_tokens, kind=kind, profile=profile.name, type='prompt')
+    TOKENS.inc(completion_tokens, kind=kind, profile=profile.name, type='completion')
+    profile.record(prompt_tokens, completion_tokens)
+    if answer_cache is not None and session.retained and session.turns == 0 and profile.name == 'chat':
+        answer_cache.learn(message, response, session.session_id)
+    sessions.record_turn(session, message, response,
+                         tokens=count_tokens(message) + completion_tokens)
+    if journal is not None and session.retained:
+        journal.append_turn(session.session_id, profile.name, message, response)
+    
+    # Compact in the background so the next turn doesn't wait for it
+    if session.retained and 0 < HISTORY_COMPACT_TOKENS < session.tokens:
+        start_compaction(session)
+    
+    return {
+        'promptTokens': prompt_tokens,
+        'completionTokens': completion_tokens,
+        'totalTokens': prompt_tokens + completion_tokens
+    }
+
+
+def rebuild_chat(session):
+    """Replace a session's chat with one seeded from its summary and recent turns"""
+    session.chat = fresh_chat(session)
+    session.tokens = count_tokens(session.summary) + history_tokens(session.history)
+    held = sum(len(content.encode('utf-8')) for _, content in session.history)
+    sessions.resize(session, 2 * (held + len(session.summary.encode('utf-8'))))
+
+
+async def compact_session(session, keep_turns: int):
+    """Fold all but the last keep_turns exchanges into the rolling summary"""
+    try:
+        older, _ = split_history(session.history, keep_turns)
+        if not older:
+            return
+        prompt = summary_prompt(session.summary, older, HISTORY_SUMMARY_WORDS)
+        summary = await get_response(f'summarize-history-{uuid.uuid4().hex}', prompt)
+        
+        # Turns may have landed while we were summarising; only the ones we
+        # summarised are dropped, everything newer stays verbatim
+        async with session.lock:
+            session.summary = truncate_to_tokens(summary.strip(), max(HISTORY_COMPACT_TOKENS // 2, 256))
+            session.history = session.history[len(older):]
+            rebuild_chat(session)
+            save_snapshot(session)
+        COMPACTIONS.inc(result='ok')
+    except Exception as e:
+        COMPACTIONS.inc(result='error')
+        print(f"History compaction failed for {session.session_id}: {e}", file=sys.stderr)
+    finally:
+        session.compacting = None
+
+
+def start_compaction(session, keep_turns: int = HISTORY_KEEP_TURNS) -> asyncio.Task:
+    """Start compacting a session unless a compaction is already running"""
+    if session.compacting is None:
+        session.compacting = asyncio.create_task(compact_session(session, keep_turns))
+    return session.compacting
+
+
+async def enforce_prompt_budget(session, message: str):
+    """Compact (and as a last resort trim) history until the turn fits the prompt cap
+    
+    Raises PromptTooLong when the system prompt and message alone are over it.
+    """
+    if MAX_PROMPT_TOKENS <= 0 or not session.retained:
+        return
+    room = MAX_PROMPT_TOKENS - session.profile.prompt_tokens - count_tokens(message)
+    if room < 0:
+        raise PromptTooLong(f"Message is too long ({count_tokens(message)} tokens; the prompt "
+                            f"limit is {MAX_PROMPT_TOKENS} including the system prompt)")
+    for keep_turns in (HISTORY_KEEP_TURNS, 0):
+        if estimate_prompt_tokens(session, message) <= MAX_PROMPT_TOKENS:
+            return
+        await asyncio.shield(start_compaction(session, keep_turns))
+    
+    if estimate_prompt_tokens(session, message) > MAX_PROMPT_TOKENS:
+        async with session.lock:
+            session.history = []
+            session.summary = truncate_to_tokens(session.summary, room)
+            rebuild_chat(session)
+            save_snapshot(session)
+        COMPACTIONS.inc(result='trimmed')
+
+
+async def cached_first_turn(session, message: str):
+    """Answer a session's opening message from the answer cache, or return None
+    
+    On a hit the exchange is recorded and the chat rebuilt with it in the
+    transcript, so the next turn has the same context as after a live reply.
+    """
+    if answer_cache is None or not session.retained or session.turns or session.profile.name != 'chat':
+        return None
+    async with session.lock:
+        if session.turns:
+            return None
+        hit = answer_cache.lookup(message)
+        if hit is None:
+            return None
+        answer, _ = hit
+        sessions.record_turn(session, message, answer,
+                             tokens=count_tokens(message) + count_tokens(answer))
+        rebuild_chat(session)
+        if journal is not None:
+            journal.append_turn(session.session_id, session.profile.name, message, answer)
+    return answer
+
+
+def save_snapshot(session):
+    """Journal a session's summary and transcript after they were rewritten"""
+    if journal is not None and session.retained:
+        journal.snapshot(session.session_id, session.profile.name, session.summary,
+                         session.history, session.turns)
+
+
+async def restore_session(session_id: str, profile=None):
+    """Rebuild a chat session that isn't in memory from the journal, if it's there
+    
+    The session gets the profile it was saved with, its summary and
+    transcript, and a chat seeded from them, as after a history compaction.
+    """
+    if journal is None or session_id in sessions or sessions.is_one_shot(session_id):
+        return
+    started = time.perf_counter()
+    saved = await journal.load(session_id)
+    if saved is None:
+        RESTORES.inc(result='miss')
+        return
+    # Another request for the same session may have restored it meanwhile
+    if session_id in sessions:
+        return
+    if saved['profile'] in profiles:
+        profile = profiles.get(saved['profile'])
+    session = open_session(session_id, profile)
+    session.summary = saved['summary']
+    session.history = saved['history']
+    session.turns = saved['turns']
+    rebuild_chat(session)
+    RESTORES.inc(result='hit')
+    RESTORE_LATENCY.observe(time.perf_counter() - started)
+
+
+def one_shot_cache_key(session_id: str, message: str, profile, model: str = None):
+    """Cache key for a one-shot request, or None if it must not be cached"""
+    if response_cache is None or not sessions.is_one_shot(session_id):
+        return None
+    return cache_key(profile.cache_identity(model), profile.system_prompt, message)
+
+
+async def get_response(session_id: str, message: str, profile_name: str = None,
+                       model: str = None) -> str:
+    """Get AI response for a message (on model, or the one the tier router picks)"""
+    kind = request_kind(session_id)
+    profile = profiles.resolve(profile_name, kind)
+    model = model or route_model(session_id, message, profile)
+    key = one_shot_cache_key(session_id, message, profile, model)
+    if key:
+        response = await response_cache.get_or_compute(
+            key, lambda: send_turn(session_id, message, profile, model))
+    else:
+        response = await send_turn(session_id, message, profile, model)
+    
+    # An empty fast-tier reply is worth one more try on the full model
+    if not response.strip() and model != profile.model:
+        tiers.quality_fallback(kind)
+        return await get_response(session_id, message, profile_name, profile.model)
     return response
 
 
-class AIHandler(BaseHTTPRequestHandler):
-    """HTTP handler for AI requests"""
+async def get_structured(session_id: str, message: str, schema: dict,
+                         profile_name: str = None) -> dict:
+    """Get a reply as JSON matching schema: {response, data, repaired}
+    
+    A fast-tier reply that doesn't parse or validate is asked again of the
+    full model. A full-model reply that fails gets one repair call which
+    sees only the bad output and the errors; if that fails too,
+    StructuredOutputError is raised.
+    """
+    kind = request_kind(session_id)
+    prompt = message + schema_instruction(schema)
+    profile = profiles.resolve(profile_name, kind)
+    routed = route_model(session_id, prompt, profile)
+    if microbatcher is not None and kind in MICROBATCH_KINDS and sessions.is_one_shot(session_id):
+        result = await batched_structured(session_id, message, schema, profile, routed)
+        if result is not None:
+            return result
     
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    response = await get_response(session_id, prompt, profile_name, routed)
+    try:
+        data = parse(response, schema)
+        STRUCTURED.inc(kind=kind, result='ok')
+        return {'response': response, 'data': data, 'repaired': False}
+    except StructuredOutputError as e:
+        errors = e.errors
     
-    def do_POST(self):
+    result = None
+    if routed != profile.model:
+        tiers.quality_fallback(kind)
+        response = await get_response(session_id, prompt, profile_name, profile.model)
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
-            
-            session_id = data.get('sessionId', 'default')
-            message = data.get('message', '')
-            
-            if not message:
-                self._send_json(400, {'error': 'Message is required'})
-                return
-            
-            # Run async function
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            result = {'response': response, 'data': parse(response, schema), 'repaired': False}
+            STRUCTURED.inc(kind=kind, result='escalated')
+        except StructuredOutputError as e:
+            errors = e.errors
+    
+    if result is None:
+        repaired = await get_response(f'repair-{kind}-{uuid.uuid4().hex}',
+                                      repair_prompt(response, errors, schema))
+        try:
+            result = {'response': repaired, 'data': parse(repaired, schema), 'repaired': True}
+        except StructuredOutputError:
+            STRUCTURED.inc(kind=kind, result='failed')
+            raise
+        STRUCTURED.inc(kind=kind, result='repaired')
+    
+    # Don't pay for the escalation or repair again when the same one-shot
+    # prompt repeats (it will be routed the same way)
+    key = one_shot_cache_key(session_id, prompt, profile, routed)
+    if key:
+        await response_cache.put(key, json.dumps(result['data']))
+    return result
+
+
+async def batched_structured(session_id: str, message: str, schema: dict, profile,
+                             model: str):
+    """A structured reply by way of the micro-batcher, or None to ask on its own"""
+    kind = request_kind(session_id)
+    prompt = message + schema_instruction(schema)
+    key = one_shot_cache_key(session_id, prompt, profile, model)
+    if key:
+        cached = await response_cache.get(key)
+        if cached is not None:
             try:
-                response = loop.run_until_complete(get_response(session_id, message))
-            finally:
-                loop.close()
-            
-            self._send_json(200, {
+                data = parse(cached, schema)
+            except StructuredOutputError:
+                return None
+            STRUCTURED.inc(kind=kind, result='ok')
+            return {'response': cached, 'data': data, 'repaired': False}
+    
+    # Charged up front at the unbatched size, as a call of its own would be
+    prompt_tokens = profile.prompt_tokens + count_tokens(prompt)
+    admit_tokens(None, prompt_tokens)
+    batch_key = (kind, profile.name, model, json.dumps(schema, sort_keys=True))
+    with span('microbatch'):
+        data = await microbatcher.submit(batch_key, (message, schema, request_usage()))
+    if data is None:
+        # The call on its own is admitted and charged again, so drop this charge
+        ledger.refund(None, request_usage().caller, prompt_tokens)
+        return None
+    STRUCTURED.inc(kind=kind, result='batched')
+    response = json.dumps(data)
+    if key:
+        await response_cache.put(key, response)
+    return {'response': response, 'data': data, 'repaired': False}
+
+
+async def run_structured_batch(key: tuple, items: list) -> list:
+    """Send micro-batched requests as one call; each gets its data, or None to go alone"""
+    kind, profile_name, model, _ = key
+    if len(items) == 1:
+        MICROBATCHED.inc(kind=kind, result='solo')
+        return [None]
+    messages = [message for message, _, _ in items]
+    schema = items[0][1]
+    profile = profiles.get(profile_name)
+    # The reply carries one result per request, so it gets each one's output allowance
+    batch_profile = Profile(profile.name, profile.system_prompt, profile.model_provider,
+                            profile.model_name,
+                            max_tokens=profile.max_tokens and profile.max_tokens * len(items),
+                            temperature=profile.temperature, pinned=profile.pinned)
+    
+    # Items were routed one by one; the packed prompt may be past the fast
+    # tier's input limit, so the batch is routed again as a whole
+    session_id = f'{kind}-batch-{uuid.uuid4().hex}'
+    prompt = pack(messages, schema)
+    if model != profile.model:
+        model = route_model(session_id, prompt, profile)
+    
+    # The call itself is charged to no one; each request's share is below
+    current_usage.set(Usage())
+    response = await send_turn(session_id, prompt, batch_profile, model)
+    results = unpack(response, schema, len(items))
+    MICROBATCH_SIZE.observe(len(items), kind=kind)
+    
+    batch = request_usage()
+    weights = [count_tokens(message) for message in messages]
+    total = sum(weights) or 1
+    for (_, _, usage), weight, data in zip(items, weights, results):
+        prompt_tokens = round(batch.prompt_tokens * weight / total)
+        completion_tokens = round(batch.completion_tokens * weight / total)
+        usage.add(prompt_tokens, completion_tokens, model)
+        ledger.complete(None, usage.caller, completion_tokens)
+        profile.record(prompt_tokens, completion_tokens)
+        MICROBATCHED.inc(kind=kind, result='batched' if data is not None else 'fallback')
+    return results
+
+
+def take_chat(session, model: str):
+    """The chat for one attempt: the session's own on the first try, else a fresh one
+    
+    A chat whose call failed may have kept the unanswered message in its
+    history, so retries, hedges and fallback-model calls never reuse it.
+    Until a winning chat is installed, session.chat is None and the next
+    turn starts from the transcript.
+    """
+    chat = session.chat
+    if chat is not None and model == session.model:
+        session.chat = None
+        return chat
+    return fresh_chat(session, model)
+
+
+def keep_chat(session, chat, model: str):
+    # A fallback-model chat answers this turn only; the next one goes back
+    # to the session's model, rebuilt from the transcript
+    session.chat = chat if model == session.model else None
+
+
+async def send_upstream(session, message: str) -> str:
+    """One turn upstream with retries, hedging and the circuit breaker (slot held)"""
+    controller = admission_for(provider_of(session.model))
+    
+    async def attempt(model):
+        chat = take_chat(session, model)
+        return chat, model, await chat.send(message)
+    
+    chat, model, response = await resilience.call(
+        attempt, session.model, request_kind(session.session_id),
+        can_hedge=controller.has_spare, hedge_slot=controller.admit)
+    keep_chat(session, chat, model)
+    return response
+
+
+async def stream_upstream(session, message: str):
+    """Yield a turn's reply deltas; failures before the first delta are retried
+    
+    Once text has reached the client the attempt can't be replaced, so
+    streamed turns are never hedged and a later failure is final.
+    """
+    async def attempt(model):
+        chat = take_chat(session, model)
+        deltas = chat.stream(message)
+        try:
+            first = await anext(deltas)
+        except StopAsyncIteration:
+            first = ''
+        return chat, model, deltas, first
+    
+    chat, model, deltas, first = await resilience.call(
+        attempt, session.model, request_kind(session.session_id))
+    try:
+        if first:
+            yield first
+        async for delta in deltas:
+            yield delta
+    except Exception as e:
+        if is_retryable(e):
+            resilience.breaker(model).failure()
+        raise
+    keep_chat(session, chat, model)
+
+
+async def send_turn(session_id: str, message: str, profile=None, model: str = None) -> str:
+    """Send one turn to the model on the session's chat"""
+    with span('session'):
+        await restore_session(session_id, profile)
+        session = open_session(session_id, profile, model)
+    cached = await cached_first_turn(session, message)
+    if cached is not None:
+        return cached
+    await enforce_prompt_budget(session, message)
+    admit_turn(session, message)
+    
+    async with upstream_turn(session):
+        async with upstream_call(request_kind(session_id), session.model):
+            response = await send_upstream(session, message)
+        finish_turn(session, message, response)
+    return response
+
+
+async def sweep_sessions(app: web.Application):
+    """Periodically drop idle sessions so memory stays flat"""
+    async def sweeper():
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            sessions.sweep()
+    
+    task = asyncio.create_task(sweeper())
+    yield
+    task.cancel()
+
+
+async def run_journal(app: web.Application):
+    """Open the session journal, prune it periodically and flush it on shutdown"""
+    if journal is None:
+        yield
+        return
+    started = time.perf_counter()
+    await journal.open()
+    print(f"Opened session journal {journal.path} in {time.perf_counter() - started:.3f}s",
+          file=sys.stderr)
+    
+    async def pruner():
+        while True:
+            await asyncio.sleep(JOURNAL_PRUNE_INTERVAL)
+            try:
+                await journal.prune()
+            except Exception as e:
+                print(f"Session journal prune failed: {e}", file=sys.stderr)
+    
+    task = asyncio.create_task(pruner())
+    yield
+    task.cancel()
+    await journal.close()
+
+
+async def warm_up():
+    """Load the model client and, for AI_WARMUP=request, open an upstream connection"""
+    await provider.warm_up()
+    chat = new_chat(f'warmup-{uuid.uuid4().hex}', profiles.get('chat'), 'Reply with the single word OK.')
+    if WARMUP_MODE == 'request':
+        async with upstream_call('warmup'):
+            await chat.send('OK?')
+
+
+async def start_warm_up(app: web.Application):
+    """Warm up in the background so /healthz answers while /readyz waits"""
+    async def warmer():
+        started = time.perf_counter()
+        while True:
+            readiness['phase'] = 'warming'
+            try:
+                if WARMUP_MODE != 'off':
+                    await warm_up()
+                else:
+                    provider.check()
+                break
+            except Exception as e:
+                readiness['error'] = str(e)
+                print(f"Warm-up failed, retrying in {WARMUP_RETRY:g}s: {e}", file=sys.stderr)
+                await asyncio.sleep(WARMUP_RETRY)
+        readiness.update(
+            ready=True, phase='ready', error=None,
+            warmupSeconds=round(time.perf_counter() - started, 4),
+            startupSeconds=round(time.perf_counter() - PROCESS_STARTED, 4))
+        print(f"AI Service ready in {readiness['startupSeconds']:.2f}s "
+              f"(imports {readiness['importSeconds']:.2f}s, "
+              f"warm-up {readiness['warmupSeconds']:.2f}s)", file=sys.stderr)
+    
+    task = asyncio.create_task(warmer())
+    yield
+    # Stop advertising readiness while shutting down
+    readiness.update(ready=False, phase='stopping')
+    task.cancel()
+
+
+async def close_provider(app: web.Application):
+    """Close the provider's shared upstream connections on shutdown"""
+    yield
+    await provider.close()
+
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+}
+
+
+def json_response(status: int, data: dict, headers: dict = None) -> web.Response:
+    """Build a JSON response with CORS headers"""
+    with span('serialize'):
+        return web.json_response(data, status=status, headers={
+            'Access-Control-Allow-Origin': '*',
+            **(headers or {})
+        })
+
+
+async def read_json(request: web.Request):
+    """Read and decode a request's JSON body, which must be an object"""
+    with span('parse'):
+        data = await request.json()
+    if not isinstance(data, dict):
+        # Handled like undecodable bodies by every caller
+        raise json.JSONDecodeError('Expected a JSON object', '', 0)
+    return data
+
+
+def overloaded_response(error: Overloaded) -> web.Response:
+    return json_response(error.status, {'error': str(error)}, headers={
+        'Retry-After': str(error.retry_after)
+    })
+
+
+def budget_response(error: BudgetExceeded) -> web.Response:
+    """429 naming the exhausted budget; only the per-minute one is worth retrying"""
+    headers = {'Retry-After': str(error.retry_after)} if error.retry_after else None
+    return json_response(429, {
+        'error': str(error),
+        'budget': error.scope,
+        'limit': error.limit,
+        'used': error.used
+    }, headers=headers)
+
+
+def start_usage(caller: str) -> Usage:
+    """Begin counting the current request's tokens on behalf of caller"""
+    usage = Usage(caller)
+    current_usage.set(usage)
+    return usage
+
+
+async def handle_options(request: web.Request) -> web.Response:
+    return web.Response(status=200, headers=CORS_HEADERS)
+
+
+async def stream_cached(stream: EventStream, session_id: str, response: str) -> web.StreamResponse:
+    """Send a cached reply as one token frame and a done frame"""
+    await stream.prepare()
+    await stream.token(response)
+    await stream.send('done', {
+        'response': response,
+        'sessionId': session_id,
+        'usage': request_usage().as_dict(),
+        'cached': True
+    })
+    await stream.close()
+    return stream.response
+
+
+async def handle_stream(request: web.Request, session_id: str, message: str,
+                        fmt: str, profile_name: str = None) -> web.StreamResponse:
+    """Stream token frames, then a final done frame with the session and usage"""
+    profile = profiles.resolve(profile_name, request_kind(session_id))
+    model = route_model(session_id, message, profile)
+    key = one_shot_cache_key(session_id, message, profile, model)
+    cached = await response_cache.get(key) if key else None
+    stream = EventStream(request, fmt)
+    
+    if cached is not None:
+        return await stream_cached(stream, session_id, cached)
+    
+    # Admission happens before any bytes are sent so an overloaded service
+    # can still answer with a plain 429/503
+    with span('session'):
+        await restore_session(session_id, profile)
+        session = open_session(session_id, profile, model)
+    cached = await cached_first_turn(session, message)
+    if cached is not None:
+        return await stream_cached(stream, session_id, cached)
+    await enforce_prompt_budget(session, message)
+    admit_turn(session, message)
+    async with upstream_turn(session):
+        await stream.prepare()
+        try:
+            parts = []
+            async with upstream_call(request_kind(session_id), session.model):
+                async for delta in stream_upstream(session, message):
+                    parts.append(delta)
+                    await stream.token(delta)
+            response = ''.join(parts)
+            finish_turn(session, message, response)
+            if key:
+                await response_cache.put(key, response)
+            await stream.send('done', {
                 'response': response,
-                'sessionId': session_id
+                'sessionId': session_id,
+                'usage': request_usage().as_dict()
             })
-            
+        except ConnectionResetError:
+            # Client went away mid-stream; nothing left to write to
+            return stream.response
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            await stream.send('error', {'error': str(e)})
+    
+    await stream.close()
+    return stream.response
+
+
+async def handle_chat(request: web.Request) -> web.StreamResponse:
+    """POST {sessionId, message[, stream][, profile][, caller]} -> {response, sessionId, usage}
+    
+    With `stream: true` (or `Accept: text/event-stream`) the reply is sent as
+    Server-Sent Events; `stream: "ndjson"` (or `Accept: application/x-ndjson`)
+    sends newline-delimited JSON frames instead. `profile` picks a prompt
+    profile; by default it follows the session ID prefix. Tokens are charged
+    to `caller` (falling back to the session) for the per-minute budget.
+    """
+    # The kind follows from the sessionId; until that's read (and for bodies
+    # rejected before then) the request is still counted
+    request['kind'] = UNKNOWN_KIND
+    try:
+        try:
+            data = await read_json(request)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return json_response(400, {'error': 'Invalid JSON body'})
+        
+        session_id = data.get('sessionId', 'default')
+        message = data.get('message', '')
+        
+        if not isinstance(session_id, str) or not session_id:
+            return json_response(400, {'error': 'sessionId must be a non-empty string'})
+        request['kind'] = request_kind(session_id)
+        if not isinstance(message, str):
+            return json_response(400, {'error': 'message must be a string'})
+        if not message:
+            return json_response(400, {'error': 'Message is required'})
+        
+        usage = start_usage(str(data.get('caller') or f'session:{session_id}'))
+        profile_name = data.get('profile')
+        if profile_name is not None and not isinstance(profile_name, str):
+            return json_response(400, {'error': 'profile must be a string'})
+        if profile_name and profile_name not in profiles:
+            return json_response(400, {'error': f"Unknown profile '{profile_name}'"})
+        
+        schema = data.get('schema')
+        if schema is not None:
+            if not isinstance(schema, dict):
+                return json_response(400, {'error': 'schema must be a JSON Schema object'})
+            # Structured replies are only useful whole, so they're never streamed
+            result = await get_structured(session_id, message, schema, profile_name)
+            return json_response(200, {**result, 'sessionId': session_id, 'usage': usage.as_dict()})
+        
+        fmt = requested_format(request, data)
+        if fmt:
+            return await handle_stream(request, session_id, message, fmt, profile_name)
+        
+        response = await get_response(session_id, message, profile_name)
+        
+        return json_response(200, {
+            'response': response,
+            'sessionId': session_id,
+            'usage': usage.as_dict()
+        })
+        
+    except PromptTooLong as e:
+        return json_response(413, {'error': str(e)})
+    except StructuredOutputError as e:
+        return json_response(422, {
+            'error': str(e),
+            'details': e.errors,
+            'response': e.response
+        })
+    except Overloaded as e:
+        return overloaded_response(e)
+    except BudgetExceeded as e:
+        return budget_response(e)
+    except TimeoutError:
+        return json_response(504, {'error': 'Upstream model timed out'})
+    except ProviderError as e:
+        print(f"Upstream error: {e}", file=sys.stderr)
+        return json_response(502, {'error': str(e)})
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return json_response(500, {'error': str(e)})
+
+
+async def handle_batch(request: web.Request) -> web.StreamResponse:
+    """POST {items: [{sessionId, message, schema?}], schema?, concurrency?, stream?, caller?} -> {results}
+    
+    Items are sent upstream with bounded concurrency. Results come back in
+    request order, each carrying either `response` and `usage` or `error`;
+    items with a schema (their own or the batch's) also carry the parsed
+    `data`. When streamed, an `item` frame is sent as each one completes,
+    then a `done` frame.
+    """
+    request['kind'] = 'batch'
+    try:
+        data = await read_json(request)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return json_response(400, {'error': 'Invalid JSON body'})
+    
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return json_response(400, {'error': 'items must be a non-empty list'})
+    if len(items) > BATCH_MAX_ITEMS:
+        return json_response(413, {'error': f'At most {BATCH_MAX_ITEMS} items per batch'})
+    
+    try:
+        concurrency = min(int(data.get('concurrency') or BATCH_CONCURRENCY), BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'concurrency must be an integer'})
+    
+    batch_schema = data.get('schema')
+    caller = data.get('caller')
+    
+    async def run_item(item):
+        if not isinstance(item, dict) or not item.get('message'):
+            raise ValueError('Message is required')
+        if not isinstance(item['message'], str):
+            raise ValueError('message must be a string')
+        session_id = item.get('sessionId') or 'default'
+        if not isinstance(session_id, str):
+            raise ValueError('sessionId must be a string')
+        if not isinstance(item.get('profile') or '', str):
+            raise ValueError('profile must be a string')
+        # Each item runs in its own task, so it gets its own usage
+        usage = start_usage(str(caller or f'session:{session_id}'))
+        schema = item.get('schema', batch_schema)
+        if isinstance(schema, dict):
+            result = await get_structured(session_id, item['message'], schema, item.get('profile'))
+        else:
+            result = {'response': await get_response(session_id, item['message'], item.get('profile'))}
+        return {**result, 'usage': usage.as_dict()}
+    
+    def result_for(index, fields, error):
+        item = items[index] if isinstance(items[index], dict) else {}
+        result = {'index': index, 'sessionId': item.get('sessionId') or 'default'}
+        if isinstance(error, BudgetExceeded):
+            result.update(error=str(error), budget=error.scope)
+        elif error is not None:
+            result['error'] = str(error)
+        else:
+            result.update(fields)
+        return result
+    
+    fmt = requested_format(request, data)
+    if not fmt:
+        results = [None] * len(items)
+        async for index, response, error in fan_out(items, run_item, concurrency):
+            results[index] = result_for(index, response, error)
+        return json_response(200, {'results': results})
+    
+    stream = EventStream(request, fmt)
+    await stream.prepare()
+    failed = 0
+    try:
+        async for index, response, error in fan_out(items, run_item, concurrency):
+            failed += error is not None
+            await stream.send('item', result_for(index, response, error))
+        await stream.send('done', {'count': len(items), 'failed': failed})
+    except ConnectionResetError:
+        return stream.response
+    await stream.close()
+    return stream.response
+
+
+async def handle_summarize_document(request: web.Request) -> web.StreamResponse:
+    """POST {path, maxLength[, stream][, caller]} -> {summary, chunks, levels, usage}
+    
+    Summarizes the whole file with chunked map-reduce instead of a truncated
+    preview. Chunk summaries go through the one-shot response cache, so
+    re-summarizing the same file is nearly free. When streamed, `progress`
+    frames report each completed chunk and merge.
+    """
+    request['kind'] = 'summarize'
+    try:
+        data = await read_json(request)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return json_response(400, {'error': 'Invalid JSON body'})
+    
+    try:
+        path = resolve_document(str(data.get('path') or ''), DOC_ROOTS)
+        max_words = int(data.get('maxLength') or 500)
+        # Scans the whole file, so kept off the event loop
+        await asyncio.to_thread(check_document, path, DOC_MAX_BYTES, DOC_MAX_CHUNKS,
+                                DOC_CHUNK_TOKENS)
+    except DocumentTooLarge as e:
+        return json_response(413, {'error': str(e)})
+    except NotText as e:
+        return json_response(415, {'error': str(e)})
+    except DocumentError as e:
+        return json_response(400, {'error': str(e)})
+    except OSError as e:
+        return json_response(400, {'error': f'Document could not be read: {e.strerror}'})
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'maxLength must be an integer'})
+    
+    usage = start_usage(str(data.get('caller') or f'document:{path}'))
+    
+    async def summarize(prompt):
+        return await get_response(f'summarize-doc-{uuid.uuid4().hex}', prompt)
+    
+    options = dict(max_words=max_words, chunk_tokens=DOC_CHUNK_TOKENS,
+                   concurrency=DOC_CONCURRENCY, fan_in=DOC_FAN_IN)
+    
+    fmt = requested_format(request, data)
+    if not fmt:
+        try:
+            result = await summarize_document(path, summarize, **options)
+        except Overloaded as e:
+            return overloaded_response(e)
+        except BudgetExceeded as e:
+            return budget_response(e)
+        except TimeoutError:
+            return json_response(504, {'error': 'Upstream model timed out'})
+        except ProviderError as e:
+            print(f"Upstream error: {e}", file=sys.stderr)
+            return json_response(502, {'error': str(e)})
         except Exception as e:
             print(f"Error: {e}", file=sys.stderr)
-            self._send_json(500, {'error': str(e)})
+            return json_response(500, {'error': str(e)})
+        return json_response(200, {**result, 'usage': usage.as_dict()})
     
-    def _send_json(self, status, data):
-        self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+    stream = EventStream(request, fmt)
+    await stream.prepare()
     
-    def log_message(self, format, *args):
-        # Log to stderr
-        print(f"AI Service: {format % args}", file=sys.stderr)
+    async def progress(stage, done, total):
+        await stream.send('progress', {'stage': stage, 'done': done, 'total': total})
+    
+    try:
+        result = await summarize_document(path, summarize, progress=progress, **options)
+        await stream.send('done', {**result, 'usage': usage.as_dict()})
+    except ConnectionResetError:
+        return stream.response
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        await stream.send('error', {'error': str(e)})
+    await stream.close()
+    return stream.response
+
+
+async def handle_delete_session(request: web.Request) -> web.Response:
+    """POST {sessionId} -> {deleted}; drops the session from memory and the journal"""
+    try:
+        data = await read_json(request)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return json_response(400, {'error': 'Invalid JSON body'})
+    
+    session_id = data.get('sessionId')
+    if not session_id or not isinstance(session_id, str):
+        return json_response(400, {'error': 'sessionId is required'})
+    deleted = sessions.discard(session_id)
+    if journal is not None:
+        journal.delete(session_id)
+    return json_response(200, {'deleted': deleted})
+
+
+async def handle_route(request: web.Request) -> web.Response:
+    """POST {task, text} -> {task, local, confidence, result}
+    
+    `local: false` means the local answer wasn't confident enough and the
+    caller should ask the model instead.
+    """
+    request['kind'] = 'route'
+    try:
+        data = await read_json(request)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return json_response(400, {'error': 'Invalid JSON body'})
+    
+    task = data.get('task')
+    text = str(data.get('text') or '')
+    if task not in ('suggest', 'classify'):
+        return json_response(400, {'error': 'task must be suggest or classify'})
+    if classifier is None:
+        ROUTED.inc(task=task, result='fallback')
+        return json_response(200, {'task': task, 'local': False, 'confidence': 0.0})
+    
+    started = time.perf_counter()
+    result, score = classifier.suggest(text) if task == 'suggest' else classifier.classify(text)
+    ROUTER_LATENCY.observe(time.perf_counter() - started, task=task)
+    local = score >= ROUTER_THRESHOLD
+    ROUTED.inc(task=task, result='local' if local else 'fallback')
+    return json_response(200, {
+        'task': task,
+        'local': local,
+        'confidence': round(score, 4),
+        'result': result if local else None
+    })
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """GET /metrics -> Prometheus text exposition"""
+    return web.Response(body=metrics.render().encode('utf-8'), headers={
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'
+    })
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    """GET /healthz -> 200 while the event loop is serving requests"""
+    return json_response(200, {
+        'status': 'ok',
+        'uptime': round(time.perf_counter() - PROCESS_STARTED, 1)
+    })
+
+
+async def handle_readyz(request: web.Request) -> web.Response:
+    """GET /readyz -> 200 once warm-up has succeeded, otherwise 503"""
+    if readiness['ready']:
+        return json_response(200, {'status': 'ready', **readiness})
+    return json_response(503, {'status': readiness['phase'], **readiness},
+                         headers={'Retry-After': str(max(1, int(WARMUP_RETRY)))})
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """Count and time requests whose handler tagged them with a route kind, and trace them"""
+    started = time.monotonic()
+    request['request_id'] = request_id_from(request.headers.get('X-Request-ID'))
+    trace = None
+    if tracer is not None and request.method == 'POST':
+        trace = tracer.start(request['request_id'], request.method, request.path)
+    REQUESTS_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    except asyncio.CancelledError:
+        # Client closed the connection (nginx's convention)
+        status = 499
+        raise
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        kind = request.get('kind')
+        if trace is not None:
+            tracer.finish(trace, status, kind)
+        if kind:
+            REQUESTS.inc(kind=kind, status=status)
+            REQUEST_LATENCY.observe(time.monotonic() - started, kind=kind)
+
+
+async def echo_request_id(request: web.Request, response: web.StreamResponse):
+    # Also reaches streamed replies, whose headers go out before the handler returns
+    request_id = request.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+
+
+async def run_tracer(app: web.Application):
+    """Write kept traces in the background, and whatever is left on shutdown"""
+    if tracer is None:
+        yield
+        return
+    task = asyncio.create_task(tracer.run())
+    yield
+    task.cancel()
+    await tracer.flush()
+
+
+async def handle_profile(request: web.Request) -> web.Response:
+    """POST {seconds} -> sample the event loop for that long, then the hottest functions
+    
+    Only reachable from this host; the Node API exposes it to admins.
+    """
+    try:
+        data = await read_json(request)
+        seconds = float(data.get('seconds', 10))
+    except (json.JSONDecodeError, UnicodeDecodeError, TypeError, ValueError, AttributeError):
+        return json_response(400, {'error': 'Expected {"seconds": number}'})
+    if not seconds > 0:
+        return json_response(400, {'error': 'seconds must be positive'})
+    try:
+        return json_response(200, await profiler.profile(seconds))
+    except ProfilerBusy as e:
+        return json_response(409, {'error': str(e)})
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    """GET /stats -> session store, admission, cache and token budget counters"""
+    return json_response(200, {
+        'sessions': sessions.stats(),
+        'admission': {name: ctl.stats() for name, ctl in admission.items()},
+        'responseCache': response_cache.stats() if response_cache is not None else None,
+        'answerCache': answer_cache.stats() if answer_cache is not None else None,
+        'profiles': profiles.stats(),
+        'sessionStore': await journal.stats() if journal is not None else None,
+        'tokenBudgets': ledger.stats(),
+        'resilience': resilience.stats(),
+        'tiers': tiers.stats() if tiers is not None else None,
+        'microbatch': microbatcher.stats() if microbatcher is not None else None,
+        'tracing': tracer.stats() if tracer is not None else None,
+        'profiler': profiler.stats(),
+        'upstreamPool': provider.pool.stats() if provider.pool else None
+    })
+
+
+def create_app() -> web.Application:
+    """Build the long-lived aiohttp application"""
+    app = web.Application(middlewares=[metrics_middleware])
+    app.on_response_prepare.append(echo_request_id)
+    app.cleanup_ctx.append(sweep_sessions)
+    app.cleanup_ctx.append(run_journal)
+    app.cleanup_ctx.append(run_tracer)
+    app.cleanup_ctx.append(start_warm_up)
+    app.cleanup_ctx.append(close_provider)
+    app.router.add_get('/healthz', handle_healthz)
+    app.router.add_get('/readyz', handle_readyz)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/stats', handle_stats)
+    app.router.add_post('/batch', handle_batch)
+    app.router.add_post('/summarize/document', handle_summarize_document)
+    app.router.add_post('/route', handle_route)
+    app.router.add_post('/sessions/delete', handle_delete_session)
+    app.router.add_post('/admin/profile', handle_profile)
+    # Any path is accepted, matching the old BaseHTTPRequestHandler behaviour
+    app.router.add_route('OPTIONS', '/{tail:.*}', handle_options)
+    app.router.add_route('POST', '/{tail:.*}', handle_chat)
+    return app
 
 
 if __name__ == '__main__':
     port = int(os.environ.get('AI_SERVICE_PORT', 8002))
-    server = HTTPServer(('127.0.0.1', port), AIHandler)
-    print(f"AI Service running on port {port}", file=sys.stderr)
-    sys.stderr.flush()
-    server.serve_forever()
+    # aiohttp speaks HTTP/1.1 with keep-alive and Content-Length, so routes/ai.js
+    # can reuse one connection for many calls; idle ones close after this
+    keepalive_timeout = env_float('AI_KEEPALIVE_TIMEOUT', 75)
+    worker_count = env_int('AI_WORKERS', 1)
+    worker_socket = env_str(WORKER_ENV)
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format='AI Service: %(message)s'
+    )
+    # handler_cancellation cancels the handler (and its upstream call) as soon
+    # as the client disconnects, so abandoned requests stop using quota
+    if worker_socket:
+        # Child of the router: serve on the socket it gave us
+        app = create_app()
+        app.cleanup_ctx.append(watch_parent)
+        web.run_app(app, path=worker_socket, print=None, handler_cancellation=True,
+                    keepalive_timeout=keepalive_timeout)
+    elif worker_count > 1:
+        pool = WorkerPool(worker_count, [sys.executable, os.path.abspath(__file__)],
+                          sessions.is_one_shot, env_str('AI_WORKER_SOCKET_DIR') or None)
+        print(f"AI Service running on port {port} with {worker_count} workers", file=sys.stderr)
+        sys.stderr.flush()
+        web.run_app(pool.create_app(), host='127.0.0.1', port=port, print=None,
+                    handler_cancellation=True, keepalive_timeout=keepalive_timeout)
+    else:
+        print(f"AI Service running on port {port}", file=sys.stderr)
+        sys.stderr.flush()
+        web.run_app(create_app(), host='127.0.0.1', port=port, print=None,
+                    handler_cancellation=True, keepalive_timeout=keepalive_timeout)
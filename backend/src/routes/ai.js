@@ -4,30 +4,45 @@ const express = require('express');
 const router = express.Router();
 const { v4: uuidv4 } = require('uuid');
 const { AISession, File, Analytics } = require('../models');
-const { optionalAuth } = require('../middleware/auth');
+const { optionalAuth, authenticateAdmin } = require('../middleware/auth');
 const rateLimiter = require('../middleware/rateLimiter');
 const fs = require('fs');
+const path = require('path');
 const http = require('http');
+const aiOptions = require('../config/aiOptions.json');
 
 // AI Service configuration
 const AI_SERVICE_HOST = 'localhost';
 const AI_SERVICE_PORT = 8002;
 
-// Call the Python AI service
-const callAIService = (sessionId, message) => {
+// One keep-alive agent for every call to the AI service, so chat messages
+// reuse open connections instead of paying a TCP handshake each time. Idle
+// sockets are dropped well before the service's 75s keep-alive timeout.
+const aiServiceAgent = new http.Agent({
+  keepAlive: true,
+  maxSockets: parseInt(process.env.AI_SERVICE_MAX_SOCKETS, 10) || 64,
+  maxFreeSockets: 16,
+  timeout: 30000
+});
+
+// POST a JSON payload to the Python AI service; requestId is sent as
+// X-Request-ID so the service's traces line up with this API's access log
+const requestAIService = (servicePath, payload, timeout = 60000, requestId = null) => {
   return new Promise((resolve, reject) => {
-    const data = JSON.stringify({ sessionId, message });
+    const data = JSON.stringify(payload);
     
     const options = {
       hostname: AI_SERVICE_HOST,
       port: AI_SERVICE_PORT,
-      path: '/',
+      agent: aiServiceAgent,
+      path: servicePath,
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'Content-Length': Buffer.byteLength(data)
+        'Content-Length': Buffer.byteLength(data),
+        ...(requestId ? { 'X-Request-ID': requestId } : {})
       },
-      timeout: 60000 // 60 second timeout
+      timeout // 60 second default
     };
     
     const req = http.request(options, (res) => {
@@ -43,7 +58,11 @@ const callAIService = (sessionId, message) => {
           if (res.statusCode === 200) {
             resolve(parsed);
           } else {
-            reject(new Error(parsed.error || 'AI service error'));
+            const error = new Error(parsed.error || 'AI service error');
+            error.status = res.statusCode;
+            error.retryAfter = res.headers['retry-after'];
+            error.budget = parsed.budget;
+            reject(error);
           }
         } catch (e) {
           reject(new Error('Invalid response from AI service'));
@@ -65,6 +84,148 @@ const callAIService = (sessionId, message) => {
   });
 };
 
+// Who the AI service charges a request's tokens to for its per-minute budget
+const aiCaller = (req) => req.user?.userId ? `user:${req.user.userId}` : `ip:${req.ip}`;
+
+// The caller and request ID every AI service call made for req carries
+const aiContext = (req) => ({ caller: aiCaller(req), requestId: req.id });
+
+// Answer a request the AI service refused for exceeding a token budget;
+// returns false for any other error
+const sendBudgetError = (res, error) => {
+  if (!error.budget) return false;
+  if (error.retryAfter) res.set('Retry-After', error.retryAfter);
+  res.status(429).json({
+    error: error.budget === 'session'
+      ? 'This conversation has reached its length limit. Please start a new chat to continue.'
+      : 'You\'re sending requests too quickly. Please wait a minute and try again.'
+  });
+  return true;
+};
+
+// Call the Python AI service; with a JSON Schema the service validates the
+// reply (repairing it once if needed) and resolves with the parsed `data`.
+// Every reply carries its token `usage`.
+const callAIService = (sessionId, message, { schema, caller, requestId } = {}) =>
+  requestAIService('/', { sessionId, message, schema, caller }, 60000, requestId);
+
+// Send many { sessionId, message } items in one round trip; resolves with
+// per-item results in request order, each holding `response` (and `data`
+// when a schema is given) or `error`
+const callAIServiceBatch = async (items, { schema, caller, requestId } = {}) => {
+  const { results } = await requestAIService('/batch', { items, schema, caller }, 60000, requestId);
+  return results;
+};
+
+// Ask the AI service's local TF-IDF router to answer a suggest/classify
+// task; resolves with its result, or null when the model should be asked
+const routeLocally = async (task, text, requestId) => {
+  try {
+    const routed = await requestAIService('/route', { task, text }, 2000, requestId);
+    return routed.local ? routed.result : null;
+  } catch (error) {
+    return null;
+  }
+};
+
+// Stream a reply from the Python AI service as Server-Sent Events.
+// Raw frames are piped through to `res` as they arrive; resolves with the
+// final `done` payload ({ response, sessionId, usage }) once the stream ends.
+const streamAIService = (sessionId, message, res, { caller, requestId } = {}) => {
+  return new Promise((resolve, reject) => {
+    const data = JSON.stringify({ sessionId, message, stream: true, caller });
+    
+    const options = {
+      hostname: AI_SERVICE_HOST,
+      port: AI_SERVICE_PORT,
+      agent: aiServiceAgent,
+      path: '/',
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Content-Length': Buffer.byteLength(data),
+        'Accept': 'text/event-stream',
+        ...(requestId ? { 'X-Request-ID': requestId } : {})
+      },
+      timeout: 60000
+    };
+    
+    const req = http.request(options, (aiRes) => {
+      if (aiRes.statusCode !== 200) {
+        let body = '';
+        aiRes.setEncoding('utf8');
+        aiRes.on('data', (chunk) => { body += chunk; });
+        aiRes.on('end', () => {
+          let parsed = {};
+          try { parsed = JSON.parse(body); } catch (e) { /* not JSON */ }
+          const error = new Error(parsed.error || `AI service error (${aiRes.statusCode})`);
+          error.status = aiRes.statusCode;
+          error.retryAfter = aiRes.headers['retry-after'];
+          error.budget = parsed.budget;
+          reject(error);
+        });
+        return;
+      }
+      
+      let buffer = '';
+      let done = null;
+      let failed = null;
+      
+      aiRes.setEncoding('utf8');
+      aiRes.on('data', (chunk) => {
+        res.write(chunk);
+        
+        // Keep an eye on complete frames for the final payload
+        buffer += chunk;
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = (frame.match(/^event: (.*)$/m) || [])[1];
+          const payload = (frame.match(/^data: (.*)$/m) || [])[1];
+          if (event === 'done' && payload) {
+            done = JSON.parse(payload);
+          } else if (event === 'error') {
+            failed = new Error(payload ? JSON.parse(payload).error : 'AI service error');
+            // The client has already been sent this frame
+            failed.forwarded = true;
+          }
+        }
+      });
+      
+      aiRes.on('end', () => {
+        if (done) resolve(done);
+        else reject(failed || new Error('AI stream ended early'));
+      });
+    });
+    
+    // Stop the upstream generation if the browser disconnects
+    res.on('close', () => req.destroy());
+    
+    req.on('error', (e) => {
+      reject(new Error(`AI service unavailable: ${e.message}`));
+    });
+    
+    req.on('timeout', () => {
+      req.destroy();
+      reject(new Error('AI service timeout'));
+    });
+    
+    req.write(data);
+    req.end();
+  });
+};
+
+// Summarize a whole stored file; the AI service reads it from disk and
+// summarizes it chunk by chunk, so nothing is truncated
+const summarizeDocument = (storagePath, maxLength, { caller, requestId } = {}) => {
+  return requestAIService('/summarize/document', {
+    path: path.resolve(storagePath),
+    maxLength,
+    caller
+  }, 180000, requestId);
+};
+
 // Extract text from file (simplified)
 const extractText = async (fileId) => {
   const file = await File.findOne({ fileId });
@@ -90,7 +251,7 @@ router.post('/chat', rateLimiter.ai, optionalAuth, async (req, res) => {
     const sid = sessionId || uuidv4();
 
     // Call Python AI service
-    const aiResponse = await callAIService(sid, message);
+    const aiResponse = await callAIService(sid, message, aiContext(req));
 
     // Save to database for persistence
     let session = await AISession.findOne({ sessionId: sid });
@@ -108,6 +269,8 @@ router.post('/chat', rateLimiter.ai, optionalAuth, async (req, res) => {
       { role: 'user', content: message, timestamp: new Date() },
       { role: 'assistant', content: aiResponse.response, timestamp: new Date() }
     );
+    session.tokensUsed += aiResponse.usage?.totalTokens || 0;
+    session.model = aiResponse.usage?.model || session.model;
     session.lastActivity = new Date();
     await session.save();
 
@@ -115,7 +278,7 @@ router.post('/chat', rateLimiter.ai, optionalAuth, async (req, res) => {
     await Analytics.create({
       event: 'ai_chat',
       userId: req.user?.userId,
-      details: { sessionId: sid }
+      details: { sessionId: sid, tokens: aiResponse.usage?.totalTokens }
     }).catch(() => {});
 
     res.json({
@@ -125,6 +288,16 @@ router.post('/chat', rateLimiter.ai, optionalAuth, async (req, res) => {
   } catch (error) {
     console.error('AI Chat error:', error);
     
+    if (sendBudgetError(res, error)) return;
+    
+    // The AI service is shedding load; pass its back-off hint along
+    if (error.retryAfter) {
+      res.set('Retry-After', error.retryAfter);
+      return res.status(503).json({
+        error: 'The AI assistant is busy right now. Please try again in a few seconds.'
+      });
+    }
+    
     // Return user-friendly error
     res.status(500).json({ 
       error: 'I\'m having trouble connecting right now. Please try again in a moment, or browse our tools and bundles directly.' 
@@ -132,6 +305,89 @@ router.post('/chat', rateLimiter.ai, optionalAuth, async (req, res) => {
   }
 });
 
+// POST /api/ai/chat/stream - Chat endpoint streaming tokens as Server-Sent Events
+router.post('/chat/stream', rateLimiter.ai, optionalAuth, async (req, res) => {
+  const { message, sessionId } = req.body;
+
+  if (!message) {
+    return res.status(400).json({ error: 'Message is required' });
+  }
+
+  const sid = sessionId || uuidv4();
+
+  res.writeHead(200, {
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no'
+  });
+  res.flushHeaders();
+
+  try {
+    const aiResponse = await streamAIService(sid, message, res, aiContext(req));
+    res.end();
+
+    // Save to database for persistence
+    let session = await AISession.findOne({ sessionId: sid });
+    
+    if (!session) {
+      session = new AISession({
+        sessionId: sid,
+        userId: req.user?.userId,
+        messages: []
+      });
+    }
+
+    session.messages.push(
+      { role: 'user', content: message, timestamp: new Date() },
+      { role: 'assistant', content: aiResponse.response, timestamp: new Date() }
+    );
+    session.tokensUsed += aiResponse.usage?.totalTokens || 0;
+    session.model = aiResponse.usage?.model || session.model;
+    session.lastActivity = new Date();
+    await session.save();
+
+    await Analytics.create({
+      event: 'ai_chat',
+      userId: req.user?.userId,
+      details: { sessionId: sid, stream: true, tokens: aiResponse.usage?.totalTokens }
+    }).catch(() => {});
+  } catch (error) {
+    console.error('AI Chat stream error:', error);
+    
+    if (!res.writableEnded && error.forwarded) {
+      res.end();
+    } else if (!res.writableEnded) {
+      let message = 'I\'m having trouble connecting right now. Please try again in a moment, or browse our tools and bundles directly.';
+      if (error.budget === 'session') {
+        message = 'This conversation has reached its length limit. Please start a new chat to continue.';
+      } else if (error.budget) {
+        message = 'You\'re sending requests too quickly. Please wait a minute and try again.';
+      }
+      res.write(`event: error\ndata: ${JSON.stringify({ error: message })}\n\n`);
+      res.end();
+    }
+  }
+});
+
+const SUGGEST_OPTIONS = aiOptions.suggestOptions
+  .map(option => `- ${option.id}: ${option.description}`)
+  .join('\n');
+
+const SUGGEST_SCHEMA = {
+  type: 'array',
+  minItems: 1,
+  maxItems: 3,
+  items: {
+    type: 'object',
+    required: ['serviceId', 'reason'],
+    properties: {
+      serviceId: { type: 'string', enum: aiOptions.suggestOptions.map(option => option.id) },
+      reason: { type: 'string' }
+    }
+  }
+};
+
 // POST /api/ai/suggest - Suggest services based on user's situation
 router.post('/suggest', rateLimiter.ai, optionalAuth, async (req, res) => {
   try {
@@ -139,39 +395,27 @@ router.post('/suggest', rateLimiter.ai, optionalAuth, async (req, res) => {
 
     const suggestions = [];
 
-    // If user describes a situation, use AI to suggest bundles
-    if (situation) {
+    // If user describes a situation, suggest bundles locally when the
+    // catalog index is confident, otherwise ask the AI
+    const localSuggestions = situation ? await routeLocally('suggest', situation, req.id) : null;
+    if (localSuggestions) {
+      suggestions.push(...localSuggestions);
+    } else if (situation) {
       try {
         const prompt = `Based on this situation: "${situation}"
 
 Suggest 2-3 relevant FileSolved bundles or tools. Available options:
-- landlord_protection: Housing disputes, unsafe conditions
-- officer_misconduct: Police complaints, civil rights
-- ice_immigration: Immigration documents
-- lawyer_fiduciary: Attorney/trustee disputes
-- evidence_builder: Organize evidence
-- complaint_generator: Create formal complaints
+${SUGGEST_OPTIONS}
 
 Reply with ONLY a JSON array like: [{"serviceId": "id", "reason": "one sentence"}]`;
 
-        const aiResponse = await callAIService('suggest-' + Date.now(), prompt);
-        
-        try {
-          // Extract JSON from response
-          const jsonMatch = aiResponse.response.match(/\[[\s\S]*\]/);
-          if (jsonMatch) {
-            const aiSuggestions = JSON.parse(jsonMatch[0]);
-            suggestions.push(...aiSuggestions);
-          }
-        } catch (parseError) {
-          // Fallback suggestions if AI response can't be parsed
-          suggestions.push(
-            { serviceId: 'evidence_builder', reason: 'Start documenting your situation' },
-            { serviceId: 'complaint_generator', reason: 'Create formal complaints' }
-          );
-        }
+        const aiResponse = await callAIService('suggest-' + Date.now(), prompt, {
+          schema: SUGGEST_SCHEMA,
+          ...aiContext(req)
+        });
+        suggestions.push(...aiResponse.data);
       } catch (aiError) {
-        // Fallback if AI service unavailable
+        // Fallback if AI service unavailable or its reply failed validation
         suggestions.push(
           { serviceId: 'evidence_builder', reason: 'Start documenting your situation' },
           { serviceId: 'complaint_generator', reason: 'Create formal complaints' }
@@ -212,21 +456,65 @@ router.post('/summarize', rateLimiter.ai, optionalAuth, async (req, res) => {
       return res.status(400).json({ error: 'File ID required' });
     }
 
-    const text = await extractText(fileId);
-    
-    const prompt = `Summarize this document in under ${maxLength} words:\n\n${text}`;
-    const aiResponse = await callAIService('summarize-' + Date.now(), prompt);
+    const file = await File.findOne({ fileId });
+    if (!file) {
+      return res.status(404).json({ error: 'File not found' });
+    }
+
+    let result = null;
+    if (fs.existsSync(file.storagePath)) {
+      try {
+        result = await summarizeDocument(file.storagePath, maxLength, aiContext(req));
+      } catch (error) {
+        // The service refuses files it can't summarize whole (binary, too
+        // large, outside its roots) with 4xx; those get the truncated preview
+        if (error.budget || !(error.status >= 400 && error.status < 500)) throw error;
+      }
+    }
+    if (!result) {
+      const text = await extractText(fileId);
+      const prompt = `Summarize this document in under ${maxLength} words:\n\n${text}`;
+      const aiResponse = await callAIService('summarize-' + Date.now(), prompt, aiContext(req));
+      result = { summary: aiResponse.response, usage: aiResponse.usage };
+    }
 
     res.json({
-      summary: aiResponse.response,
-      model: 'gpt-4o'
+      summary: result.summary,
+      // Chunk summaries can come from the AI service's cache, in which case
+      // no model was called
+      model: result.usage?.model || 'gpt-4o'
     });
   } catch (error) {
     console.error('Summarize error:', error);
+    if (sendBudgetError(res, error)) return;
     res.status(500).json({ error: 'Summarization failed' });
   }
 });
 
+const CLASSIFY_CATEGORIES = aiOptions.classifyCategories.map(category => category.id);
+
+const CLASSIFY_FALLBACK = {
+  category: 'other',
+  confidence: 0.5,
+  reasoning: 'Unable to classify document'
+};
+
+const classifyPrompt = (text) => `Classify this document into one of: ${CLASSIFY_CATEGORIES.join(', ')}
+
+Document preview: ${text.substring(0, 2000)}
+
+Respond with JSON only: {"category": "...", "confidence": 0.0-1.0, "reasoning": "..."}`;
+
+const CLASSIFY_SCHEMA = {
+  type: 'object',
+  required: ['category', 'confidence', 'reasoning'],
+  properties: {
+    category: { type: 'string', enum: CLASSIFY_CATEGORIES },
+    confidence: { type: 'number', minimum: 0, maximum: 1 },
+    reasoning: { type: 'string' }
+  }
+};
+
 // POST /api/ai/classify - Classify document type
 router.post('/classify', rateLimiter.ai, optionalAuth, async (req, res) => {
   try {
@@ -236,39 +524,73 @@ router.post('/classify', rateLimiter.ai, optionalAuth, async (req, res) => {
       return res.status(400).json({ error: 'File ID required' });
     }
 
-    const categories = [
-      'invoice', 'receipt', 'contract', 'legal_document', 'lease',
-      'letter', 'report', 'form', 'certificate', 'resume', 
-      'evidence_photo', 'correspondence', 'complaint', 'other'
-    ];
-
     const text = await extractText(fileId);
-    
-    const prompt = `Classify this document into one of: ${categories.join(', ')}
-
-Document preview: ${text.substring(0, 2000)}
+    const local = await routeLocally('classify', text, req.id);
+    if (local) {
+      return res.json(local);
+    }
+    try {
+      const aiResponse = await callAIService('classify-' + Date.now(), classifyPrompt(text), {
+        schema: CLASSIFY_SCHEMA,
+        ...aiContext(req)
+      });
+      res.json(aiResponse.data);
+    } catch (aiError) {
+      // The AI service answers 422 when the reply failed validation twice
+      if (aiError.status !== 422) throw aiError;
+      res.json(CLASSIFY_FALLBACK);
+    }
+  } catch (error) {
+    console.error('Classify error:', error);
+    if (sendBudgetError(res, error)) return;
+    res.status(500).json({ error: 'Classification failed' });
+  }
+});
 
-Respond with JSON only: {"category": "...", "confidence": 0.0-1.0, "reasoning": "..."}`;
+// POST /api/ai/classify/batch - Classify many documents in one AI service call
+router.post('/classify/batch', rateLimiter.ai, optionalAuth, async (req, res) => {
+  try {
+    const { fileIds } = req.body;
 
-    const aiResponse = await callAIService('classify-' + Date.now(), prompt);
+    if (!Array.isArray(fileIds) || fileIds.length === 0) {
+      return res.status(400).json({ error: 'fileIds must be a non-empty array' });
+    }
+    if (fileIds.length > 100) {
+      return res.status(400).json({ error: 'At most 100 files per batch' });
+    }
 
-    try {
-      const jsonMatch = aiResponse.response.match(/\{[\s\S]*\}/);
-      if (jsonMatch) {
-        const result = JSON.parse(jsonMatch[0]);
-        return res.json(result);
+    const texts = await Promise.all(fileIds.map(fileId => extractText(fileId).catch(() => null)));
+    const local = await Promise.all(texts.map(text => text === null ? null : routeLocally('classify', text, req.id)));
+    const stamp = Date.now();
+    const items = [];
+    texts.forEach((text, i) => {
+      if (text !== null && !local[i]) {
+        items.push({ sessionId: `classify-${stamp}-${i}`, message: classifyPrompt(text) });
       }
-    } catch (parseError) {
-      // Fallback
-    }
+    });
+
+    const results = items.length
+      ? await callAIServiceBatch(items, { schema: CLASSIFY_SCHEMA, ...aiContext(req) })
+      : [];
 
+    let next = 0;
     res.json({
-      category: 'other',
-      confidence: 0.5,
-      reasoning: 'Unable to classify document'
+      results: fileIds.map((fileId, i) => {
+        if (texts[i] === null) {
+          return { fileId, error: 'File not found' };
+        }
+        if (local[i]) {
+          return { fileId, ...local[i] };
+        }
+        const result = results[next++];
+        if (result.error) {
+          return { fileId, ...CLASSIFY_FALLBACK };
+        }
+        return { fileId, ...result.data };
+      })
     });
   } catch (error) {
-    console.error('Classify error:', error);
+    console.error('Classify batch error:', error);
     res.status(500).json({ error: 'Classification failed' });
   }
 });
@@ -302,10 +624,15 @@ router.get('/sessions', optionalAuth, async (req, res) => {
 // DELETE /api/ai/sessions/:sessionId - Delete a session
 router.delete('/sessions/:sessionId', optionalAuth, async (req, res) => {
   try {
-    await AISession.deleteOne({ 
+    const result = await AISession.deleteOne({ 
       sessionId: req.params.sessionId,
       ...(req.user ? { userId: req.user.userId } : {})
     });
+    if (result.deletedCount > 0) {
+      // Drop the AI service's in-memory and on-disk copy too; best effort
+      requestAIService('/sessions/delete', { sessionId: req.params.sessionId }, 5000, req.id)
+        .catch(error => console.error('AI session delete error:', error.message));
+    }
     res.json({ success: true });
   } catch (error) {
     console.error('Delete session error:', error);
@@ -313,4 +640,22 @@ router.delete('/sessions/:sessionId', optionalAuth, async (req, res) => {
   }
 });
 
+// POST /api/ai/admin/profile - Profile the AI service's event loop for a
+// fixed window (admins only); resolves once the window has passed
+router.post('/admin/profile', authenticateAdmin, async (req, res) => {
+  try {
+    const seconds = Number(req.body.seconds ?? 10);
+    if (!(seconds > 0 && seconds <= 60)) {
+      return res.status(400).json({ error: 'seconds must be between 0 and 60' });
+    }
+    const result = await requestAIService('/admin/profile', { seconds }, (seconds + 30) * 1000, req.id);
+    res.json(result);
+  } catch (error) {
+    console.error('AI profile error:', error);
+    res.status(error.status === 409 ? 409 : 500).json({
+      error: error.status === 409 ? error.message : 'Profiling failed'
+    });
+  }
+});
+
 module.exports = router;
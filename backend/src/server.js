@@ -7,6 +7,7 @@ const morgan = require('morgan');
 const mongoose = require('mongoose');
 const path = require('path');
 const fs = require('fs');
+const crypto = require('crypto');
 
 // Import routes
 const servicesRoutes = require('./routes/services');
@@ -49,8 +50,19 @@ app.use(cors({
   allowedHeaders: ['Content-Type', 'Authorization', 'X-Requested-With']
 }));
 
-// Logging
-app.use(morgan('combined'));
+// Tag each request with an ID (the caller's X-Request-ID if it looks sane);
+// it is passed on to the AI service so its traces can be matched to this log
+app.use((req, res, next) => {
+  const incoming = req.get('X-Request-ID');
+  req.id = incoming && /^[\w.:-]{1,128}$/.test(incoming) ? incoming : crypto.randomUUID();
+  res.set('X-Request-ID', req.id);
+  next();
+});
+
+// Logging: the combined format plus the request ID and response time
+morgan.token('id', (req) => req.id);
+app.use(morgan(':remote-addr - :remote-user [:date[clf]] ":method :url HTTP/:http-version" '
+  + ':status :res[content-length] ":referrer" ":user-agent" :id :response-time ms'));
 
 // Body parsing
 app.use(express.json({ limit: '50mb' }));
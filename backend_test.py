@@ -11,6 +11,32 @@ from datetime import datetime
 from pathlib import Path
 import tempfile
 import os
+import argparse
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+AI_CHAT_SCENARIOS = [
+    {
+        "message": "My landlord won't fix the heating",
+        "sessionId": "test1",
+        "expected_keywords": ["landlord", "heating", "bundle", "lawyer"]
+    },
+    {
+        "message": "I'm experiencing workplace harassment",
+        "sessionId": "test2", 
+        "expected_keywords": ["workplace", "harassment", "document", "lawyer"]
+    },
+    {
+        "message": "I was harassed by a police officer",
+        "sessionId": "test3",
+        "expected_keywords": ["police", "officer", "misconduct", "lawyer"]
+    }
+]
+
 
 class FileSolvedAPITester:
     def __init__(self, base_url="https://empowerhelp.preview.emergentagent.com/api"):
@@ -20,16 +46,21 @@ class FileSolvedAPITester:
         self.tests_passed = 0
         self.failed_tests = []
         self.session = requests.Session()
+        self.quiet = False
+        self.lock = threading.Lock()
         
     def log_result(self, test_name, success, details=""):
         """Log test result"""
-        self.tests_run += 1
-        if success:
-            self.tests_passed += 1
-            print(f"✅ {test_name}")
-        else:
-            self.failed_tests.append({"test": test_name, "details": details})
-            print(f"❌ {test_name} - {details}")
+        with self.lock:
+            self.tests_run += 1
+            if success:
+                self.tests_passed += 1
+                if not self.quiet:
+                    print(f"✅ {test_name}")
+            else:
+                self.failed_tests.append({"test": test_name, "details": details})
+                if not self.quiet:
+                    print(f"❌ {test_name} - {details}")
     
     def test_health_endpoint(self):
         """Test health check endpoint"""
@@ -306,60 +337,46 @@ class FileSolvedAPITester:
     
     def test_ai_chat(self):
         """Test AI chat endpoint with various scenarios"""
-        test_scenarios = [
-            {
-                "message": "My landlord won't fix the heating",
-                "sessionId": "test1",
-                "expected_keywords": ["landlord", "heating", "bundle", "lawyer"]
-            },
-            {
-                "message": "I'm experiencing workplace harassment",
-                "sessionId": "test2", 
-                "expected_keywords": ["workplace", "harassment", "document", "lawyer"]
-            },
-            {
-                "message": "I was harassed by a police officer",
-                "sessionId": "test3",
-                "expected_keywords": ["police", "officer", "misconduct", "lawyer"]
-            }
-        ]
-        
         all_passed = True
-        for i, scenario in enumerate(test_scenarios):
-            try:
-                response = self.session.post(f"{self.base_url}/ai/chat", json=scenario, timeout=30)
-                success = response.status_code == 200
-                details = f"Status: {response.status_code}"
-                
-                if success:
-                    data = response.json()
-                    ai_response = data.get('response', '')
-                    session_id = data.get('sessionId', '')
-                    
-                    # Check response quality
-                    response_length = len(ai_response)
-                    has_session = bool(session_id)
-                    under_500_words = response_length < 2500  # Rough word count
-                    mentions_lawyer = 'lawyer' in ai_response.lower()
-                    
-                    details += f", Response length: {response_length}, Session: {has_session}, Under 500 words: {under_500_words}, Mentions lawyer: {mentions_lawyer}"
-                    
-                    if not (has_session and under_500_words and mentions_lawyer):
-                        success = False
-                        details += " - Quality checks failed"
-                else:
-                    details += f", Error: {response.text[:100]}"
-                
-                self.log_result(f"AI Chat Scenario {i+1} ({scenario['message'][:30]}...)", success, details)
-                if not success:
-                    all_passed = False
-                    
-            except Exception as e:
-                self.log_result(f"AI Chat Scenario {i+1}", False, f"Exception: {str(e)}")
+        for i, scenario in enumerate(AI_CHAT_SCENARIOS):
+            if not self.test_ai_chat_scenario(i, scenario):
                 all_passed = False
-        
         return all_passed
     
+    def test_ai_chat_scenario(self, i, scenario):
+        """Test one AI chat scenario"""
+        try:
+            payload = {"message": scenario["message"], "sessionId": scenario["sessionId"]}
+            response = self.session.post(f"{self.base_url}/ai/chat", json=payload, timeout=30)
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                ai_response = data.get('response', '')
+                session_id = data.get('sessionId', '')
+                
+                # Check response quality
+                response_length = len(ai_response)
+                has_session = bool(session_id)
+                under_500_words = response_length < 2500  # Rough word count
+                mentions_lawyer = 'lawyer' in ai_response.lower()
+                
+                details += f", Response length: {response_length}, Session: {has_session}, Under 500 words: {under_500_words}, Mentions lawyer: {mentions_lawyer}"
+                
+                if not (has_session and under_500_words and mentions_lawyer):
+                    success = False
+                    details += " - Quality checks failed"
+            else:
+                details += f", Error: {response.text[:100]}"
+            
+            self.log_result(f"AI Chat Scenario {i+1} ({scenario['message'][:30]}...)", success, details)
+            return success
+            
+        except Exception as e:
+            self.log_result(f"AI Chat Scenario {i+1}", False, f"Exception: {str(e)}")
+            return False
+    
     def test_subscription_plans(self):
         """Test subscription plans endpoint"""
         try:
@@ -515,48 +532,138 @@ class FileSolvedAPITester:
             self.log_result("PayPal Order Creation", False, f"Exception: {str(e)}")
             return False
     
-    def run_all_tests(self):
-        """Run comprehensive test suite"""
-        print("🚀 Starting FileSolved Backend API Tests")
-        print(f"📍 Testing endpoint: {self.base_url}")
-        print("=" * 60)
+    def test_plan(self):
+        """Test graph: name -> (callable, dependencies)
         
-        # Basic connectivity tests
-        health_ok = self.test_health_endpoint()
-        services_ok, services_data = self.test_services_endpoint()
+        Each callable receives the results of its dependencies, in order, and
+        only runs if all of them passed.
+        """
+        plan = {
+            'health': (self.test_health_endpoint, []),
+            'services': (self.test_services_endpoint, []),
+            # Test first 3 services
+            'service_details': (lambda services: all([
+                self.test_service_detail(service.get('id')) for service in services[1][:3]
+            ]), ['services']),
+            
+            # File upload and order flow
+            'upload': (self.test_file_upload, []),
+            'order': (lambda upload: self.test_order_creation(upload[1]), ['upload']),
+            'order_retrieval': (lambda order: self.test_order_retrieval(order[1].get('orderId')), ['order']),
+            'paypal': (lambda order: self.test_paypal_endpoints(order[1].get('orderId')), ['order']),
+            
+            # Admin functionality tests
+            'admin_login': (self.test_admin_login, []),
+            'admin_analytics': (lambda _: self.test_admin_analytics(), ['admin_login']),
+            'admin_orders': (lambda _: self.test_admin_orders(), ['admin_login']),
+            'admin_revenue_summary': (lambda _: self.test_admin_revenue_summary(), ['admin_login']),
+            'admin_users': (lambda _: self.test_admin_users(), ['admin_login']),
+            'admin_errors': (lambda _: self.test_admin_errors(), ['admin_login']),
+            
+            # Subscription system tests
+            'subscription_plans': (self.test_subscription_plans, []),
+            'subscription_flow': (self.test_subscription_flow, []),
+            'subscription_status_existing': (self.test_subscription_status_existing, []),
+            'subscription_access_check': (self.test_subscription_access_check, []),
+        }
         
-        # Test individual service details
-        if services_data:
-            for service in services_data[:3]:  # Test first 3 services
-                self.test_service_detail(service.get('id'))
+        # AI functionality tests, one node per scenario so they run side by side
+        for i, scenario in enumerate(AI_CHAT_SCENARIOS):
+            plan[f'ai_chat_{i + 1}'] = (
+                lambda i=i, scenario=scenario: self.test_ai_chat_scenario(i, scenario), [])
+        return plan
+    
+    @staticmethod
+    def _passed(result):
+        """Tests return either a bool or a (success, data) tuple"""
+        if isinstance(result, tuple):
+            return bool(result[0]) and result[1] is not None
+        return bool(result)
+    
+    def run_plan(self, plan, workers=4):
+        """Run a test graph with up to `workers` tests at once
         
-        # File upload and order flow
-        upload_ok, file_data = self.test_file_upload()
-        order_ok, order_data = False, None
-        if upload_ok and file_data:
-            order_ok, order_data = self.test_order_creation(file_data)
-            if order_ok and order_data:
-                self.test_order_retrieval(order_data.get('orderId'))  # Changed from order_id to orderId
-                self.test_paypal_endpoints(order_data.get('orderId'))  # Changed from order_id to orderId
+        Returns {name: {'result', 'start', 'end', 'skipped'}} with times in
+        seconds from the start of the run.
+        """
+        started = time.perf_counter()
+        runs = {}
+        pending = dict(plan)
+        running = {}
         
-        # Admin functionality tests
-        admin_login_ok = self.test_admin_login()
-        if admin_login_ok:
-            self.test_admin_analytics()
-            self.test_admin_orders()
-            self.test_admin_revenue_summary()
-            self.test_admin_users()
-            self.test_admin_errors()
+        def timed(name, fn, args):
+            start = time.perf_counter() - started
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self.log_result(name, False, f"Exception: {str(e)}")
+                result = False
+            return result, start, time.perf_counter() - started
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            while pending or running:
+                for name, (fn, deps) in list(pending.items()):
+                    if not all(dep in runs for dep in deps):
+                        continue
+                    del pending[name]
+                    if all(self._passed(runs[dep]['result']) for dep in deps):
+                        args = [runs[dep]['result'] for dep in deps]
+                        running[pool.submit(timed, name, fn, args)] = name
+                    else:
+                        # Same as the serial suite: skip tests whose prerequisites failed
+                        now = time.perf_counter() - started
+                        runs[name] = {'result': None, 'start': now, 'end': now, 'skipped': True}
+                
+                if not running:
+                    if pending and not any(all(dep in runs for dep in deps) for _, deps in pending.values()):
+                        raise ValueError(f"Unresolvable test dependencies: {sorted(pending)}")
+                    continue
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result, start, end = future.result()
+                    runs[name] = {'result': result, 'start': start, 'end': end, 'skipped': False}
+        return runs
+    
+    @staticmethod
+    def critical_path(plan, runs):
+        """Longest chain of dependent tests by duration: (seconds, [names])"""
+        best = {}
+        
+        def longest(name):
+            if name not in best:
+                duration = runs[name]['end'] - runs[name]['start']
+                chains = [longest(dep) for dep in plan[name][1]]
+                before = max(chains, default=(0.0, []))
+                best[name] = (before[0] + duration, before[1] + [name])
+            return best[name]
+        
+        return max((longest(name) for name in plan), default=(0.0, []))
+    
+    def run_all_tests(self, workers=4):
+        """Run comprehensive test suite"""
+        print("🚀 Starting FileSolved Backend API Tests")
+        print(f"📍 Testing endpoint: {self.base_url}")
+        print(f"🧵 Workers: {workers}")
+        print("=" * 60)
         
-        # AI functionality tests
-        self.test_ai_chat()
+        plan = self.test_plan()
+        runs = self.run_plan(plan, workers)
         
-        # NEW: Subscription system tests
-        print("\n🔄 Testing Subscription System...")
-        self.test_subscription_plans()
-        self.test_subscription_flow()
-        self.test_subscription_status_existing()
-        self.test_subscription_access_check()
+        # Timing report
+        print("=" * 60)
+        print("⏱️  Test timings:")
+        for name, run in sorted(runs.items(), key=lambda item: item[1]['start']):
+            if run['skipped']:
+                print(f"  {name:<32} skipped")
+            else:
+                print(f"  {name:<32} {run['end'] - run['start']:7.2f}s  (started {run['start']:.2f}s)")
+        wall_time = max((run['end'] for run in runs.values()), default=0.0)
+        serial_time = sum(run['end'] - run['start'] for run in runs.values())
+        path_time, path = self.critical_path(plan, runs)
+        print(f"  Wall time: {wall_time:.2f}s, serial sum: {serial_time:.2f}s")
+        print(f"  Critical path: {path_time:.2f}s ({' → '.join(path)})")
         
         # Print summary
         print("=" * 60)
@@ -571,6 +678,8 @@ class FileSolvedAPITester:
         print(f"\n🎯 Success Rate: {success_rate:.1f}%")
         
         return {
+            'wall_time': round(wall_time, 2),
+            'critical_path': {'seconds': round(path_time, 2), 'tests': path},
             'total_tests': self.tests_run,
             'passed_tests': self.tests_passed,
             'failed_tests': self.failed_tests,
@@ -578,10 +687,305 @@ class FileSolvedAPITester:
             'critical_failures': [f for f in self.failed_tests if any(keyword in f['test'].lower() for keyword in ['health', 'services', 'admin login', 'subscription'])]
         }
 
-def main():
+
+# ============================================================================
+# Benchmark mode: concurrent virtual users running weighted scenario mixes
+# ============================================================================
+
+DEFAULT_MIX = "health=4,services=3,upload_order=1,ai_chat=1,subscription=1"
+
+ID_SEGMENT = re.compile(r'^([0-9a-f]{8}-[0-9a-f-]{27}|[0-9a-f]{24}|[0-9A-Za-z_-]{20,}|\d+)$')
+
+# Routes whose last segment is a slug rather than an ID-looking value
+ENDPOINT_TEMPLATES = [
+    (re.compile(r'^/services/[^/]+$'), '/services/:id'),
+    (re.compile(r'^/orders/[^/]+$'), '/orders/:id'),
+]
+
+
+def endpoint_name(method, url, base_url):
+    """Normalise a request URL to 'METHOD /path' with IDs replaced by :id"""
+    path = urlparse(url).path
+    base_path = urlparse(base_url).path.rstrip('/')
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):] or '/'
+    for pattern, template in ENDPOINT_TEMPLATES:
+        if pattern.match(path):
+            return f"{method.upper()} {template}"
+    segments = [':id' if ID_SEGMENT.match(seg) else seg for seg in path.split('/')]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LatencyRecorder:
+    """Thread-safe collection of per-endpoint latencies and errors"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+    
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+    
+    def summary(self, duration):
+        """Per-endpoint count, error rate, throughput and latency percentiles (ms)"""
+        endpoints = {}
+        with self.lock:
+            for endpoint, values in sorted(self.samples.items()):
+                values = sorted(values)
+                errors = self.errors.get(endpoint, 0)
+                endpoints[endpoint] = {
+                    'count': len(values),
+                    'errors': errors,
+                    'errorRate': round(errors / len(values), 4),
+                    'rps': round(len(values) / duration, 3) if duration else 0.0,
+                    'meanMs': round(sum(values) / len(values) * 1000, 1),
+                    'p50Ms': round(percentile(values, 50) * 1000, 1),
+                    'p95Ms': round(percentile(values, 95) * 1000, 1),
+                    'p99Ms': round(percentile(values, 99) * 1000, 1),
+                    'maxMs': round(values[-1] * 1000, 1),
+                }
+        return endpoints
+
+
+class TimedSession(requests.Session):
+    """requests.Session that reports the wall-clock time of every call"""
+    
+    def __init__(self, recorder, base_url):
+        super().__init__()
+        self.recorder = recorder
+        self.base_url = base_url
+    
+    def request(self, method, url, *args, **kwargs):
+        name = endpoint_name(method, url, self.base_url)
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self.recorder.record(name, time.perf_counter() - start, False)
+            raise
+        # Reading .content makes sure the body download is part of the timing
+        response.content
+        self.recorder.record(name, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+
+class BenchmarkScenarios:
+    """Benchmark flows built from the FileSolvedAPITester checks"""
+    
+    def __init__(self, tester, rng):
+        self.tester = tester
+        self.rng = rng
+        self.service_ids = []
+    
+    def health(self):
+        return self.tester.test_health_endpoint()
+    
+    def services(self):
+        ok, services = self.tester.test_services_endpoint()
+        if services and not self.service_ids:
+            self.service_ids = [s.get('id') for s in services if s.get('id')]
+        if self.service_ids:
+            self.tester.test_service_detail(self.rng.choice(self.service_ids))
+        return ok
+    
+    def upload_order(self):
+        ok, file_data = self.tester.test_file_upload()
+        if ok and file_data:
+            ok, order = self.tester.test_order_creation(file_data)
+            if ok and order:
+                ok = self.tester.test_order_retrieval(order.get('orderId'))
+        return ok
+    
+    def ai_chat(self):
+        # A fresh session per call so virtual users don't queue behind each
+        # other on one conversation
+        payload = {
+            "message": self.rng.choice(AI_CHAT_SCENARIOS)["message"],
+            "sessionId": f"bench-{self.rng.getrandbits(48):012x}"
+        }
+        try:
+            response = self.tester.session.post(f"{self.tester.base_url}/ai/chat", json=payload, timeout=60)
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    def subscription(self):
+        ok = self.tester.test_subscription_plans()
+        self.tester.test_subscription_status_existing()
+        self.tester.test_subscription_access_check()
+        return ok
+
+
+def parse_mix(mix):
+    """Parse 'name=weight,...' into a dict, validating scenario names"""
+    weights = {}
+    for part in mix.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if not hasattr(BenchmarkScenarios, name) or name.startswith('_'):
+            raise ValueError(f"Unknown benchmark scenario: {name}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("Benchmark mix needs at least one positive weight")
+    return weights
+
+
+def run_benchmark(base_url, users=10, ramp_up=5.0, duration=30.0, mix=DEFAULT_MIX, seed=0):
+    """Run virtual users against base_url and return a JSON-serialisable report"""
+    weights = parse_mix(mix)
+    names, weight_values = list(weights), list(weights.values())
+    recorder = LatencyRecorder()
+    scenario_runs = {name: {'runs': 0, 'failed': 0} for name in names}
+    runs_lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + ramp_up + duration
+    
+    def virtual_user(index):
+        rng = random.Random(seed + index)
+        # Spread user start times evenly over the ramp-up period
+        time.sleep(ramp_up * index / max(1, users))
+        tester = FileSolvedAPITester(base_url)
+        tester.quiet = True
+        tester.session = TimedSession(recorder, base_url)
+        scenarios = BenchmarkScenarios(tester, rng)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights=weight_values)[0]
+            try:
+                ok = getattr(scenarios, name)()
+            except Exception:
+                ok = False
+            with runs_lock:
+                scenario_runs[name]['runs'] += 1
+                scenario_runs[name]['failed'] += 0 if ok else 1
+    
+    print(f"🏋️  Benchmark: {users} users, {ramp_up}s ramp-up, {duration}s steady, mix {mix}")
+    threads = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    endpoints = recorder.summary(elapsed)
+    total = sum(e['count'] for e in endpoints.values())
+    errors = sum(e['errors'] for e in endpoints.values())
+    return {
+        'baseUrl': base_url,
+        'startedAt': datetime.now().isoformat(),
+        'config': {'users': users, 'rampUp': ramp_up, 'duration': duration, 'mix': weights, 'seed': seed},
+        'elapsed': round(elapsed, 2),
+        'totals': {
+            'requests': total,
+            'errors': errors,
+            'errorRate': round(errors / total, 4) if total else 0.0,
+            'rps': round(total / elapsed, 3) if elapsed else 0.0,
+        },
+        'scenarios': scenario_runs,
+        'endpoints': endpoints,
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    """List regressions of report against baseline (p95/p99 latency, error rate, throughput)"""
+    regressions = []
+    for endpoint, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        for key in ('p95Ms', 'p99Ms'):
+            # Ignore jitter on very fast endpoints
+            if current[key] > previous[key] * (1 + tolerance) and current[key] - previous[key] > 5:
+                regressions.append(f"{endpoint}: {key} {previous[key]} -> {current[key]}")
+        if current['errorRate'] > previous['errorRate'] + 0.01:
+            regressions.append(f"{endpoint}: errorRate {previous['errorRate']} -> {current['errorRate']}")
+    previous_rps = baseline.get('totals', {}).get('rps', 0)
+    if previous_rps and report['totals']['rps'] < previous_rps * (1 - tolerance):
+        regressions.append(f"total rps {previous_rps} -> {report['totals']['rps']}")
+    return regressions
+
+
+def print_benchmark(report):
+    print("=" * 96)
+    print(f"{'Endpoint':<44}{'count':>7}{'err%':>7}{'rps':>8}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}")
+    for endpoint, stats in report['endpoints'].items():
+        print(f"{endpoint[:43]:<44}{stats['count']:>7}{stats['errorRate'] * 100:>6.1f}%"
+              f"{stats['rps']:>8.2f}{stats['p50Ms']:>9.1f}{stats['p95Ms']:>9.1f}{stats['p99Ms']:>9.1f}")
+    totals = report['totals']
+    print("=" * 96)
+    print(f"📊 {totals['requests']} requests in {report['elapsed']}s, "
+          f"{totals['rps']} req/s, error rate {totals['errorRate'] * 100:.1f}%")
+
+
+PREVIEW_BASE_URL = "https://empowerhelp.preview.emergentagent.com/api"
+LOCAL_BASE_URL = "http://localhost:8001/api"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="FileSolved backend API tests and benchmarks")
+    parser.add_argument('--base-url', help="API to test (default: the preview deployment; "
+                                           "with --benchmark, a local server on port 8001)")
+    parser.add_argument('--workers', type=int, default=4, help="Tests run concurrently by the suite")
+    parser.add_argument('--benchmark', action='store_true', help="Run the concurrent load benchmark")
+    parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument('--ramp-up', type=float, default=5.0, help="Seconds to start all users")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds at full load")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Weighted scenarios, e.g. health=4,ai_chat=1")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default='bench_report.json', help="Where to write the JSON report")
+    parser.add_argument('--baseline', help="Compare against a saved report; exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+    if not args.base_url:
+        # A load test against the shared deployment would pay for real model calls
+        args.base_url = LOCAL_BASE_URL if args.benchmark else PREVIEW_BASE_URL
+    return args
+
+
+def run_benchmark_mode(args):
+    """Run the benchmark, write the report and compare against a baseline"""
+    report = run_benchmark(args.base_url, users=args.users, ramp_up=args.ramp_up,
+                           duration=args.duration, mix=args.mix, seed=args.seed)
+    print_benchmark(report)
+    
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Report written to {args.report}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n🚨 {len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  • {regression}")
+            return 1
+        print(f"\n✅ No regressions against {args.baseline}")
+    return 0
+
+
+def main(argv=None):
     """Main test execution"""
-    tester = FileSolvedAPITester()
-    results = tester.run_all_tests()
+    args = parse_args(argv)
+    if args.benchmark:
+        return run_benchmark_mode(args)
+    
+    tester = FileSolvedAPITester(args.base_url)
+    results = tester.run_all_tests(workers=args.workers)
     
     # Return appropriate exit code
     if results['success_rate'] < 70:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The AI service's modules are imported as the top-level ``ai`` package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
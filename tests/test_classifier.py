@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from ai.classifier import WEAK_CONFIDENCE, LocalClassifier, confidence, load_catalog, load_options
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'backend', 'src', 'config')
+
+# The service's default AI_ROUTER_THRESHOLD
+LOCAL_THRESHOLD = 0.5
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    return LocalClassifier(load_catalog(os.path.join(CONFIG, 'servicesCatalog.js')),
+                           load_options(os.path.join(CONFIG, 'aiOptions.json')))
+
+
+def test_single_term_match_is_weak():
+    assert confidence([('receipt', 0.9, ['thank'])], use_margin=True) == WEAK_CONFIDENCE
+    assert confidence([('receipt', 0.9, ['thank']), ('invoice', 0.1, ['total'])],
+                      use_margin=False) == WEAK_CONFIDENCE
+
+
+def test_lone_category_needs_more_terms():
+    assert confidence([('lease', 0.9, ['security', 'deposit'])], use_margin=True) == WEAK_CONFIDENCE
+    assert confidence([('lease', 0.9, ['lease', 'rent', 'tenant'])], use_margin=True) == 1.0
+
+
+def test_runner_up_with_same_terms_is_weak():
+    ranked = [('word_to_pdf', 0.65, ['convert', 'pdf', 'word']),
+              ('pdf_to_word', 0.60, ['word', 'pdf', 'convert'])]
+    assert confidence(ranked, use_margin=False) == WEAK_CONFIDENCE
+
+
+@pytest.mark.parametrize('text', [
+    'Hi John, see attached. Thanks',
+    'Please find the file below',
+])
+def test_passing_mentions_are_not_classified_locally(classifier, text):
+    _, score = classifier.classify(text)
+    assert score < LOCAL_THRESHOLD
+
+
+@pytest.mark.parametrize('situation', [
+    'convert my pdf to word',
+    'convert word document to pdf',
+    'help with a lease',
+])
+def test_ambiguous_situations_are_not_suggested_locally(classifier, situation):
+    _, score = classifier.suggest(situation)
+    assert score < LOCAL_THRESHOLD
+
+
+@pytest.mark.parametrize('text, category', [
+    ('RECEIPT Total $45.00 paid by card, thank you for your purchase. Tax 3.20', 'receipt'),
+    ('Lease agreement between landlord and tenant, monthly rent, security deposit', 'lease'),
+])
+def test_clear_documents_are_classified_locally(classifier, text, category):
+    result, score = classifier.classify(text)
+    assert result['category'] == category
+    assert score >= LOCAL_THRESHOLD
+
+
+@pytest.mark.parametrize('situation, service_id', [
+    ('my landlord refuses to return my security deposit and ignores repair requests',
+     'landlord_protection'),
+    ('the police officer used excessive force during my arrest', 'officer_misconduct'),
+])
+def test_clear_situations_are_suggested_locally(classifier, situation, service_id):
+    suggestions, score = classifier.suggest(situation)
+    assert suggestions[0]['serviceId'] == service_id
+    assert score >= LOCAL_THRESHOLD
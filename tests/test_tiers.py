@@ -0,0 +1,67 @@
+from ai.tiers import FAST, FULL, TierRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_router(clock, **kwargs):
+    options = dict(fast_kinds=('classify',), latency_target=1.0, min_samples=5,
+                   latency_window=60, probe_share=0.25, clock=clock)
+    options.update(kwargs)
+    return TierRouter('openai/fast', **options)
+
+
+def slow_down(router, kind='summarize', seconds=3.0, count=5):
+    for _ in range(count):
+        router.observe('openai/full', kind, seconds)
+
+
+def test_slow_full_tier_moves_kind_to_fast():
+    router = make_router(FakeClock(), probe_share=0)
+    assert router.pick('summarize', 100) == (FULL, 'kind')
+    slow_down(router)
+    assert router.pick('summarize', 100) == (FAST, 'latency')
+
+
+def test_switched_kind_still_probes_full_tier():
+    router = make_router(FakeClock())
+    slow_down(router)
+    picks = [router.pick('summarize', 100) for _ in range(8)]
+    assert picks.count((FULL, 'probe')) == 2
+    assert picks.count((FAST, 'latency')) == 6
+
+
+def test_recovered_full_tier_wins_traffic_back():
+    clock = FakeClock()
+    router = make_router(clock)
+    slow_down(router)
+    assert router.pick('summarize', 100)[0] == FAST
+
+    # Probes answer quickly, and the slow samples age out of the window
+    clock.now += 30
+    for _ in range(5):
+        router.observe('openai/full', 'summarize', 0.2)
+    assert router.pick('summarize', 100)[0] == FAST
+    clock.now += 31
+    assert router.pick('summarize', 100) == (FULL, 'kind')
+
+
+def test_without_samples_old_slowness_expires():
+    clock = FakeClock()
+    router = make_router(clock, probe_share=0)
+    slow_down(router)
+    assert router.pick('summarize', 100)[0] == FAST
+    clock.now += 61
+    assert router.pick('summarize', 100) == (FULL, 'kind')
+
+
+def test_long_inputs_never_go_fast():
+    router = make_router(FakeClock(), fast_max_tokens=50)
+    slow_down(router)
+    assert router.pick('summarize', 100) == (FULL, 'length')
+    assert router.pick('classify', 100) == (FULL, 'length')